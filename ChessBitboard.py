@@ -0,0 +1,576 @@
+"""
+Bitboard backend for the game state. The position is kept as 12 64-bit integers, one per piece type and color,
+plus occupancy masks. It exposes the same API as ChessEngine.GameState so either one can drive the game.
+Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1.
+"""
+from array import array
+import ChessEngine
+
+# piece i here has code i + 1 in ChessEngine.PIECES
+PIECES = ChessEngine.PIECES[1:]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+WHITE, BLACK = 0, 1
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+ROOK_RAYS = range(0, 4)
+BISHOP_RAYS = range(4, 8)
+
+
+def buildTables() -> tuple:
+    """
+    Precompute the attack tables
+
+    Returns:
+        tuple: (rays, between, knightAttacks, kingAttacks, pawnAttacks) where rays[d][sq] holds every square from sq
+            in direction d, between[a][b] the squares strictly between a and b on a shared ray, knightAttacks[sq] the
+            knight jumps, kingAttacks[sq] the king steps and pawnAttacks[color][sq] the pawn capture squares
+    """
+    rays = [[0] * 64 for _ in DIRECTIONS]
+    between = [[0] * 64 for _ in range(64)]
+    knightAttacks = [0] * 64
+    kingAttacks = [0] * 64
+    pawnAttacks = [[0] * 64, [0] * 64]
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            passed = 0
+            endRow, endCol = r + dr, c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                endSq = endRow * 8 + endCol
+                between[sq][endSq] = passed
+                passed |= 1 << endSq
+                endRow += dr
+                endCol += dc
+            rays[d][sq] = passed
+        for dr, dc in DIRECTIONS:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                kingAttacks[sq] |= 1 << ((r + dr) * 8 + c + dc)
+        for dr, dc in KNIGHT_JUMPS:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                knightAttacks[sq] |= 1 << ((r + dr) * 8 + c + dc)
+        for dc in (-1, 1):
+            if 0 <= c + dc < 8:
+                if r - 1 >= 0:
+                    pawnAttacks[WHITE][sq] |= 1 << ((r - 1) * 8 + c + dc)
+                if r + 1 < 8:
+                    pawnAttacks[BLACK][sq] |= 1 << ((r + 1) * 8 + c + dc)
+    return rays, between, knightAttacks, kingAttacks, pawnAttacks
+
+
+RAYS, BETWEEN, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS = buildTables()
+# rays pointing to lower square indexes meet their first blocker at the most significant bit
+RAY_DESCENDING = [dr * 8 + dc < 0 for dr, dc in DIRECTIONS]
+FULL_BOARD = (1 << 64) - 1
+LAST_RANKS = 0xFF | 0xFF << 56
+# per color: the king's start square and the castling king end squares
+CASTLING_KING = ((60, (62, 58)), (4, (6, 2)))
+
+
+def firstBlocker(d, sq, occupied) -> int:
+    """
+    Get the first occupied square along a ray
+
+    Args:
+        d (int): The ray direction index
+        sq (int): The square the ray starts from
+        occupied (int): The occupancy mask
+
+    Returns:
+        int: The square index, or -1 if the ray is empty
+    """
+    blockers = RAYS[d][sq] & occupied
+    if not blockers:
+        return -1
+    if RAY_DESCENDING[d]:
+        return blockers.bit_length() - 1
+    return (blockers & -blockers).bit_length() - 1
+
+
+def rayAttacks(d, sq, occupied) -> int:
+    """
+    Get the squares a slider reaches along one ray, including the first blocker
+
+    Args:
+        d (int): The ray direction index
+        sq (int): The square the ray starts from
+        occupied (int): The occupancy mask
+
+    Returns:
+        int: The attacked squares
+    """
+    blocker = firstBlocker(d, sq, occupied)
+    if blocker < 0:
+        return RAYS[d][sq]
+    return RAYS[d][sq] ^ RAYS[d][blocker]
+
+
+class BitboardGameState():
+    def __init__(self) -> None:
+        self.pieces = [0] * 12
+        self.occupancy = [0, 0]
+        self.undoStack = ChessEngine.UndoStack()
+        self.setBoard(ChessEngine.GameState().board, True)
+
+    def setBoard(self, board, whiteToMove, castlingRights=None, enPassantSquare=-1, halfmoveClock=0, fullmoveNumber=1) -> None:
+        """
+        Set up an arbitrary position, clearing the move log
+
+        Args:
+            board (_list_): 8 rows of 8 pieces, "--" for empty squares
+            whiteToMove (bool): True if white is to move
+            castlingRights (int, optional): The castling rights bits, taken from the king and rook squares if omitted.
+                Rights the pieces no longer allow are dropped.
+            enPassantSquare (int, optional): The square behind a pawn that just moved two squares, -1 for none
+            halfmoveClock (int, optional): Plies since the last capture or pawn move
+            fullmoveNumber (int, optional): The move number, starting at 1
+        """
+        self.pieces = [0] * 12
+        for r, row in enumerate(board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    self.pieces[PIECE_INDEX[piece]] |= 1 << (r * 8 + c)
+        self.updateOccupancy()
+        self.whiteToMove = whiteToMove
+        fromBoard = ChessEngine.castlingRightsFromBoard(board)
+        self.castlingRights = fromBoard if castlingRights is None else castlingRights & fromBoard
+        self.enPassantSquare = ChessEngine.enPassantTarget(board, whiteToMove, enPassantSquare)
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.undoStack.clear()
+        self.zobristKey = self.computeZobristKey()
+
+    @property
+    def moveLog(self) -> ChessEngine.UndoStack:
+        """
+        The moves played since the last setBoard, read only
+        """
+        return self.undoStack
+
+    def clone(self) -> "BitboardGameState":
+        """
+        Copy the game for analysis without deep copying it, the piece bitboards are one list of 12 integers
+
+        Returns:
+            BitboardGameState: An independent game state, with the same history to undo
+        """
+        gs = BitboardGameState.__new__(BitboardGameState)
+        gs.pieces = self.pieces[:]
+        gs.occupancy = self.occupancy[:]
+        gs.undoStack = self.undoStack.copy()
+        gs.whiteToMove = self.whiteToMove
+        gs.castlingRights = self.castlingRights
+        gs.enPassantSquare = self.enPassantSquare
+        gs.halfmoveClock = self.halfmoveClock
+        gs.fullmoveNumber = self.fullmoveNumber
+        gs.zobristKey = self.zobristKey
+        return gs
+
+    @property
+    def board(self) -> list:
+        """
+        Build the string board view used for rendering and move input
+        """
+        board = [["--"] * 8 for _ in range(8)]
+        for i, bitboard in enumerate(self.pieces):
+            while bitboard:
+                bit = bitboard & -bitboard
+                sq = bit.bit_length() - 1
+                board[sq >> 3][sq & 7] = PIECES[i]
+                bitboard ^= bit
+        return board
+
+    @property
+    def whiteKingLocation(self) -> tuple:
+        return divmod(self.pieces[KING].bit_length() - 1, 8)
+
+    @property
+    def blackKingLocation(self) -> tuple:
+        return divmod(self.pieces[6 + KING].bit_length() - 1, 8)
+
+    def computeZobristKey(self) -> int:
+        """
+        Compute the Zobrist key of the position from scratch, keyed the same way as ChessEngine.GameState
+
+        Returns:
+            int: The 64-bit position key
+        """
+        key = ((0 if self.whiteToMove else ChessEngine.ZOBRIST_BLACK_TO_MOVE) ^ ChessEngine.ZOBRIST_CASTLING[self.castlingRights]
+               ^ ChessEngine.ZOBRIST_EN_PASSANT[self.enPassantSquare])
+        for i, bitboard in enumerate(self.pieces):
+            while bitboard:
+                bit = bitboard & -bitboard
+                key ^= ChessEngine.ZOBRIST_PIECES[(i + 1) * 64 + bit.bit_length() - 1]
+                bitboard ^= bit
+        return key
+
+    def updateOccupancy(self) -> None:
+        """
+        Recompute the occupancy masks from the piece bitboards
+        """
+        self.occupancy[WHITE] = 0
+        self.occupancy[BLACK] = 0
+        for i in range(6):
+            self.occupancy[WHITE] |= self.pieces[i]
+            self.occupancy[BLACK] |= self.pieces[6 + i]
+
+    def pieceAt(self, sq) -> int:
+        """
+        Get the piece on a square
+
+        Args:
+            sq (int): The square index
+
+        Returns:
+            int: The index of the piece in PIECES, -1 if the square is empty
+        """
+        bit = 1 << sq
+        for i, bitboard in enumerate(self.pieces):
+            if bitboard & bit:
+                return i
+        return -1
+
+    def makeMove(self, move) -> None:
+        """
+        This will make the move
+
+        Args:
+            move (Move): The move to make
+        """
+        self.undoStack.push(move.moveID, self.zobristKey, self.castlingRights, self.enPassantSquare, self.halfmoveClock)
+        self.toggleMove(move.moveID)
+        moveID = move.moveID
+        start = moveID & 63
+        end = moveID >> 6 & 63
+        moved = moveID >> 12 & 15
+        key = (self.zobristKey ^ ChessEngine.zobristDelta(moveID) ^ ChessEngine.ZOBRIST_CASTLING[self.castlingRights]
+               ^ ChessEngine.ZOBRIST_EN_PASSANT[self.enPassantSquare])
+        self.castlingRights &= ChessEngine.CASTLING_KEEP[start] & ChessEngine.CASTLING_KEEP[end]
+        self.enPassantSquare = -1
+        if (moved == 1 or moved == 7) and (end - start == 16 or start - end == 16):
+            # keep the square only when an enemy pawn stands ready to capture onto it
+            color = WHITE if self.whiteToMove else BLACK
+            if PAWN_ATTACKS[color][start + end >> 1] & self.pieces[6 * (color ^ 1) + PAWN]:
+                self.enPassantSquare = start + end >> 1
+        self.zobristKey = key ^ ChessEngine.ZOBRIST_CASTLING[self.castlingRights] ^ ChessEngine.ZOBRIST_EN_PASSANT[self.enPassantSquare]
+        self.halfmoveClock = 0 if moved == 1 or moved == 7 or moveID >> 16 & 15 else self.halfmoveClock + 1
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+        self.whiteToMove = not self.whiteToMove
+
+    def undoMove(self) -> None:
+        """
+        Undo the last move
+        """
+        stack = self.undoStack
+        if stack.size != 0:
+            moveID = stack.pop()
+            self.whiteToMove = not self.whiteToMove
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            self.toggleMove(moveID)
+            size = stack.size
+            self.zobristKey = stack.keys[size]
+            self.castlingRights = stack.castlingRights[size]
+            self.enPassantSquare = stack.enPassantSquares[size]
+            self.halfmoveClock = stack.halfmoveClocks[size]
+
+    def toggleMove(self, moveID) -> None:
+        """
+        Move the pieces of a move on the bitboards, the same XORs make and unmake it
+
+        Args:
+            moveID (int): The packed ID of the move, made by the side to move
+        """
+        color = WHITE if self.whiteToMove else BLACK
+        pieces = self.pieces
+        start = moveID & 63
+        end = moveID >> 6 & 63
+        moved = moveID >> 12 & 15
+        fromBit = 1 << start
+        toBit = 1 << end
+        pieces[moved - 1] ^= fromBit
+        pieces[(moveID >> ChessEngine.PROMOTION_SHIFT & 15 or moved) - 1] ^= toBit
+        self.occupancy[color] ^= fromBit | toBit
+        captured = moveID >> 16 & 15
+        if captured:
+            capturedBit = 1 << (start & 56 | end & 7) if moveID & ChessEngine.EN_PASSANT_FLAG else toBit
+            pieces[captured - 1] ^= capturedBit
+            self.occupancy[color ^ 1] ^= capturedBit
+        elif moveID & ChessEngine.CASTLE_FLAG:
+            _, rookStart, rookEnd, _, _ = ChessEngine.CASTLINGS[end]
+            rookBits = 1 << rookStart | 1 << rookEnd
+            pieces[moved - 3] ^= rookBits  # the rook index is two below the king's
+            self.occupancy[color] ^= rookBits
+
+    def attackersTo(self, sq, color, occupied) -> int:
+        """
+        Get the pieces of one color that attack a square
+
+        Args:
+            sq (int): The square index
+            color (int): The attacking color
+            occupied (int): The occupancy mask to slide through
+
+        Returns:
+            int: Bitboard of the attacking pieces
+        """
+        base = 6 * color
+        pieces = self.pieces
+        attackers = PAWN_ATTACKS[color ^ 1][sq] & pieces[base + PAWN]
+        attackers |= KING_ATTACKS[sq] & pieces[base + KING]
+        attackers |= KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]
+        rooks = pieces[base + ROOK] | pieces[base + QUEEN]
+        bishops = pieces[base + BISHOP] | pieces[base + QUEEN]
+        for d in ROOK_RAYS:
+            blocker = firstBlocker(d, sq, occupied)
+            if blocker >= 0 and rooks >> blocker & 1:
+                attackers |= 1 << blocker
+        for d in BISHOP_RAYS:
+            blocker = firstBlocker(d, sq, occupied)
+            if blocker >= 0 and bishops >> blocker & 1:
+                attackers |= 1 << blocker
+        return attackers
+
+    def squareUnderAttack(self, r, c) -> bool:
+        """
+        Check if the square is under attack by the side not to move
+
+        Args:
+            r (int): The row of the square
+            c (int): The column of the square
+        """
+        color = BLACK if self.whiteToMove else WHITE
+        return self.attackersTo(r * 8 + c, color, self.occupancy[WHITE] | self.occupancy[BLACK]) != 0
+
+    def inCheck(self) -> bool:
+        """
+        Check if the king is in check
+        """
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return self.squareUnderAttack(kingRow, kingCol)
+
+    def pinnedPieces(self, kingSq, color, occupied) -> dict:
+        """
+        Find the pieces pinned to the king
+
+        Args:
+            kingSq (int): The king square
+            color (int): The color of the king
+            occupied (int): The occupancy mask
+
+        Returns:
+            dict: Maps a pinned square to the mask of squares it may still move to
+        """
+        pins = {}
+        base = 6 * (color ^ 1)
+        own = self.occupancy[color]
+        for rays, attackers in (
+                (ROOK_RAYS, self.pieces[base + ROOK] | self.pieces[base + QUEEN]),
+                (BISHOP_RAYS, self.pieces[base + BISHOP] | self.pieces[base + QUEEN])):
+            if not attackers:
+                continue
+            for d in rays:
+                pinned = firstBlocker(d, kingSq, occupied)
+                if pinned < 0 or not own >> pinned & 1:
+                    continue
+                pinner = firstBlocker(d, pinned, occupied)
+                if pinner >= 0 and attackers >> pinner & 1:
+                    pins[pinned] = BETWEEN[kingSq][pinner] | 1 << pinner
+        return pins
+
+    def getValidMoves(self) -> list:
+        """
+        Get the valid moves, through the shared legal move cache
+
+        Returns:
+            _list_: The list of valid moves
+        """
+        return [ChessEngine.Move.fromID(moveID) for moveID in ChessEngine.cachedValidMoveIDs(self)]
+
+    def getValidMoveIDs(self, moves=None) -> array:
+        """
+        Get the valid moves as packed move IDs, see ChessEngine.Move
+
+        Args:
+            moves (_array_, optional): A preallocated array to fill, cleared first. A new one is made if omitted.
+
+        Returns:
+            _array_: The packed IDs of the valid moves
+        """
+        if moves is None:
+            moves = array("I")
+        else:
+            del moves[:]
+        color = WHITE if self.whiteToMove else BLACK
+        enemy = color ^ 1
+        base = 6 * color
+        own = self.occupancy[color]
+        enemyOccupied = self.occupancy[enemy]
+        occupied = own | enemyOccupied
+        kingBit = self.pieces[base + KING]
+        kingSq = kingBit.bit_length() - 1
+
+        # king steps are tested with the king lifted so it cannot hide behind its own square
+        targets = KING_ATTACKS[kingSq] & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            sq = bit.bit_length() - 1
+            if not self.attackersTo(sq, enemy, occupied ^ kingBit):
+                self.addMove(moves, kingSq, sq, base + KING, enemyOccupied)
+
+        checkers = self.attackersTo(kingSq, enemy, occupied)
+        if checkers & (checkers - 1): # double check, only the king can move
+            return moves
+        checkMask = FULL_BOARD
+        if checkers:
+            checkerSq = checkers.bit_length() - 1
+            checkMask = BETWEEN[kingSq][checkerSq] | checkers
+        pins = self.pinnedPieces(kingSq, color, occupied)
+
+        pawns = self.pieces[base + PAWN]
+        step, startRow = (-8, 6) if color == WHITE else (8, 1)
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            sq = bit.bit_length() - 1
+            targets = PAWN_ATTACKS[color][sq] & enemyOccupied
+            push = sq + step
+            if 0 <= push < 64 and not occupied >> push & 1:
+                targets |= 1 << push
+                doublePush = push + step
+                if sq >> 3 == startRow and not occupied >> doublePush & 1:
+                    targets |= 1 << doublePush
+            targets &= checkMask & pins.get(sq, FULL_BOARD)
+            if targets & LAST_RANKS:
+                self.addPromotions(moves, sq, targets, base + PAWN, enemyOccupied)
+            else:
+                self.addMoves(moves, sq, targets, base + PAWN, enemyOccupied)
+
+        knights = self.pieces[base + KNIGHT]
+        while knights:
+            bit = knights & -knights
+            knights ^= bit
+            sq = bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[sq] & ~own & checkMask & pins.get(sq, FULL_BOARD)
+            self.addMoves(moves, sq, targets, base + KNIGHT, enemyOccupied)
+
+        for piece, rays in ((BISHOP, BISHOP_RAYS), (ROOK, ROOK_RAYS), (QUEEN, range(0, 8))):
+            bitboard = self.pieces[base + piece]
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                sq = bit.bit_length() - 1
+                targets = 0
+                for d in rays:
+                    targets |= rayAttacks(d, sq, occupied)
+                targets &= ~own & checkMask & pins.get(sq, FULL_BOARD)
+                self.addMoves(moves, sq, targets, base + piece, enemyOccupied)
+
+        if self.enPassantSquare >= 0:
+            self.addEnPassantMoves(moves, color, kingSq, occupied)
+        if self.castlingRights and not checkers:
+            self.addCastleMoves(moves, color, occupied)
+        return moves
+
+    def addEnPassantMoves(self, moves, color, kingSq, occupied) -> None:
+        """
+        Append the en passant captures that do not leave the king attacked. The occupancy after the capture is
+        slid through, so a rook uncovered by both pawns leaving the rank is seen.
+
+        Args:
+            moves (_array_): The packed IDs of the valid moves
+            color (int): The color to move
+            kingSq (int): The king square
+            occupied (int): The occupancy mask
+        """
+        target = self.enPassantSquare
+        capturedSq = target + 8 if color == WHITE else target - 8
+        capturedBit = 1 << capturedSq
+        pawn = 6 * color + PAWN
+        capturedPawn = 6 * (color ^ 1) + PAWN
+        pawns = PAWN_ATTACKS[color ^ 1][target] & self.pieces[pawn]
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            after = occupied ^ bit ^ capturedBit | 1 << target
+            if not self.attackersTo(kingSq, color ^ 1, after) & ~capturedBit:
+                moves.append(bit.bit_length() - 1 | target << 6 | (pawn + 1) << 12 | (capturedPawn + 1) << 16
+                             | ChessEngine.EN_PASSANT_FLAG)
+
+    def addCastleMoves(self, moves, color, occupied) -> None:
+        """
+        Append the castling moves. The caller checks that the king is not in check.
+
+        Args:
+            moves (_array_): The packed IDs of the valid moves
+            color (int): The color to move
+            occupied (int): The occupancy mask
+        """
+        kingSq, ends = CASTLING_KING[color]
+        for end in ends:
+            right, _, _, empty, crossed = ChessEngine.CASTLINGS[end]
+            if (self.castlingRights & right and not any(occupied >> sq & 1 for sq in empty)
+                    and not any(self.attackersTo(sq, color ^ 1, occupied) for sq in crossed)):
+                moves.append(kingSq | end << 6 | (6 * color + KING + 1) << 12 | ChessEngine.CASTLE_FLAG)
+
+    def addMoves(self, moves, fromSq, targets, piece, enemyOccupied) -> None:
+        """
+        Append a move for every target square
+
+        Args:
+            moves (_array_): The packed IDs of the valid moves
+            fromSq (int): The start square
+            targets (int): Bitboard of the end squares
+            piece (int): The index of the moving piece
+            enemyOccupied (int): The enemy occupancy mask
+        """
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            self.addMove(moves, fromSq, bit.bit_length() - 1, piece, enemyOccupied)
+
+    def addPromotions(self, moves, fromSq, targets, piece, enemyOccupied) -> None:
+        """
+        Append a move per promotion piece for every target square of a pawn about to promote
+
+        Args:
+            moves (_array_): The packed IDs of the valid moves
+            fromSq (int): The start square
+            targets (int): Bitboard of the end squares, all on the last rank
+            piece (int): The index of the moving pawn
+            enemyOccupied (int): The enemy occupancy mask
+        """
+        promotions = ChessEngine.PROMOTION_FLAGS[PIECES[piece][0]]
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            toSq = bit.bit_length() - 1
+            captured = self.pieceAt(toSq) + 1 if enemyOccupied >> toSq & 1 else 0
+            moveID = fromSq | toSq << 6 | (piece + 1) << 12 | captured << 16
+            for promotion in promotions:
+                moves.append(moveID | promotion)
+
+    def addMove(self, moves, fromSq, toSq, piece, enemyOccupied) -> None:
+        """
+        Append a single move
+
+        Args:
+            moves (_array_): The packed IDs of the valid moves
+            fromSq (int): The start square
+            toSq (int): The end square
+            piece (int): The index of the moving piece
+            enemyOccupied (int): The enemy occupancy mask
+        """
+        captured = self.pieceAt(toSq) + 1 if enemyOccupied >> toSq & 1 else 0
+        moves.append(fromSq | toSq << 6 | (piece + 1) << 12 | captured << 16)
+
+
+BACKENDS = {
+    "board": ChessEngine.GameState,
+    "bitboard": BitboardGameState
+}
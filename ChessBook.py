@@ -0,0 +1,245 @@
+"""
+Opening book. The builder replays the opening moves of a PGN corpus and writes every (position, move) pair it saw
+to a binary file, sorted by the position's Zobrist key. The reader maps the file and binary searches the key
+column in place, so opening a book reads nothing and a probe takes microseconds.
+
+File layout, little endian: an 8 byte magic, the entry count as uint64, then three columns of that many entries:
+the Zobrist keys (uint64), the moves as ChessEngine.shortMoveID (uint16) and the weights (uint16).
+
+    python3 ChessBook.py build book.bin games.pgn --plies 20
+    python3 ChessBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b"
+"""
+from array import array
+import argparse
+import bisect
+import mmap
+import random
+import struct
+import sys
+import time
+import ChessEngine
+import ChessBitboard
+import ChessPGN
+from Console import print_c
+
+MAGIC = b"CHBOOK02"
+HEADER = struct.Struct("<8sQ")
+MAX_WEIGHT = 0xFFFF
+
+
+def buildBook(pgnPaths, bookPath, plies=20, minGames=1, backend="board") -> int:
+    """
+    Compile the openings of PGN files into a book. A move's weight is the number of games that played it plus the
+    number its side won, so every move seen keeps a weight of at least 1.
+
+    Args:
+        pgnPaths (_list_): The PGN files
+        bookPath (str): The book file to write
+        plies (int): Moves of each game to take into the book
+        minGames (int): Leave out moves played in fewer games than this
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        int: The number of entries written
+    """
+    counts = {}
+    for path in pgnPaths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for game in ChessPGN.readGames(f):
+                winner = {"1-0": True, "0-1": False}.get(game.result)
+                try:
+                    gs = ChessPGN.newGame(game.tags.get("FEN"), backend)
+                    for san in game.moves[:plies]:
+                        moveID = ChessPGN.sanToMoveID(gs, san, gs.getValidMoveIDs())
+                        entry = (gs.zobristKey, ChessEngine.shortMoveID(moveID))
+                        games, wins = counts.get(entry, (0, 0))
+                        counts[entry] = (games + 1, wins + (winner is gs.whiteToMove))
+                        gs.makeMove(ChessEngine.Move.fromID(moveID))
+                except ValueError:  # keep the moves before an unreadable one
+                    continue
+    keys, moves, weights = array("Q"), array("H"), array("H")
+    for (key, move), (games, wins) in sorted(counts.items()):
+        if games >= minGames:
+            keys.append(key)
+            moves.append(move)
+            weights.append(min(MAX_WEIGHT, games + wins))
+    if sys.byteorder != "little":
+        for column in (keys, moves, weights):
+            column.byteswap()
+    with open(bookPath, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys)))
+        keys.tofile(f)
+        moves.tofile(f)
+        weights.tofile(f)
+    return len(keys)
+
+
+class OpeningBook():
+    """
+    A memory-mapped book. Any GameState works with it through its zobristKey.
+    """
+    def __init__(self, path) -> None:
+        """
+        Map a book file
+
+        Args:
+            path (str): The book file
+
+        Raises:
+            ValueError: If the file is not a book
+        """
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or len(self.map) != HEADER.size + 12 * count:
+            self.map.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.count = count
+        view = memoryview(self.map)
+        keysEnd = HEADER.size + 8 * count
+        movesEnd = keysEnd + 2 * count
+        if sys.byteorder == "little":
+            self.keys = view[HEADER.size:keysEnd].cast("Q")
+            self.moves = view[keysEnd:movesEnd].cast("H")
+            self.weights = view[movesEnd:].cast("H")
+        else:  # big endian machines pay for a swapped copy
+            self.keys, self.moves, self.weights = array("Q"), array("H"), array("H")
+            for column, start, end in ((self.keys, HEADER.size, keysEnd), (self.moves, keysEnd, movesEnd), (self.weights, movesEnd, len(self.map))):
+                column.frombytes(self.map[start:end])
+                column.byteswap()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self.keys, memoryview):
+            self.keys.release()
+            self.moves.release()
+            self.weights.release()
+        self.map.close()
+
+    def probe(self, key) -> tuple:
+        """
+        Find the entries of a position by binary search, without copying anything
+
+        Args:
+            key (int): The position's Zobrist key
+
+        Returns:
+            tuple: (first, end) entry indexes, equal when the position is not in the book
+        """
+        first = bisect.bisect_left(self.keys, key)
+        end = first
+        while end < self.count and self.keys[end] == key:
+            end += 1
+        return first, end
+
+    def bookMoves(self, gs):
+        """
+        Get the book moves of a position that are legal in it, read straight from the mapped columns without
+        building any collection
+
+        Args:
+            gs (GameState): The position, any backend
+
+        Yields:
+            tuple: (moveID, weight) of each legal book move, nothing when the position is not in the book
+        """
+        first, end = self.probe(gs.zobristKey)
+        if first == end:
+            return
+        legal = ChessEngine.cachedValidMoveIDs(gs)
+        for i in range(first, end):
+            short = self.moves[i]
+            for moveID in legal:
+                if moveID & 0xFFF == short & 0xFFF and ChessEngine.shortMoveID(moveID) == short:
+                    yield moveID, self.weights[i]
+                    break
+
+    def pickMove(self, gs, rng=random, best=False) -> ChessEngine.Move:
+        """
+        Choose a book move, at random in proportion to the weights or the heaviest one
+
+        Args:
+            gs (GameState): The position, any backend
+            rng (random.Random): Source of randomness
+            best (bool): Always take the heaviest move
+
+        Returns:
+            Move: The move, None when the position is not in the book
+        """
+        if best:
+            bestMove, bestWeight = 0, 0
+            for moveID, weight in self.bookMoves(gs):
+                if weight > bestWeight:
+                    bestMove, bestWeight = moveID, weight
+            return ChessEngine.Move.fromID(bestMove) if bestWeight else None
+        total = sum(weight for _, weight in self.bookMoves(gs))
+        if not total:
+            return None
+        target = rng.random() * total
+        for moveID, weight in self.bookMoves(gs):
+            target -= weight
+            if target < 0:
+                break
+        return ChessEngine.Move.fromID(moveID)
+
+
+def benchmark(path, probes=100000) -> None:
+    """
+    Time probes of positions in and out of a book
+
+    Args:
+        path (str): The book file
+        probes (int): Number of probes of each kind
+    """
+    start = time.perf_counter()
+    book = OpeningBook(path)
+    opened = time.perf_counter() - start
+    gs = ChessBitboard.BACKENDS["board"]()
+    keys = [book.keys[i] for i in range(0, len(book), max(1, len(book) // 1000))] or [gs.zobristKey]
+    missing = [key ^ 0x5A5A5A5A5A5A5A5A for key in keys]
+    for name, sample in (("in the book", keys), ("not in the book", missing)):
+        start = time.perf_counter()
+        for i in range(probes):
+            book.probe(sample[i % len(sample)])
+        elapsed = time.perf_counter() - start
+        print_c.info(f"Probe {name}: {elapsed / probes * 1e6:.2f} us")
+    print_c.info(f"Opened {len(book)} entries in {opened * 1e6:.0f} us")
+    book.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, probe and benchmark opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile PGN files into a book")
+    build.add_argument("book", help="the book file to write")
+    build.add_argument("pgn", nargs="+", help="the PGN files")
+    build.add_argument("--plies", type=int, default=20, help="moves of each game to take into the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="the book file")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN, help="the position")
+    bench = commands.add_parser("bench", help="time book probes")
+    bench.add_argument("book", help="the book file")
+    args = parser.parse_args()
+    if args.command == "build":
+        start = time.perf_counter()
+        count = buildBook(args.pgn, args.book, args.plies, args.min_games)
+        print_c.success(f"Wrote {count} entries to {args.book} in {time.perf_counter() - start:.1f}s")
+    elif args.command == "probe":
+        with OpeningBook(args.book) as book:
+            gs = ChessPGN.newGame(args.fen)
+            moves = sorted(book.bookMoves(gs), key=lambda entry: -entry[1])
+            for moveID, weight in moves:
+                print(f"{ChessEngine.Move.fromID(moveID).getChessNotation()} {weight}")
+            if not moves:
+                print_c.warning("Position not in the book")
+    else:
+        benchmark(args.book)
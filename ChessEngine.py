@@ -2,6 +2,691 @@
 This class is responsible for storing all the information about the current state of a chess game. It will also be responsible
 for determining the valid moves at the current state. It will also keep a move log.
 """
+from array import array
+from collections import OrderedDict
+import random
+
+PIECES = ["--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_CODES = {piece: i for i, piece in enumerate(PIECES)}
+
+# Move ID flags above the captured piece code, see Move
+EN_PASSANT_FLAG = 1 << 20
+CASTLE_FLAG = 1 << 21
+PROMOTION_SHIFT = 22  # the promoted piece code sits in bits 22-25
+PROMOTION_PIECES = "NBRQ"
+
+# castling rights bits, and the rights that survive a move from or to each square
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_LETTERS = "KQkq"
+CASTLING_KEEP = [15] * 64
+CASTLING_KEEP[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1
+CASTLING_KEEP[63] = 15 & ~WHITE_KINGSIDE  # h1
+CASTLING_KEEP[56] = 15 & ~WHITE_QUEENSIDE  # a1
+CASTLING_KEEP[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8
+CASTLING_KEEP[7] = 15 & ~BLACK_KINGSIDE  # h8
+CASTLING_KEEP[0] = 15 & ~BLACK_QUEENSIDE  # a8
+# per castling king end square: the right it needs, the rook's start and end squares, the squares that must be
+# empty and the squares the king crosses, which must not be attacked
+CASTLINGS = {
+    62: (WHITE_KINGSIDE, 63, 61, (61, 62), (61, 62)),
+    58: (WHITE_QUEENSIDE, 56, 59, (59, 58, 57), (59, 58)),
+    6: (BLACK_KINGSIDE, 7, 5, (5, 6), (5, 6)),
+    2: (BLACK_QUEENSIDE, 0, 3, (3, 2, 1), (3, 2))
+}
+FIFTY_MOVE_PLIES = 100
+
+# Zobrist keys, fixed seed so a position hashes the same in every process. Indexed code * 64 + square,
+# the empty piece code keys are 0 so a quiet move XORs out nothing for its captured piece.
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [0] * 64 + [_zobristRandom.getrandbits(64) for _ in range(64 * (len(PIECES) - 1))]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+# one key per combination of castling rights, none for no rights
+ZOBRIST_CASTLING = [0] + [_zobristRandom.getrandbits(64) for _ in range(15)]
+# one key per en passant file, indexed by the en passant square; the extra last entry makes index -1, no en
+# passant square, hash to nothing
+_zobristFiles = [_zobristRandom.getrandbits(64) for _ in range(8)]
+ZOBRIST_EN_PASSANT = [_zobristFiles[sq & 7] for sq in range(64)] + [0]
+
+def zobristDelta(moveID) -> int:
+    """
+    Get the Zobrist key change of a move's pieces and side to move, the same value makes and unmakes it.
+    Castling rights and en passant keys are changed by the caller, which knows the state before the move.
+
+    Args:
+        moveID (int): The packed move ID
+
+    Returns:
+        int: The value to XOR into the position key
+    """
+    start = moveID & 63
+    end = moveID >> 6 & 63
+    moved = moveID >> 12 & 15
+    captured = moveID >> 16 & 15
+    delta = ZOBRIST_PIECES[moved * 64 + start] ^ ZOBRIST_PIECES[((moveID >> PROMOTION_SHIFT & 15) or moved) * 64 + end]
+    if moveID & EN_PASSANT_FLAG:
+        delta ^= ZOBRIST_PIECES[captured * 64 + (start & 56 | end & 7)]
+    else:
+        delta ^= ZOBRIST_PIECES[captured * 64 + end]
+    if moveID & CASTLE_FLAG:
+        _, rookStart, rookEnd, _, _ = CASTLINGS[end]
+        rook = (moved - 2) * 64  # the rook code is two below the king's of the same color
+        delta ^= ZOBRIST_PIECES[rook + rookStart] ^ ZOBRIST_PIECES[rook + rookEnd]
+    return delta ^ ZOBRIST_BLACK_TO_MOVE
+
+def positionKey(board, whiteToMove, castlingRights, enPassantSquare) -> int:
+    """
+    Compute the Zobrist key of a position from scratch
+
+    Args:
+        board (_list_): 8 rows of 8 pieces
+        whiteToMove (bool): True if white is to move
+        castlingRights (int): The castling rights bits
+        enPassantSquare (int): The en passant target square, -1 for none
+
+    Returns:
+        int: The 64-bit position key
+    """
+    key = (0 if whiteToMove else ZOBRIST_BLACK_TO_MOVE) ^ ZOBRIST_CASTLING[castlingRights] ^ ZOBRIST_EN_PASSANT[enPassantSquare]
+    for r in range(8):
+        for c in range(8):
+            key ^= ZOBRIST_PIECES[PIECE_CODES[board[r][c]] * 64 + r * 8 + c]
+    return key
+
+def castlingRightsFromBoard(board) -> int:
+    """
+    Guess the castling rights of a position from its pieces: every king and rook still on its start square
+
+    Args:
+        board (_list_): 8 rows of 8 pieces
+
+    Returns:
+        int: The castling rights bits
+    """
+    rights = 0
+    if board[7][4] == "wK":
+        rights |= (WHITE_KINGSIDE if board[7][7] == "wR" else 0) | (WHITE_QUEENSIDE if board[7][0] == "wR" else 0)
+    if board[0][4] == "bK":
+        rights |= (BLACK_KINGSIDE if board[0][7] == "bR" else 0) | (BLACK_QUEENSIDE if board[0][0] == "bR" else 0)
+    return rights
+
+def enPassantTarget(board, whiteToMove, square) -> int:
+    """
+    Keep an en passant square only when a pawn of the side to move could capture onto it, so positions that
+    differ only by an unusable en passant square hash and repeat alike
+
+    Args:
+        board (_list_): 8 rows of 8 pieces
+        whiteToMove (bool): True if white is to move
+        square (int): The square behind a pawn that just moved two squares, -1 for none
+
+    Returns:
+        int: The square, or -1
+    """
+    if square < 0:
+        return -1
+    r, c = divmod(square, 8)
+    pawnRow, pawn = (r + 1, "wp") if whiteToMove else (r - 1, "bp")
+    if not 0 <= pawnRow < 8:
+        return -1
+    if (c > 0 and board[pawnRow][c - 1] == pawn) or (c < 7 and board[pawnRow][c + 1] == pawn):
+        return square
+    return -1
+
+def repetitionCount(gs) -> int:
+    """
+    Count how often the current position has occurred, looking back only to the last capture or pawn move
+
+    Args:
+        gs (GameState): The position, any backend
+
+    Returns:
+        int: The number of occurrences, 1 for a new position
+    """
+    stack = gs.undoStack
+    keys = stack.keys
+    key = gs.zobristKey
+    count = 1
+    for ply in range(stack.size - 2, max(stack.size - gs.halfmoveClock, 0) - 1, -2):
+        if keys[ply] == key:
+            count += 1
+    return count
+
+def drawReason(gs) -> str:
+    """
+    Check the draws a player can claim: threefold repetition and the fifty-move rule
+
+    Args:
+        gs (GameState): The position, any backend
+
+    Returns:
+        str: "threefold repetition", "fifty-move rule" or None
+    """
+    if gs.halfmoveClock >= FIFTY_MOVE_PLIES:
+        return "fifty-move rule"
+    if gs.halfmoveClock >= 8 and repetitionCount(gs) >= 3:
+        return "threefold repetition"
+    return None
+
+class MoveCache():
+    """
+    Least recently used cache of legal move ID arrays keyed by Zobrist key, shared by every game state of a process
+    through MOVE_CACHE. Openings, undo and redo and rooms playing the same line all revisit positions.
+    """
+    def __init__(self, maxEntries=32768) -> None:
+        """
+        Initialize the cache
+
+        Args:
+            maxEntries (int): Positions kept before the least recently used one is evicted, about 200 bytes each
+        """
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key) -> array:
+        """
+        Look a position up
+
+        Args:
+            key (int): The position's Zobrist key
+
+        Returns:
+            _array_: The cached move IDs, which must not be modified, None on a miss
+        """
+        moves = self.entries.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return moves
+
+    def put(self, key, moves) -> None:
+        """
+        Store the legal moves of a position, evicting the least recently used one when full
+
+        Args:
+            key (int): The position's Zobrist key
+            moves (_array_): The move IDs, owned by the cache from now on
+        """
+        if self.maxEntries <= 0:
+            return
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = moves
+        if len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Drop every entry and reset the counters
+        """
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Get the counters
+
+        Returns:
+            dict: entries, hits, misses, evictions and hitRate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": self.hits / lookups if lookups else 0.0
+        }
+
+MOVE_CACHE = MoveCache()
+
+def cachedValidMoveIDs(gs) -> array:
+    """
+    Get the legal move IDs of a position through MOVE_CACHE
+
+    Args:
+        gs (GameState): The position, any backend
+
+    Returns:
+        _array_: The move IDs, shared with the cache so they must not be modified
+    """
+    moves = MOVE_CACHE.get(gs.zobristKey)
+    if moves is None:
+        moves = gs.getValidMoveIDs()
+        MOVE_CACHE.put(gs.zobristKey, moves)
+    return moves
+
+def shortMoveID(moveID) -> int:
+    """
+    Get the 16-bit form of a move that names it within its position: start square | end square << 6 | the
+    promotion piece's index in PROMOTION_PIECES + 1 << 12, 0 for no promotion
+
+    Args:
+        moveID (int): The packed move ID
+
+    Returns:
+        int: The short move ID
+    """
+    promoted = moveID >> PROMOTION_SHIFT & 15
+    if promoted:
+        return moveID & 0xFFF | PROMOTION_PIECES.index(PIECES[promoted][1]) + 1 << 12
+    return moveID & 0xFFF
+
+def findMove(gs, startSq, endSq, promotion="Q") -> "Move":
+    """
+    Find the legal move between two squares
+
+    Args:
+        gs (GameState): The position, any backend
+        startSq (int): The start square index
+        endSq (int): The end square index
+        promotion (str, optional): The promotion piece letter, one of PROMOTION_PIECES, used when the move promotes
+
+    Returns:
+        Move: The move, None if no legal move joins the squares
+    """
+    short = startSq | endSq << 6
+    for moveID in cachedValidMoveIDs(gs):
+        if moveID & 0xFFF == short:
+            promoted = moveID >> PROMOTION_SHIFT & 15
+            if not promoted or PIECES[promoted][1] == promotion:
+                return Move.fromID(moveID)
+    return None
+
+# how each piece attacks: its directions and whether it keeps going past empty squares
+ATTACK_PATTERNS = {
+    "N": (((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)), False),
+    "B": (((-1, -1), (-1, 1), (1, -1), (1, 1)), True),
+    "R": (((-1, 0), (0, -1), (1, 0), (0, 1)), True),
+    "Q": (((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)), True),
+    "K": (((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)), False),
+    "wp": (((-1, -1), (-1, 1)), False),
+    "bp": (((1, -1), (1, 1)), False)
+}
+
+def buildAttackRays() -> tuple:
+    """
+    Precompute the attack rays of every piece code on every square
+
+    Returns:
+        tuple: (rays, sliding) where rays[code][sq] is a tuple of rays, each the tuple of squares in order out from
+            sq, and sliding[code] is True when the piece's attacks stop at the first occupied square
+    """
+    rays = [[()] * 64]
+    sliding = [False]
+    for piece in PIECES[1:]:
+        directions, slides = ATTACK_PATTERNS[piece if piece[1] == "p" else piece[1]]
+        rays.append([])
+        sliding.append(slides)
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            pieceRays = []
+            for dr, dc in directions:
+                ray = []
+                endRow, endCol = r + dr, c + dc
+                while 0 <= endRow < 8 and 0 <= endCol < 8:
+                    ray.append(endRow * 8 + endCol)
+                    if not slides:
+                        break
+                    endRow += dr
+                    endCol += dc
+                if ray:
+                    pieceRays.append(tuple(ray))
+            rays[-1].append(tuple(pieceRays))
+    return rays, sliding
+
+ATTACK_RAYS, SLIDING = buildAttackRays()
+# the squares a knight or king on each square reaches, for the move generators
+KNIGHT_TARGETS = [tuple(ray[0] for ray in rays) for rays in ATTACK_RAYS[PIECE_CODES["wN"]]]
+KING_TARGETS = [tuple(ray[0] for ray in rays) for rays in ATTACK_RAYS[PIECE_CODES["wK"]]]
+# the promoted piece bits of a pawn move, per color in PROMOTION_PIECES order
+PROMOTION_FLAGS = {color: tuple(PIECE_CODES[color + piece] << PROMOTION_SHIFT for piece in PROMOTION_PIECES) for color in "wb"}
+
+class AttackMap():
+    """
+    The squares each side attacks, kept up to date as squares change instead of being rescanned. For every square
+    it holds the mask of squares its piece attacks and the mask of squares whose pieces attack it, plus per side
+    attacker counts, so asking whether a square is attacked is a list lookup. A change recomputes only the pieces
+    on the changed squares and the sliders whose rays reached them.
+    Squares are indexed row * 8 + col and colors are 0 for white, 1 for black.
+    """
+    __slots__ = ("squares", "attacks", "attackers", "counts")
+
+    def __init__(self, codes) -> None:
+        """
+        Build the map of a position from scratch
+
+        Args:
+            codes (_iterable_): The piece code of each of the 64 squares
+        """
+        self.squares = bytearray(codes)
+        self.attacks = [0] * 64
+        self.attackers = [0] * 64
+        self.counts = ([0] * 64, [0] * 64)
+        for sq in range(64):
+            if self.squares[sq]:
+                self.changeAttacks(sq, self.computeAttacks(sq))
+
+    def computeAttacks(self, sq) -> int:
+        """
+        Get the squares the piece on a square attacks, up to and including the first occupied square of each ray
+
+        Args:
+            sq (int): The square index
+
+        Returns:
+            int: The mask of attacked squares
+        """
+        squares = self.squares
+        mask = 0
+        for ray in ATTACK_RAYS[squares[sq]][sq]:
+            for target in ray:
+                mask |= 1 << target
+                if squares[target]:
+                    break
+        return mask
+
+    def changeAttacks(self, sq, mask) -> None:
+        """
+        Replace the recorded attacks of the piece on a square, touching only the squares that differ
+
+        Args:
+            sq (int): The square index
+            mask (int): The squares it attacks now
+        """
+        old = self.attacks[sq]
+        self.attacks[sq] = mask
+        attackers = self.attackers
+        counts = self.counts[self.squares[sq] > 6]
+        bit = 1 << sq
+        diff = old ^ mask
+        while diff:
+            low = diff & -diff
+            diff ^= low
+            target = low.bit_length() - 1
+            attackers[target] ^= bit
+            counts[target] += 1 if mask & low else -1
+
+    def update(self, changes) -> None:
+        """
+        Put new pieces on squares and bring the map up to date
+
+        Args:
+            changes (_iterable_): (square, piece code) pairs, code 0 to empty the square
+        """
+        squares = self.squares
+        changed = 0
+        reached = 0
+        for sq, code in changes:
+            changed |= 1 << sq
+            reached |= self.attackers[sq]
+            if squares[sq]:
+                self.changeAttacks(sq, 0)
+            squares[sq] = code
+        # the squares a slider reaches are the only ones that can lengthen or shorten its rays
+        reached &= ~changed
+        while reached:
+            low = reached & -reached
+            reached ^= low
+            sq = low.bit_length() - 1
+            if SLIDING[squares[sq]]:
+                self.changeAttacks(sq, self.computeAttacks(sq))
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            sq = low.bit_length() - 1
+            if squares[sq]:
+                self.changeAttacks(sq, self.computeAttacks(sq))
+
+    def copy(self) -> "AttackMap":
+        """
+        Copy the map, one slice per array
+
+        Returns:
+            AttackMap: The copy
+        """
+        attackMap = AttackMap.__new__(AttackMap)
+        attackMap.squares = self.squares[:]
+        attackMap.attacks = self.attacks[:]
+        attackMap.attackers = self.attackers[:]
+        attackMap.counts = (self.counts[0][:], self.counts[1][:])
+        return attackMap
+
+    def isAttacked(self, sq, color) -> bool:
+        """
+        Check if a side attacks a square
+
+        Args:
+            sq (int): The square index
+            color (int): The attacking color
+
+        Returns:
+            bool: True if at least one piece of that color attacks the square
+        """
+        return self.counts[color][sq] > 0
+
+class UndoStack():
+    """
+    The moves played and the state each one destroys, kept in parallel arrays preallocated to a capacity that
+    doubles when full. Making a move stores a few integers and undoing it reads them back, nothing is copied.
+    It is also the game's move log: indexing and iterating it give Move objects.
+    """
+    __slots__ = ("moveIDs", "keys", "castlingRights", "enPassantSquares", "halfmoveClocks", "size")
+
+    def __init__(self, capacity=256) -> None:
+        """
+        Initialize the stack
+
+        Args:
+            capacity (int): Plies stored before the arrays grow
+        """
+        self.moveIDs = array("I", bytes(4 * capacity))
+        self.keys = array("Q", bytes(8 * capacity))
+        self.castlingRights = array("B", bytes(capacity))
+        self.enPassantSquares = array("b", bytes(capacity))
+        self.halfmoveClocks = array("H", bytes(2 * capacity))
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index) -> "Move":
+        if isinstance(index, slice):
+            return [Move.fromID(moveID) for moveID in self.moveIDs[:self.size][index]]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("move log index out of range")
+        return Move.fromID(self.moveIDs[index])
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield Move.fromID(self.moveIDs[i])
+
+    def push(self, moveID, key, castlingRights, enPassantSquare, halfmoveClock) -> None:
+        """
+        Record a move about to be made and the state it cannot restore by itself
+
+        Args:
+            moveID (int): The packed move ID
+            key (int): The Zobrist key of the position before the move
+            castlingRights (int): The castling rights before the move
+            enPassantSquare (int): The en passant square before the move, -1 for none
+            halfmoveClock (int): The halfmove clock before the move
+        """
+        size = self.size
+        if size == len(self.moveIDs):
+            for column in (self.moveIDs, self.keys, self.castlingRights, self.enPassantSquares, self.halfmoveClocks):
+                column.extend(column)
+        self.moveIDs[size] = moveID
+        self.keys[size] = key
+        self.castlingRights[size] = castlingRights
+        self.enPassantSquares[size] = enPassantSquare
+        self.halfmoveClocks[size] = halfmoveClock
+        self.size = size + 1
+
+    def pop(self) -> int:
+        """
+        Remove the last move, its stored state stays readable at index size until the next push
+
+        Returns:
+            int: The packed move ID
+        """
+        self.size -= 1
+        return self.moveIDs[self.size]
+
+    def clear(self) -> None:
+        self.size = 0
+
+    def copy(self) -> "UndoStack":
+        """
+        Copy the stack, one array copy per column
+
+        Returns:
+            UndoStack: The copy
+        """
+        stack = UndoStack.__new__(UndoStack)
+        stack.moveIDs = self.moveIDs[:]
+        stack.keys = self.keys[:]
+        stack.castlingRights = self.castlingRights[:]
+        stack.enPassantSquares = self.enPassantSquares[:]
+        stack.halfmoveClocks = self.halfmoveClocks[:]
+        stack.size = self.size
+        return stack
+
+def packPosition(gs) -> bytes:
+    """
+    Pack a position into 67 bytes: the piece code of each square, then 1 if white is to move with the castling
+    rights in the bits above, the en passant square + 1 (0 for none) and the halfmove clock
+
+    Args:
+        gs (GameState): The position, any backend
+
+    Returns:
+        bytes: The packed position
+    """
+    return bytes([PIECE_CODES[piece] for row in gs.board for piece in row]
+                 + [gs.whiteToMove | gs.castlingRights << 1, gs.enPassantSquare + 1, min(gs.halfmoveClock, 255)])
+
+def unpackPosition(data, gs) -> None:
+    """
+    Set up a position packed by packPosition
+
+    Args:
+        data (bytes): The packed position
+        gs (GameState): The game state to set up, any backend
+    """
+    board = [[PIECES[code] for code in data[r * 8:r * 8 + 8]] for r in range(8)]
+    gs.setBoard(board, bool(data[64] & 1), data[64] >> 1, data[65] - 1, data[66])
+
+# FEN piece letters, upper case for white
+FEN_PIECES = {(piece[1].lower() if piece[0] == "b" else piece[1].upper()): piece for piece in PIECES[1:]}
+FEN_LETTERS = {piece: letter for letter, piece in FEN_PIECES.items()}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+def parseFen(fen) -> tuple:
+    """
+    Read a FEN string. Missing trailing fields take their defaults: white to move, the castling rights the
+    king and rook squares allow, no en passant square and move 1.
+
+    Args:
+        fen (str): The FEN string, the fields after the piece placement may be left out
+
+    Returns:
+        tuple: (board, whiteToMove, castlingRights, enPassantSquare, halfmoveClock, fullmoveNumber)
+
+    Raises:
+        ValueError: If a field is malformed
+    """
+    fields = fen.split()
+    ranks = fields[0].split("/") if fields else []
+    if len(ranks) != 8:
+        raise ValueError(f"FEN needs 8 ranks: {fen!r}")
+    board = []
+    for rank in ranks:
+        row = []
+        for char in rank:
+            if char in "12345678":
+                row.extend(["--"] * int(char))
+            elif char in FEN_PIECES:
+                row.append(FEN_PIECES[char])
+            else:
+                raise ValueError(f"Bad FEN piece {char!r}: {fen!r}")
+        if len(row) != 8:
+            raise ValueError(f"FEN rank {rank!r} is not 8 squares: {fen!r}")
+        board.append(row)
+    if len(fields) > 1 and fields[1] not in ("w", "b"):
+        raise ValueError(f"Bad FEN side to move {fields[1]!r}: {fen!r}")
+    whiteToMove = len(fields) < 2 or fields[1] == "w"
+    if len(fields) < 3:
+        castlingRights = castlingRightsFromBoard(board)
+    elif fields[2] == "-":
+        castlingRights = 0
+    elif all(char in CASTLING_LETTERS for char in fields[2]):
+        castlingRights = sum(1 << CASTLING_LETTERS.index(char) for char in set(fields[2]))
+        castlingRights &= castlingRightsFromBoard(board)  # drop rights the pieces no longer allow
+    else:
+        raise ValueError(f"Bad FEN castling rights {fields[2]!r}: {fen!r}")
+    enPassantSquare = -1
+    if len(fields) > 3 and fields[3] != "-":
+        field = fields[3]
+        if len(field) != 2 or field[0] not in "abcdefgh" or field[1] not in "36":
+            raise ValueError(f"Bad FEN en passant square {field!r}: {fen!r}")
+        enPassantSquare = (8 - int(field[1])) * 8 + "abcdefgh".index(field[0])
+    try:
+        halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Bad FEN move counters: {fen!r}") from None
+    return board, whiteToMove, castlingRights, enPassantSquare, halfmoveClock, max(fullmoveNumber, 1)
+
+def loadFen(fen, gs) -> None:
+    """
+    Set up a FEN position
+
+    Args:
+        fen (str): The FEN string
+        gs (GameState): The game state to set up, any backend
+    """
+    gs.setBoard(*parseFen(fen))
+
+def toFen(gs) -> str:
+    """
+    Write a position as FEN. The en passant square is only written when a pawn can capture onto it.
+
+    Args:
+        gs (GameState): The position, any backend
+
+    Returns:
+        str: The FEN string
+    """
+    ranks = []
+    for row in gs.board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += FEN_LETTERS[piece]
+        ranks.append(rank + (str(empty) if empty else ""))
+    castling = "".join(letter for i, letter in enumerate(CASTLING_LETTERS) if gs.castlingRights >> i & 1) or "-"
+    enPassant = "-"
+    if gs.enPassantSquare >= 0:
+        enPassant = "abcdefgh"[gs.enPassantSquare & 7] + str(8 - (gs.enPassantSquare >> 3))
+    return (f"{'/'.join(ranks)} {'w' if gs.whiteToMove else 'b'} {castling} {enPassant} "
+            f"{gs.halfmoveClock} {gs.fullmoveNumber}")
 
 class GameState():
     def __init__(self) -> None:
@@ -25,10 +710,85 @@ class GameState():
             "K": self.getKingMoves
         }
         self.whiteToMove = True
-        self.moveLog = []
+        self.castlingRights = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.enPassantSquare = -1
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        self.undoStack = UndoStack()
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
-        
+        self.zobristKey = self.computeZobristKey()
+        self.attackMap = AttackMap(PIECE_CODES[piece] for row in self.board for piece in row)
+
+    def setBoard(self, board, whiteToMove, castlingRights=None, enPassantSquare=-1, halfmoveClock=0, fullmoveNumber=1) -> None:
+        """
+        Set up an arbitrary position, clearing the move log
+
+        Args:
+            board (_list_): 8 rows of 8 pieces, "--" for empty squares
+            whiteToMove (bool): True if white is to move
+            castlingRights (int, optional): The castling rights bits, taken from the king and rook squares if omitted.
+                Rights the pieces no longer allow are dropped.
+            enPassantSquare (int, optional): The square behind a pawn that just moved two squares, -1 for none
+            halfmoveClock (int, optional): Plies since the last capture or pawn move
+            fullmoveNumber (int, optional): The move number, starting at 1
+        """
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        fromBoard = castlingRightsFromBoard(self.board)
+        self.castlingRights = fromBoard if castlingRights is None else castlingRights & fromBoard
+        self.enPassantSquare = enPassantTarget(self.board, whiteToMove, enPassantSquare)
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.undoStack.clear()
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        self.zobristKey = self.computeZobristKey()
+        self.attackMap = AttackMap(PIECE_CODES[piece] for row in self.board for piece in row)
+
+    @property
+    def moveLog(self) -> UndoStack:
+        """
+        The moves played since the last setBoard, read only
+        """
+        return self.undoStack
+
+    def clone(self) -> "GameState":
+        """
+        Copy the game for analysis without deep copying it: the rows, the packed attack map and the undo stack
+        are each copied by slicing, and the moves and pieces they hold are shared immutable values
+
+        Returns:
+            GameState: An independent game state, with the same history to undo
+        """
+        gs = GameState.__new__(GameState)
+        gs.board = [row[:] for row in self.board]
+        gs.moveFunction = {piece: getattr(gs, function.__name__) for piece, function in self.moveFunction.items()}
+        gs.whiteToMove = self.whiteToMove
+        gs.castlingRights = self.castlingRights
+        gs.enPassantSquare = self.enPassantSquare
+        gs.halfmoveClock = self.halfmoveClock
+        gs.fullmoveNumber = self.fullmoveNumber
+        gs.undoStack = self.undoStack.copy()
+        gs.whiteKingLocation = self.whiteKingLocation
+        gs.blackKingLocation = self.blackKingLocation
+        gs.zobristKey = self.zobristKey
+        gs.attackMap = self.attackMap.copy()
+        return gs
+
+    def computeZobristKey(self) -> int:
+        """
+        Compute the Zobrist key of the position from scratch
+
+        Returns:
+            int: The 64-bit position key
+        """
+        return positionKey(self.board, self.whiteToMove, self.castlingRights, self.enPassantSquare)
+
     def makeMove(self, move) -> None:
         """
         This will make the move
@@ -36,10 +796,36 @@ class GameState():
         Args:
             move (Move): The move to make
         """
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)
+        moveID = move.moveID
+        board = self.board
+        start = moveID & 63
+        end = moveID >> 6 & 63
+        moved = moveID >> 12 & 15
+        placed = moveID >> PROMOTION_SHIFT & 15 or moved
+        self.undoStack.push(moveID, self.zobristKey, self.castlingRights, self.enPassantSquare, self.halfmoveClock)
+        board[move.startRow][move.startCol] = "--"
+        board[move.endRow][move.endCol] = PIECES[placed]
+        changes = [(start, 0), (end, placed)]
+        if moveID & EN_PASSANT_FLAG: # the captured pawn stands beside the start square
+            board[move.startRow][move.endCol] = "--"
+            changes.append((start & 56 | end & 7, 0))
+        elif moveID & CASTLE_FLAG:
+            _, rookStart, rookEnd, _, _ = CASTLINGS[end]
+            board[rookStart >> 3][rookStart & 7] = "--"
+            board[rookEnd >> 3][rookEnd & 7] = PIECES[moved - 2]
+            changes += ((rookStart, 0), (rookEnd, moved - 2))
+        key = self.zobristKey ^ zobristDelta(moveID) ^ ZOBRIST_CASTLING[self.castlingRights] ^ ZOBRIST_EN_PASSANT[self.enPassantSquare]
+        self.castlingRights &= CASTLING_KEEP[start] & CASTLING_KEEP[end]
         self.whiteToMove = not self.whiteToMove
+        if (moved == 1 or moved == 7) and (end - start == 16 or start - end == 16):
+            self.enPassantSquare = enPassantTarget(board, self.whiteToMove, start + end >> 1)
+        else:
+            self.enPassantSquare = -1
+        self.zobristKey = key ^ ZOBRIST_CASTLING[self.castlingRights] ^ ZOBRIST_EN_PASSANT[self.enPassantSquare]
+        self.halfmoveClock = 0 if moved == 1 or moved == 7 or moveID >> 16 & 15 else self.halfmoveClock + 1
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
+        self.attackMap.update(changes)
         
         # update king's location if move
         if move.pieceMoved == "wK":
@@ -51,11 +837,37 @@ class GameState():
         """
         Undo the last move
         """
-        if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+        stack = self.undoStack
+        if stack.size != 0:
+            move = Move.fromID(stack.pop())
+            moveID = move.moveID
+            board = self.board
+            start = moveID & 63
+            end = moveID >> 6 & 63
+            moved = moveID >> 12 & 15
+            captured = moveID >> 16 & 15
+            board[move.startRow][move.startCol] = move.pieceMoved
+            if moveID & EN_PASSANT_FLAG:
+                board[move.endRow][move.endCol] = "--"
+                board[move.startRow][move.endCol] = move.pieceCaptured
+                changes = [(start, moved), (end, 0), (start & 56 | end & 7, captured)]
+            else:
+                board[move.endRow][move.endCol] = move.pieceCaptured
+                changes = [(start, moved), (end, captured)]
+                if moveID & CASTLE_FLAG:
+                    _, rookStart, rookEnd, _, _ = CASTLINGS[end]
+                    board[rookEnd >> 3][rookEnd & 7] = "--"
+                    board[rookStart >> 3][rookStart & 7] = PIECES[moved - 2]
+                    changes += ((rookEnd, 0), (rookStart, moved - 2))
+            if self.whiteToMove:
+                self.fullmoveNumber -= 1
             self.whiteToMove = not self.whiteToMove
+            size = stack.size
+            self.zobristKey = stack.keys[size]
+            self.castlingRights = stack.castlingRights[size]
+            self.enPassantSquare = stack.enPassantSquares[size]
+            self.halfmoveClock = stack.halfmoveClocks[size]
+            self.attackMap.update(changes)
             # update king's location if unmove
             if move.pieceMoved == "wK":
                 self.whiteKingLocation = (move.startRow, move.startCol)
@@ -64,16 +876,81 @@ class GameState():
             
     def getValidMoves(self) -> list:
         """
-        Get the valid moves
+        Get the valid moves, through the shared legal move cache
+
+        Returns:
+            _list_: The list of valid moves
+        """
+        return [Move.fromID(moveID) for moveID in cachedValidMoveIDs(self)]
+
+    def getValidMoveIDs(self, moves=None) -> array:
+        """
+        Get the valid moves as packed move IDs. Checks and pins are found once per position by scanning rays
+        out from the king, so each pseudo-legal move is accepted or rejected without replaying it. Only en
+        passant captures, which can uncover the king along the rank, are replayed to test them.
+
+        Args:
+            moves (_array_, optional): A preallocated array to fill, cleared first. A new one is made if omitted.
+
+        Returns:
+            _array_: The packed IDs of the valid moves
+        """
+        if moves is None:
+            moves = array("I")
+        else:
+            del moves[:]
+        allyColor = "w" if self.whiteToMove else "b"
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        blockSquares = checks[0] if len(checks) == 1 else None
+        for r in range(len(self.board)): # number of rows
+            for c in range(len(self.board[r])): # number of columns
+                if self.board[r][c][0] != allyColor:
+                    continue
+                piece = self.board[r][c][1]
+                if piece == "K":
+                    kingMoves = []
+                    self.getKingMoves(r, c, kingMoves)
+                    for moveID in kingMoves:
+                        if self.isKingMoveSafe(moveID):
+                            moves.append(moveID)
+                    continue
+                if len(checks) > 1: # double check, only the king can move
+                    continue
+                allowed = pins.get(r * 8 + c)
+                if blockSquares is not None:
+                    allowed = blockSquares if allowed is None else allowed & blockSquares
+                if allowed is None:
+                    self.moveFunction[piece](r, c, moves)
+                    continue
+                pieceMoves = []
+                self.moveFunction[piece](r, c, pieceMoves)
+                for moveID in pieceMoves:
+                    if moveID >> 6 & 63 in allowed:
+                        moves.append(moveID)
+        if self.enPassantSquare >= 0 and len(checks) < 2:
+            enPassantMoves = []
+            self.getEnPassantMoves(enPassantMoves)
+            for moveID in enPassantMoves:
+                if self.isEnPassantSafe(moveID):
+                    moves.append(moveID)
+        if self.castlingRights and not checks:
+            self.getCastleMoves(moves, self.attackMap.counts[1 if self.whiteToMove else 0].__getitem__)
+        return moves
+
+    def getValidMovesReference(self) -> list:
+        """
+        Get the valid moves by playing every pseudo-legal move and testing for check.
+        This is the slow reference path used to cross-check getValidMoves.
 
         Returns:
             _list_: The list of valid moves
         """
         moves = self.getAllPossibleMoves()
-        for i in range(len(moves) - 1, -1, -1): 
+        for i in range(len(moves) - 1, -1, -1):
             self.makeMove(moves[i])
             self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
+            if self.inCheckRescan():
                 moves.remove(moves[i])
             self.whiteToMove = not self.whiteToMove
             self.undoMove()
@@ -81,7 +958,17 @@ class GameState():
     
     def inCheck(self) -> bool:
         """
-        Check if the king is in check
+        Check if the king is in check, a lookup in the attack map
+        """
+        if self.whiteToMove:
+            return self.attackMap.counts[1][self.whiteKingLocation[0] * 8 + self.whiteKingLocation[1]] > 0
+        else:
+            return self.attackMap.counts[0][self.blackKingLocation[0] * 8 + self.blackKingLocation[1]] > 0
+
+    def inCheckRescan(self) -> bool:
+        """
+        Check if the king is in check by scanning out from it, without the attack map.
+        This is the full recompute path the attack map is benchmarked and cross-checked against.
         """
         if self.whiteToMove:
             return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
@@ -90,20 +977,144 @@ class GameState():
         
     def squareUnderAttack(self, r, c) -> bool:
         """
-        Check if the square is under attack
+        Check if the square is under attack by the side not to move. The scan runs outward from
+        the square and stops at the first attacker, so no moves are generated.
 
         Args:
             r (int): The row of the square
             c (int): The column of the square
         """
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+        board = self.board
+        if self.whiteToMove:
+            enemyColor, enemyPawn, enemyKnight, enemyKing, pawnRow = "b", "bp", "bN", "bK", r - 1
+        else:
+            enemyColor, enemyPawn, enemyKnight, enemyKing, pawnRow = "w", "wp", "wN", "wK", r + 1
+        # pawns, knights and the king only reach the squares of their tables
+        if 0 <= pawnRow < 8:
+            if c - 1 >= 0 and board[pawnRow][c - 1] == enemyPawn:
+                return True
+            if c + 1 <= 7 and board[pawnRow][c + 1] == enemyPawn:
                 return True
+        for sq in KNIGHT_TARGETS[r * 8 + c]:
+            if board[sq >> 3][sq & 7] == enemyKnight:
+                return True
+        for sq in KING_TARGETS[r * 8 + c]:
+            if board[sq >> 3][sq & 7] == enemyKing:
+                return True
+        for dr, dc, attackers in (
+                (-1, 0, "RQ"), (0, -1, "RQ"), (1, 0, "RQ"), (0, 1, "RQ"),
+                (-1, -1, "BQ"), (-1, 1, "BQ"), (1, -1, "BQ"), (1, 1, "BQ")):
+            endRow = r + dr
+            endCol = c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece[0] == enemyColor and endPiece[1] in attackers:
+                        return True
+                    break
+                endRow += dr
+                endCol += dc
         return False
-    
+
+    def checkForPinsAndChecks(self, r, c) -> tuple:
+        """
+        Scan rays out from a king square to find the pieces pinned to it and the pieces checking it
+
+        Args:
+            r (int): The row of the king
+            c (int): The column of the king
+
+        Returns:
+            tuple: (pins, checks) where pins maps a pinned square index (row * 8 + col) to the square indexes
+                it may still move to, and checks is a list with, per checker, the square indexes that capture or block it
+        """
+        pins = {}
+        checks = []
+        allyColor = "w" if self.whiteToMove else "b"
+        enemyColor = "b" if self.whiteToMove else "w"
+        directions = (
+            ((-1, 0), "RQ"), ((0, -1), "RQ"), ((1, 0), "RQ"), ((0, 1), "RQ"),
+            ((-1, -1), "BQ"), ((-1, 1), "BQ"), ((1, -1), "BQ"), ((1, 1), "BQ")
+        )
+        pawnRow = -1 if self.whiteToMove else 1 # enemy pawns attack the king from this side
+        for d, attackers in directions:
+            ray = []
+            possiblePin = None
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                ray.append(endRow * 8 + endCol)
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == allyColor:
+                    if possiblePin is not None: # second allied piece, no pin in this direction
+                        break
+                    possiblePin = endRow * 8 + endCol
+                    continue
+                pieceType = endPiece[1]
+                if pieceType in attackers or (i == 1 and (
+                        pieceType == "K" or (pieceType == "p" and d[0] == pawnRow and d[1] != 0))):
+                    if possiblePin is None:
+                        checks.append(set(ray))
+                    else:
+                        pins[possiblePin] = set(ray)
+                break
+        # a knight checks by jumping, it can be captured but not blocked and pins nothing
+        enemyKnight = enemyColor + "N"
+        for sq in KNIGHT_TARGETS[r * 8 + c]:
+            if self.board[sq >> 3][sq & 7] == enemyKnight:
+                checks.append({sq})
+        return pins, checks
+
+    def isKingMoveSafe(self, moveID) -> bool:
+        """
+        Check that a king move does not land on an attacked square
+
+        Args:
+            moveID (int): The packed ID of the king move to test
+        """
+        start = moveID & 63
+        end = moveID >> 6 & 63
+        enemy = 1 if self.whiteToMove else 0
+        if self.attackMap.counts[enemy][end]:
+            return False
+        # a line piece checking the king also covers the square behind it, which the king's own square hides
+        kingRow, kingCol = divmod(start, 8)
+        stepRow, stepCol = divmod(end, 8)
+        stepRow -= kingRow
+        stepCol -= kingCol
+        attackers = self.attackMap.attackers[start]
+        while attackers:
+            low = attackers & -attackers
+            attackers ^= low
+            sq = low.bit_length() - 1
+            code = self.attackMap.squares[sq]
+            if (code > 6) != enemy or PIECES[code][1] not in "BRQ":
+                continue
+            r, c = divmod(sq, 8)
+            dr = kingRow - r
+            dc = kingCol - c
+            if (dr > 0) - (dr < 0) == stepRow and (dc > 0) - (dc < 0) == stepCol:
+                return False
+        return True
+
+    def isEnPassantSafe(self, moveID) -> bool:
+        """
+        Check that an en passant capture does not leave the king attacked. Two pawns leave the rank at once,
+        which can uncover a rook or queen no pin scan sees, so the capture is made and unmade.
+
+        Args:
+            moveID (int): The packed ID of the en passant capture to test
+        """
+        self.makeMove(Move.fromID(moveID))
+        kingRow, kingCol = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        safe = not self.attackMap.counts[0 if self.whiteToMove else 1][kingRow * 8 + kingCol]
+        self.undoMove()
+        return safe
+
     def getAllPossibleMoves(self) -> list:
         """
         Get all the possible moves
@@ -115,41 +1126,110 @@ class GameState():
                 if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
                     piece = self.board[r][c][1]
                     self.moveFunction[piece](r, c, move)
-        return move
+        if self.enPassantSquare >= 0:
+            self.getEnPassantMoves(move)
+        if self.castlingRights and not self.inCheckRescan():
+            self.getCastleMoves(move, lambda sq: self.squareUnderAttack(sq >> 3, sq & 7))
+        return [Move.fromID(moveID) for moveID in move]
     
     
     def getPawnMoves(self, r, c, moves) -> None:
         """
-        Get the pawn moves
+        Get the pawn moves. A move onto the last rank is added once per promotion piece.
 
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
+        moveBits = r * 8 + c | PIECE_CODES[self.board[r][c]] << 12
         if self.whiteToMove:
+            if r == 1:
+                self.getPromotionMoves(r, c, -1, "b", moveBits, PROMOTION_FLAGS["w"], moves)
+                return
             if self.board[r-1][c] == "--":
-                moves.append(Move((r, c), (r-1, c), self.board))
+                moves.append(moveBits | (r-1) * 8 + c << 6)
                 if r == 6 and self.board[r-2][c] == "--":
-                    moves.append(Move((r, c), (r-2, c), self.board))
+                    moves.append(moveBits | (r-2) * 8 + c << 6)
             if c-1 >= 0:
                 if self.board[r-1][c-1][0] == "b":
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
+                    moves.append(moveBits | (r-1) * 8 + c-1 << 6 | PIECE_CODES[self.board[r-1][c-1]] << 16)
             if c+1 <= 7:
                 if self.board[r-1][c+1][0] == "b":
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
+                    moves.append(moveBits | (r-1) * 8 + c+1 << 6 | PIECE_CODES[self.board[r-1][c+1]] << 16)
                     
         else: 
+            if r == 6:
+                self.getPromotionMoves(r, c, 1, "w", moveBits, PROMOTION_FLAGS["b"], moves)
+                return
             if self.board[r+1][c] == "--":
-                moves.append(Move((r, c), (r+1, c), self.board))
+                moves.append(moveBits | (r+1) * 8 + c << 6)
                 if r == 1 and self.board[r+2][c] == "--":
-                    moves.append(Move((r, c), (r+2, c), self.board))
+                    moves.append(moveBits | (r+2) * 8 + c << 6)
             if c-1 >= 0:
                 if self.board[r+1][c-1][0] == "w":
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
+                    moves.append(moveBits | (r+1) * 8 + c-1 << 6 | PIECE_CODES[self.board[r+1][c-1]] << 16)
             if c+1 <= 7:
                 if self.board[r+1][c+1][0] == "w":
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
+                    moves.append(moveBits | (r+1) * 8 + c+1 << 6 | PIECE_CODES[self.board[r+1][c+1]] << 16)
+
+    def getPromotionMoves(self, r, c, dr, enemyColor, moveBits, promotions, moves) -> None:
+        """
+        Get the moves of a pawn one step from the last rank, each once per promotion piece
+
+        Args:
+            r (int): The row of the square
+            c (int): The column of the square
+            dr (int): The row step of the pawn, -1 for white
+            enemyColor (str): "w" or "b"
+            moveBits (int): The start square and moved piece bits
+            promotions (tuple): The promoted piece bits of each promotion piece
+            moves (_list_): The list of packed move IDs
+        """
+        endRow = r + dr
+        targets = []
+        if self.board[endRow][c] == "--":
+            targets.append(moveBits | endRow * 8 + c << 6)
+        for endCol in (c - 1, c + 1):
+            if 0 <= endCol <= 7 and self.board[endRow][endCol][0] == enemyColor:
+                targets.append(moveBits | endRow * 8 + endCol << 6 | PIECE_CODES[self.board[endRow][endCol]] << 16)
+        for moveID in targets:
+            for promotion in promotions:
+                moves.append(moveID | promotion)
+
+    def getEnPassantMoves(self, moves) -> None:
+        """
+        Get the en passant captures onto the en passant square, before testing them against checks
+
+        Args:
+            moves (_list_): The list of packed move IDs
+        """
+        endRow, endCol = divmod(self.enPassantSquare, 8)
+        pawn, captured, r = ("wp", "bp", endRow + 1) if self.whiteToMove else ("bp", "wp", endRow - 1)
+        moveBits = self.enPassantSquare << 6 | PIECE_CODES[pawn] << 12 | PIECE_CODES[captured] << 16 | EN_PASSANT_FLAG
+        for c in (endCol - 1, endCol + 1):
+            if 0 <= c <= 7 and self.board[r][c] == pawn:
+                moves.append(moveBits | r * 8 + c)
+
+    def getCastleMoves(self, moves, isAttacked) -> None:
+        """
+        Get the castling moves. The caller checks that the king is not in check.
+
+        Args:
+            moves (_list_): The list of packed move IDs
+            isAttacked (callable): Takes a square index, truthy if the enemy attacks it
+        """
+        if self.whiteToMove:
+            kingBits = 60 | PIECE_CODES["wK"] << 12 | CASTLE_FLAG
+            ends = (62, 58)
+        else:
+            kingBits = 4 | PIECE_CODES["bK"] << 12 | CASTLE_FLAG
+            ends = (6, 2)
+        for end in ends:
+            right, _, _, empty, crossed = CASTLINGS[end]
+            if (self.castlingRights & right and all(self.board[sq >> 3][sq & 7] == "--" for sq in empty)
+                    and not any(isAttacked(sq) for sq in crossed)):
+                moves.append(kingBits | end << 6)
                     
     def getRookMoves(self, r, c, moves) -> None:
         """
@@ -158,10 +1238,11 @@ class GameState():
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
         enemyColor = "b" if self.whiteToMove else "w"
+        moveBits = r * 8 + c | PIECE_CODES[self.board[r][c]] << 12
         for d in directions:
             for i in range(1, 8):
                 endRow = r + d[0] * i
@@ -169,9 +1250,9 @@ class GameState():
                 if 0 <= endRow < 8 and 0 <= endCol < 8:
                     endPiece = self.board[endRow][endCol]
                     if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6)
                     elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6 | PIECE_CODES[endPiece] << 16)
                         break
                     else:
                         break
@@ -180,30 +1261,20 @@ class GameState():
     
     def getKnightMoves(self, r, c, moves) -> None:
         """
-        Get the knight moves
+        Get the knight moves, from the table of knight jumps
 
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
-        directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
+        board = self.board
+        allyColor = "w" if self.whiteToMove else "b"
+        moveBits = r * 8 + c | PIECE_CODES[board[r][c]] << 12
+        for end in KNIGHT_TARGETS[r * 8 + c]:
+            endPiece = board[end >> 3][end & 7]
+            if endPiece[0] != allyColor:
+                moves.append(moveBits | end << 6 | PIECE_CODES[endPiece] << 16)
     
     def getBishopMoves(self, r, c, moves) -> None:
         """
@@ -212,10 +1283,11 @@ class GameState():
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
         directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
         enemyColor = "b" if self.whiteToMove else "w"
+        moveBits = r * 8 + c | PIECE_CODES[self.board[r][c]] << 12
         for d in directions:
             for i in range(1, 8):
                 endRow = r + d[0] * i
@@ -223,9 +1295,9 @@ class GameState():
                 if 0 <= endRow < 8 and 0 <= endCol < 8:
                     endPiece = self.board[endRow][endCol]
                     if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6)
                     elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6 | PIECE_CODES[endPiece] << 16)
                         break
                     else:
                         break
@@ -239,10 +1311,11 @@ class GameState():
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
         enemyColor = "b" if self.whiteToMove else "w"
+        moveBits = r * 8 + c | PIECE_CODES[self.board[r][c]] << 12
         for d in directions:
             for i in range(1, 8):
                 endRow = r + d[0] * i
@@ -250,9 +1323,9 @@ class GameState():
                 if 0 <= endRow < 8 and 0 <= endCol < 8:
                     endPiece = self.board[endRow][endCol]
                     if endPiece == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6)
                     elif endPiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(moveBits | endRow * 8 + endCol << 6 | PIECE_CODES[endPiece] << 16)
                         break
                     else:
                         break
@@ -261,31 +1334,35 @@ class GameState():
     
     def getKingMoves(self, r, c, moves) -> None:
         """
-        Get the king moves
+        Get the king moves, from the table of king steps. Castling is added by getCastleMoves.
 
         Args:
             r (int): The row of the square
             c (int): The column of the square
-            moves (_list_): The list of valid moves
+            moves (_list_): The list of packed move IDs
         """
-        directions = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+        board = self.board
         allyColor = "w" if self.whiteToMove else "b"
-        for d in directions:
-            endRow = r + d[0]
-            endCol = c + d[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        moveBits = r * 8 + c | PIECE_CODES[board[r][c]] << 12
+        for end in KING_TARGETS[r * 8 + c]:
+            endPiece = board[end >> 3][end & 7]
+            if endPiece[0] != allyColor:
+                moves.append(moveBits | end << 6 | PIECE_CODES[endPiece] << 16)
         
 class Move():
     """
     Move class, to keep track of player moves.
+    A move is packed into a single int, its moveID: start square in bits 0-5, end square in bits 6-11,
+    moved piece code in bits 12-15, captured piece code in bits 16-19, then EN_PASSANT_FLAG, CASTLE_FLAG and
+    the promoted piece code from PROMOTION_SHIFT. Squares are indexed row * 8 + col and piece codes index PIECES.
     """
+    __slots__ = ("moveID", "startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "piecePromoted", "isEnpassantMove", "isCastleMove")
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    pool = {} # moves are immutable, so one instance per moveID is shared
     def __init__(self, startSq, endSq, board) -> None:
         self.startRow = startSq[0]
         self.startCol = startSq[1]
@@ -293,8 +1370,37 @@ class Move():
         self.endCol = endSq[1]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        
+        self.piecePromoted = "--"
+        self.isEnpassantMove = False
+        self.isCastleMove = False
+        self.moveID = (self.startRow * 8 + self.startCol | (self.endRow * 8 + self.endCol) << 6
+                       | PIECE_CODES[self.pieceMoved] << 12 | PIECE_CODES[self.pieceCaptured] << 16)
+
+    @classmethod
+    def fromID(cls, moveID) -> "Move":
+        """
+        Get the move for a packed move ID, reusing the pooled instance when there is one
+
+        Args:
+            moveID (int): The packed move ID
+
+        Returns:
+            Move: The move
+        """
+        move = cls.pool.get(moveID)
+        if move is None:
+            move = cls.__new__(cls)
+            move.moveID = moveID
+            move.startRow, move.startCol = divmod(moveID & 63, 8)
+            move.endRow, move.endCol = divmod(moveID >> 6 & 63, 8)
+            move.pieceMoved = PIECES[moveID >> 12 & 15]
+            move.pieceCaptured = PIECES[moveID >> 16 & 15]
+            move.piecePromoted = PIECES[moveID >> PROMOTION_SHIFT & 15]
+            move.isEnpassantMove = bool(moveID & EN_PASSANT_FLAG)
+            move.isCastleMove = bool(moveID & CASTLE_FLAG)
+            cls.pool[moveID] = move
+        return move
+
     def __eq__(self, other) -> bool:
         """
         Check if two moves are equal
@@ -306,9 +1412,12 @@ class Move():
             bool: __
         """
         if isinstance(other, Move):
-            return self.moveID == other.moveID  
+            return self.moveID == other.moveID
         return False
-        
+
+    def __hash__(self) -> int:
+        return self.moveID
+
     def getChessNotation(self) -> str:
         """
         Get the chess notation
@@ -316,7 +1425,10 @@ class Move():
         Returns:
             _None_: __
         """
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.piecePromoted != "--":
+            notation += self.piecePromoted[1].lower()
+        return notation
     
     def getRankFile(self, r, c) -> str:
         """
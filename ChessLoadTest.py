@@ -0,0 +1,269 @@
+"""
+Load test for the chess server. Simulates pairs of ChessMain clients without pygame: one player sends 'new', the
+other joins the room, then they play random legal moves at a fixed rate. Reports round-trip latency percentiles,
+moves/sec, errors and the server's memory over time. Spectators can be added to every game to measure fan-out,
+idle ones never read and exercise the server's slow consumer policy. Everything runs on localhost.
+
+    python3 ChessLoadTest.py --players 2000 --rate 1 --duration 60 --spawn-server
+    python3 ChessLoadTest.py --players 2 --spectators 2000 --rate 5 --spawn-server
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import ChessEngine
+import ChessBitboard
+import ChessProtocol
+import ChessServerBench
+import ChessServerCore
+from Console import print_c
+
+HOST = "127.0.0.1"
+
+
+class LoadStats():
+    """
+    Counters shared by every simulated game
+    """
+    def __init__(self) -> None:
+        self.latencies = []
+        self.moves = 0
+        self.games = 0
+        self.spectatorUpdates = 0
+        self.errors = {}
+
+    def error(self, kind) -> None:
+        """
+        Count an error
+
+        Args:
+            kind (str): Short description of the error
+        """
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimulatedPlayer():
+    """
+    A headless client connection speaking the same signals as ChessMain.ChessGame
+    """
+    def __init__(self, reader, writer) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.decoder = ChessProtocol.FrameDecoder()
+        self.inbox = []
+
+    def send_message(self, message, signal) -> None:
+        self.writer.write(ChessProtocol.encodeMessage(signal, message))
+
+    def send_move(self, move) -> None:
+        promotion = move.piecePromoted[1] if move.piecePromoted != "--" else None
+        self.writer.write(ChessProtocol.encodeMove((move.startRow, move.startCol), (move.endRow, move.endCol), promotion))
+
+    async def receive(self, timeout) -> dict:
+        """
+        Wait for the next message
+
+        Args:
+            timeout (float): Seconds to wait
+
+        Returns:
+            dict: The message
+        """
+        while not self.inbox:
+            data = await asyncio.wait_for(self.reader.read(4096), timeout)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.inbox.extend(self.decoder.feed(data))
+        return self.inbox.pop(0)
+
+
+async def connect(port) -> SimulatedPlayer:
+    reader, writer = await asyncio.open_connection(HOST, port)
+    return SimulatedPlayer(reader, writer)
+
+
+async def watch(spectator, stats) -> None:
+    """
+    Read everything sent to a spectator until the connection closes
+
+    Args:
+        spectator (SimulatedPlayer): The spectator
+        stats (LoadStats): The shared counters
+    """
+    try:
+        while True:
+            data = await spectator.reader.read(65536)
+            if not data:
+                break
+            stats.spectatorUpdates += len(spectator.decoder.feed(data))
+    except (ConnectionError, ChessProtocol.ProtocolError):
+        pass
+
+
+async def runGame(stats, port, rate, deadline, maxPlies, backend, timeout, spectators=0, idleSpectators=False) -> None:
+    """
+    Keep one pair of players busy until the deadline, starting a new game whenever one ends
+
+    Args:
+        stats (LoadStats): The shared counters
+        port (int): The server port on localhost
+        rate (float): Moves per second of the game
+        deadline (float): time.perf_counter() value to stop at
+        maxPlies (int): Start a new game after this many moves
+        backend (str): The GameState backend used to pick moves
+        timeout (float): Seconds to wait for any reply
+        spectators (int): Spectators joining every game
+        idleSpectators (bool): Whether the spectators never read what they are sent
+    """
+    try:
+        white, black = await connect(port), await connect(port)
+        watchers = [await connect(port) for _ in range(spectators)]
+    except OSError as e:
+        stats.error(f"connect: {e.__class__.__name__}")
+        return
+    readers = [] if idleSpectators else [asyncio.create_task(watch(watcher, stats)) for watcher in watchers]
+    try:
+        while time.perf_counter() < deadline:
+            white.send_message('new', 'new')
+            room = (await white.receive(timeout)).get('data')
+            await white.receive(timeout)  # seat
+            black.send_message(room, 'join')
+            reply = await black.receive(timeout)
+            if reply.get('signal') != 'join':
+                stats.error(f"join: {reply.get('data')}")
+                return
+            await black.receive(timeout)  # seat
+            for watcher in watchers:
+                watcher.send_message(room, 'join')
+            stats.games += 1
+            gs = ChessBitboard.BACKENDS[backend]()
+            for _ in range(maxPlies):
+                moves = gs.getValidMoveIDs()
+                if len(moves) == 0 or time.perf_counter() >= deadline:
+                    break
+                move = ChessEngine.Move.fromID(random.choice(moves))
+                mover, other = (white, black) if gs.whiteToMove else (black, white)
+                sent = time.perf_counter()
+                mover.send_move(move)
+                reply = await mover.receive(timeout)
+                if reply.get('signal') != 'move':
+                    stats.error(f"move: {reply.get('data')}")
+                    return
+                stats.latencies.append(time.perf_counter() - sent)
+                stats.moves += 1
+                await other.receive(timeout)
+                gs.makeMove(move)
+                await asyncio.sleep(1 / rate)
+            white.send_message(None, 'quit')
+            black.send_message(None, 'quit')
+    except asyncio.TimeoutError:
+        stats.error("timeout")
+    except (ConnectionError, ChessProtocol.ProtocolError) as e:
+        stats.error(f"connection: {e.__class__.__name__}")
+    finally:
+        for connection in [white, black] + watchers:
+            connection.writer.close()
+        for reader in readers:
+            reader.cancel()
+
+
+def percentile(values, fraction) -> float:
+    """
+    Get a percentile of sorted values
+
+    Args:
+        values (_list_): The sorted values
+        fraction (float): The percentile as a fraction, 0.99 for p99
+
+    Returns:
+        float: The value, 0 if there are none
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def runLoadTest(players, port, rate, duration, maxPlies, backend, timeout, serverPid, spectators=0,
+                      idleSpectators=False) -> LoadStats:
+    """
+    Run the simulated games and print a progress line every second
+
+    Args:
+        players (int): Number of simulated players, two per game
+        port (int): The server port on localhost
+        rate (float): Moves per second of each game
+        duration (float): Seconds to run
+        maxPlies (int): Start a new game after this many moves
+        backend (str): The GameState backend used to pick moves
+        timeout (float): Seconds to wait for any reply
+        serverPid (int, optional): The server process, to sample its memory
+        spectators (int): Spectators joining every game
+        idleSpectators (bool): Whether the spectators never read what they are sent
+
+    Returns:
+        LoadStats: The counters
+    """
+    stats = LoadStats()
+    start = time.perf_counter()
+    deadline = start + duration
+    tasks = [asyncio.create_task(runGame(stats, port, rate, deadline, maxPlies, backend, timeout,
+                                                  spectators, idleSpectators)) for _ in range(players // 2)]
+    print(f"{'seconds':>8}{'moves':>10}{'moves/sec':>11}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'server RSS MB':>15}")
+    lastMoves = 0
+    while any(not task.done() for task in tasks):
+        await asyncio.sleep(1.0)
+        latencies = sorted(stats.latencies[-5000:])
+        memory = ChessServerBench.residentMemory(serverPid) if serverPid else -1
+        print(f"{time.perf_counter() - start:>8.0f}{stats.moves:>10}{stats.moves - lastMoves:>11}"
+              f"{percentile(latencies, 0.5) * 1000:>9.2f}{percentile(latencies, 0.99) * 1000:>9.2f}"
+              f"{sum(stats.errors.values()):>8}{memory / 2 ** 20 if memory >= 0 else float('nan'):>15.1f}")
+        lastMoves = stats.moves
+    await asyncio.gather(*tasks)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chess server with simulated players")
+    parser.add_argument("--players", type=int, default=1000, help="number of simulated players, two per game")
+    parser.add_argument("--rate", type=float, default=1.0, help="moves per second of each game")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--max-plies", type=int, default=120, help="start a new game after this many moves")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for a reply")
+    parser.add_argument("--port", type=int, default=ChessServerCore.SERVER_PORT, help="server port on localhost")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend used to pick moves")
+    parser.add_argument("--spectators", type=int, default=0, help="spectators joining every game")
+    parser.add_argument("--idle-spectators", action="store_true", help="spectators never read what they are sent")
+    parser.add_argument("--spawn-server", action="store_true", help="start a headless server for the run")
+    parser.add_argument("--server-pid", type=int, help="pid of an already running server, to sample its memory")
+    args = parser.parse_args()
+    ChessServerCore.raiseFileLimit()
+    server = None
+    serverPid = args.server_pid
+    if args.spawn_server:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ChessServerCore.py"),
+                                   "--host", HOST, "--port", str(args.port)], stdout=subprocess.DEVNULL)
+        serverPid = server.pid
+        time.sleep(1.0)
+    try:
+        start = time.perf_counter()
+        stats = asyncio.run(runLoadTest(args.players, args.port, args.rate, args.duration, args.max_plies, args.backend,
+                                        args.timeout, serverPid, args.spectators, args.idle_spectators))
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    latencies = sorted(stats.latencies)
+    if args.spectators and not args.idle_spectators:
+        print_c.info(f"{stats.spectatorUpdates} updates delivered to spectators")
+    print_c.info(f"{stats.games} games, {stats.moves} moves in {elapsed:.1f}s, {stats.moves / elapsed:.0f} moves/sec")
+    print_c.info(f"round trip p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p95 {percentile(latencies, 0.95) * 1000:.2f} ms, "
+                 f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+    if stats.errors:
+        for kind, count in sorted(stats.errors.items()):
+            print_c.error(f"{count} x {kind}")
+    else:
+        print_c.success("No errors")
@@ -1,27 +1,40 @@
 import pygame as p
 import ChessEngine
+import ChessBitboard
+import ChessProtocol
+import ChessWorker
 from Console import print_c
 import socket
 import threading
-import json
+import queue
+import time
 import sys
 
 class ChessGame:
-    def __init__(self, server_ip='localhost', server_port=4953):
+    def __init__(self, server_ip='localhost', server_port=4953, backend='board'):
         p.init()
         p.display.set_caption('Chess Game')
         self.WIDTH = self.HEIGHT = 512
         self.DIMENSION = 8
         self.SQ_SIZE = self.HEIGHT // self.DIMENSION
         self.MAX_FPS = 15
+        self.HINT_SECONDS = 2.0
         self.IMAGES = {}
         self.SERVER_IP = server_ip
         self.SERVER_PORT = server_port
+        self.BACKEND = backend
         self.screen = p.display.set_mode((self.WIDTH, self.HEIGHT))
         self.clock = p.time.Clock()
         self.sock = None
+        self.sock_lock = threading.Lock()  # reconnect swaps the socket on the network thread while the game sends on it
         self.online = False
+        self.incoming_moves = queue.Queue()
+        self.pending_room = None
+        self.seat = None
+        self.RECONNECT_ATTEMPTS = 5
         self.running = False
+        self.engine = ChessWorker.EngineWorker()
+        self.engine.start()
 
         self.loadImages()
         self.start()
@@ -44,6 +57,10 @@ class ChessGame:
         while True:
             self.screen.fill((0, 0, 0))
             self.display_menu_options()
+            if self.pending_room is not None:  # rooms are played on the main thread, not the network thread
+                room_number, self.pending_room = self.pending_room, None
+                p.display.set_caption(f"ROOM: {str(room_number)}")
+                self.play_game(room_number=room_number)
             for e in p.event.get():
                 if e.type == p.QUIT:
                     p.quit()
@@ -80,12 +97,13 @@ class ChessGame:
     def play_game(self, room_number=None):
         """Main game loop."""
         print_c.info('Starting game...')
-        gs = ChessEngine.GameState()
-        valid_moves = gs.getValidMoves()
-        move_made = False
+        gs = ChessBitboard.BACKENDS[self.BACKEND]()
         running = True
         sq_selected = ()
         player_clicks = []
+        valid_moves = {}  # short move ID -> move ID, filled in by the engine worker
+        hint = None
+        position_changed = True
 
         while running:
             for e in p.event.get():
@@ -102,42 +120,79 @@ class ChessGame:
                         sq_selected = (row, column)
                         player_clicks.append(sq_selected)
                     if len(player_clicks) == 2:
-                        move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)
-                        if move in valid_moves:
-                            gs.makeMove(move)
-                            move_made = True
+                        move = self.find_move(valid_moves, player_clicks[0], player_clicks[1])
+                        if move is not None:
+                            if room_number is None:
+                                gs.makeMove(move)
+                                position_changed = True
+                            else:  # the server plays it once it is accepted
+                                self.send_move(move)
                             sq_selected = ()
                             player_clicks = []
                         else:
                             player_clicks = [sq_selected]
 
                 elif e.type == p.KEYDOWN:
-                    if e.key == p.K_z:
+                    if e.key == p.K_z and room_number is None:
                         gs.undoMove()
-                        move_made = True
+                        position_changed = True
+                    elif e.key == p.K_h:  # ask the engine for a move, shown when it answers
+                        self.engine.submit(ChessWorker.SEARCH, gs, self.HINT_SECONDS)
 
-            if move_made:
-                valid_moves = gs.getValidMoves()
-                move_made = False
+            while not self.incoming_moves.empty():
+                update = self.incoming_moves.get()
+                position_changed = True
+                if isinstance(update, bytes):  # snapshot after reconnecting, falling behind or joining a game in progress
+                    ChessEngine.unpackPosition(update, gs)
+                else:
+                    (start_row, start_col), (end_row, end_col), promotion = update
+                    move = ChessEngine.findMove(gs, start_row * 8 + start_col, end_row * 8 + end_col, promotion or "Q")
+                    if move is None:
+                        print_c.error(f"Server sent a move that is not legal here: {update}")
+                    else:
+                        gs.makeMove(move)
+
+            if position_changed:  # whatever the engine is working on is stale, an undo included
+                self.engine.cancel()
+                self.engine.submit(ChessWorker.LEGAL_MOVES, gs)
+                valid_moves = {}
+                hint = None
+                position_changed = False
+
+            for result in self.engine.poll():
+                if result.key != gs.zobristKey:
+                    continue
+                if result.kind == ChessWorker.LEGAL_MOVES:
+                    valid_moves = {ChessEngine.shortMoveID(move_id): move_id for move_id in result.value}
+                elif result.value.move is not None:
+                    hint = result.value.move
 
-            self.draw_game_state(gs, sq_selected)
+            self.draw_game_state(gs, sq_selected, hint)
             self.clock.tick(self.MAX_FPS)
             p.display.flip()
 
         self.quit_game()
 
-    def draw_game_state(self, gs, sq_selected):
+    def find_move(self, valid_moves, start_sq, end_sq):
+        """Match two clicked squares to a legal move, pawns promote to a queen. None until the engine has answered."""
+        short_id = start_sq[0] * 8 + start_sq[1] | (end_sq[0] * 8 + end_sq[1]) << 6
+        move_id = valid_moves.get(short_id, valid_moves.get(short_id | ChessEngine.PROMOTION_PIECES.index("Q") + 1 << 12))
+        return ChessEngine.Move.fromID(move_id) if move_id is not None else None
+
+    def draw_game_state(self, gs, sq_selected, hint=None):
         """Draw the current game state."""
-        self.draw_board(gs, sq_selected)
+        self.draw_board(gs, sq_selected, hint)
         self.draw_pieces(gs.board)
 
-    def draw_board(self, gs, sq_selected):
+    def draw_board(self, gs, sq_selected, hint=None):
         """Draw the chessboard."""
         colors = [p.Color("white"), p.Color("gray")]
         in_check = gs.inCheck()
         for r in range(self.DIMENSION):
             for c in range(self.DIMENSION):
                 color = colors[(r + c) % 2]
+                if hint is not None and (r, c) in ((hint.startRow, hint.startCol), (hint.endRow, hint.endCol)):
+                    color = p.Color("#A7C7E7")
                 if sq_selected == (r, c):
                     color = p.Color("#ECDFCC") 
                 if in_check:
@@ -169,51 +224,103 @@ class ChessGame:
             print_c.error(f"Error connecting to server: {e}")
             
     def handlerServer(self) -> None:
-        """Handle server messages."""
+        """Handle server messages, reconnecting to our seat if the connection drops mid-game."""
+        decoder = ChessProtocol.FrameDecoder()
         while self.running:
             try:
-                data = self.sock.recv(1024)
-                if not data:
+                messages = ChessProtocol.recvMessages(self.sock, decoder)
+                if messages is None:
+                    print_c.warning("Server closed the connection")
+                else:
+                    for message in messages:
+                        self.handle_message(message)
                     continue
-                message = json.loads(data.decode())   
-                
-                signal = message.get('signal')
-                data = message.get('data')
-                
-                if signal == 'join':
-                    room_number = data
-                    print_c.success(f"Joined room {room_number}")
-                    
-                elif signal == 'new':
-                    room_number = data
-                    self.play_game(room_number=room_number)
-                    p.display.set_caption(f"ROOM: {str(room_number)}")
-                    print_c.success(f"New room {room_number} created")
-                    
             except Exception as e:
-                print_c.error(f"Error connecting to server: {e}")        
+                print_c.error(f"Error connecting to server: {e}")
+            if self.seat is None or not self.reconnect():
+                self.running = False
                 break
+            decoder = ChessProtocol.FrameDecoder()
+
+    def reconnect(self) -> bool:
+        """Open a new connection and ask the server for our held seat back."""
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            time.sleep(0.5 * 2 ** attempt)
+            try:
+                with self.sock_lock:
+                    self.sock.close()
+                sock = socket.create_connection((self.SERVER_IP, self.SERVER_PORT))
+                with self.sock_lock:
+                    self.sock = sock
+                    ChessProtocol.sendMessage(sock, 'rejoin', {'room': self.seat['room'], 'token': self.seat['token']})
+                print_c.success(f"Reconnected to {self.SERVER_IP}:{self.SERVER_PORT}")
+                return True
+            except OSError as e:
+                print_c.warning(f"Reconnect attempt {attempt + 1} failed: {e}")
+        return False
+
+    def handle_message(self, message: dict) -> None:
+        """Act on one decoded server message."""
+        signal = message.get('signal')
+        data = message.get('data')
+        
+        if signal == 'join':
+            room_number = data
+            print_c.success(f"Joined room {room_number}")
+            self.pending_room = room_number
+            
+        elif signal == 'new':
+            room_number = data
+            print_c.success(f"New room {room_number} created")
+            self.pending_room = room_number
+
+        elif signal == 'seat':
+            self.seat = data
+            print_c.info(f"Playing {'white' if data['color'] == 'w' else 'black'} in room {data['room']}")
+
+        elif signal == 'rejoin':
+            print_c.success(f"Rejoined room {data}")
+
+        elif signal == 'queued':
+            print_c.info(f"Waiting for an opponent, {data} player(s) in the queue")
+
+        elif signal == 'move':
+            start_sq, end_sq, *promotion = data
+            self.incoming_moves.put((tuple(start_sq), tuple(end_sq), promotion[0] if promotion else None))
+
+        elif signal == 'snapshot':
+            self.incoming_moves.put(bytes.fromhex(data['position']))
+
+        elif signal == 'error':
+            print_c.error(f"Server: {data}")
             
     def send_message(self, message: str, signal: str, to: str = 'server') -> None:
         """Send a message to the server or another player."""
         if self.running:
-            message_payload = {
-                'signal': signal,
-                'data': message,
-            }
-            
             try:
-                self.sock.send(
-                    json.dumps(message_payload).encode()
-                )
-                print_c.message(f"Sent message: {message_payload}")
+                with self.sock_lock:
+                    ChessProtocol.sendMessage(self.sock, signal, message)
+                print_c.message(f"Sent {signal} message: {message}")
             except Exception as e:
                 print_c.error(f"Error sending message to server: {e}")
         else:
             print("Not connected to server")
         
+    def send_move(self, move) -> None:
+        """Send a move to the server as a compact move frame."""
+        if self.running:
+            try:
+                promotion = move.piecePromoted[1] if move.piecePromoted != "--" else None
+                frame = ChessProtocol.encodeMove((move.startRow, move.startCol), (move.endRow, move.endCol), promotion)
+                with self.sock_lock:
+                    self.sock.sendall(frame)
+            except Exception as e:
+                print_c.error(f"Error sending move to server: {e}")
+        else:
+            print("Not connected to server")
+
     def join_game(self) -> None:
-        """Join a game by sending a 'join' signal to the server."""
+        """Ask the server to match us with the next waiting player."""
         self.send_message('join', 'join', 'server')
     
     def new_game(self) -> None:
@@ -222,9 +329,10 @@ class ChessGame:
         
     def quit_game(self) -> None:
         """Quit the game."""
+        self.engine.close()
         p.quit()
         sys.exit()
 
 if __name__ == '__main__':
-    game = ChessGame()
+    game = ChessGame(backend=sys.argv[1] if len(sys.argv) > 1 else 'board')
     game.start()
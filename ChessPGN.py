@@ -0,0 +1,375 @@
+"""
+PGN import and export. readGames streams games out of a PGN file one at a time, holding only the game being read,
+so multi-gigabyte files parse in constant memory. replayGame turns a game's SAN moves into a GameState and
+writeGame writes a move log back out as PGN. Positions use FEN, see ChessEngine.loadFen and ChessEngine.toFen.
+
+    python3 ChessPGN.py games.pgn --generate 1000   # write random games
+    python3 ChessPGN.py games.pgn                   # games/sec parsed
+    python3 ChessPGN.py games.pgn --replay          # games/sec parsed and replayed
+"""
+import argparse
+import random
+import re
+import time
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+import ChessEngine
+import ChessBitboard
+from Console import print_c
+
+FILES = "abcdefgh"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}?|;.*|[()]|\$\d+|[^\s{}();]+')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.*')
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(=?[NBRQ])?[+#!?]*$')
+CASTLING_PATTERN = re.compile(r'^([O0]-[O0](-[O0])?)[+#!?]*$')
+
+
+class PgnError(ValueError):
+    """
+    Raised when a game cannot be read or replayed
+    """
+
+
+class PgnGame():
+    """
+    One game as read from PGN: its tags, SAN moves and result
+    """
+    __slots__ = ("tags", "moves", "result")
+
+    def __init__(self) -> None:
+        self.tags = {}
+        self.moves = []
+        self.result = "*"
+
+
+def readGames(stream):
+    """
+    Read games from a PGN stream one at a time. Comments, variations and NAGs are skipped.
+
+    Args:
+        stream (_file_): A text stream, such as an open file
+
+    Yields:
+        PgnGame: Each game in the stream
+    """
+    game = PgnGame()
+    started = False
+    inComment = False
+    depth = 0
+    for line in stream:
+        if inComment:
+            close = line.find("}")
+            if close < 0:
+                continue
+            line = line[close + 1:]
+            inComment = False
+        elif line.startswith("%"):
+            continue
+        if depth == 0 and line.startswith("["):
+            match = TAG_PATTERN.match(line)
+            if match:
+                if game.moves:  # tags without a result before them start the next game
+                    yield game
+                    game = PgnGame()
+                game.tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                started = True
+                continue
+        for token in TOKEN_PATTERN.findall(line):
+            first = token[0]
+            if first == "{":
+                inComment = token[-1] != "}"
+            elif first == ";" or first == "$":
+                continue
+            elif first == "(":
+                depth += 1
+            elif first == ")":
+                depth = max(0, depth - 1)
+            elif depth:
+                continue
+            elif token in RESULTS:
+                game.result = token
+                yield game
+                game = PgnGame()
+                started = False
+            else:
+                if first.isdigit():
+                    token = MOVE_NUMBER_PATTERN.sub("", token)
+                    if not token:
+                        continue
+                game.moves.append(token)
+                started = True
+    if started:
+        yield game
+
+
+def squareName(square) -> str:
+    return FILES[square & 7] + str(8 - (square >> 3))
+
+
+def sanToMoveID(gs, san, moveIDs) -> int:
+    """
+    Find the legal move a SAN string names
+
+    Args:
+        gs (GameState): The position
+        san (str): The move, such as "Nbd7" or "exd5+"
+        moveIDs (_array_): The legal move IDs of the position
+
+    Returns:
+        int: The move ID
+
+    Raises:
+        PgnError: If the move is malformed, illegal or ambiguous
+    """
+    castling = CASTLING_PATTERN.match(san)
+    if castling is not None:
+        end = (2 if castling.group(2) else 6) | (56 if gs.whiteToMove else 0)
+        for moveID in moveIDs:
+            if moveID & ChessEngine.CASTLE_FLAG and (moveID >> 6 & 63) == end:
+                return moveID
+        raise PgnError(f"Illegal move {san}")
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        raise PgnError(f"Cannot read move {san!r}")
+    letter, file, rank, dest, promotion = match.groups()
+    color = "w" if gs.whiteToMove else "b"
+    code = ChessEngine.PIECE_CODES[color + (letter or "p")]
+    promoted = ChessEngine.PIECE_CODES[color + promotion[-1]] if promotion else 0
+    end = FILES.index(dest[0]) | (8 - int(dest[1])) << 3
+    candidates = []
+    for moveID in moveIDs:
+        start = moveID & 63
+        if (moveID >> 6 & 63) != end or (moveID >> 12 & 15) != code:
+            continue
+        if (moveID >> ChessEngine.PROMOTION_SHIFT & 15) != promoted or moveID & ChessEngine.CASTLE_FLAG:
+            continue
+        if file is not None and FILES[start & 7] != file:
+            continue
+        if rank is not None and 8 - (start >> 3) != int(rank):
+            continue
+        candidates.append(moveID)
+    if len(candidates) != 1:
+        raise PgnError(f"{'Ambiguous' if candidates else 'Illegal'} move {san}")
+    return candidates[0]
+
+
+def moveIDToSan(moveID, moveIDs) -> str:
+    """
+    Write a legal move as SAN, without the check suffix
+
+    Args:
+        moveID (int): The move ID
+        moveIDs (_array_): The legal move IDs of the position, for disambiguation
+
+    Returns:
+        str: The move, such as "Nbd7", "exd5", "e8=Q" or "O-O"
+    """
+    start = moveID & 63
+    end = moveID >> 6 & 63
+    code = moveID >> 12 & 15
+    capture = "x" if moveID >> 16 & 15 else ""
+    piece = ChessEngine.PIECES[code][1]
+    if moveID & ChessEngine.CASTLE_FLAG:
+        return "O-O" if end & 7 == 6 else "O-O-O"
+    if piece == "p":
+        promoted = moveID >> ChessEngine.PROMOTION_SHIFT & 15
+        promotion = "=" + ChessEngine.PIECES[promoted][1] if promoted else ""
+        return (FILES[start & 7] + capture if capture else "") + squareName(end) + promotion
+    others = [other & 63 for other in moveIDs if other != moveID and (other >> 6 & 63) == end and (other >> 12 & 15) == code]
+    origin = ""
+    if others:
+        if all((other & 7) != (start & 7) for other in others):
+            origin = FILES[start & 7]
+        elif all((other >> 3) != (start >> 3) for other in others):
+            origin = str(8 - (start >> 3))
+        else:
+            origin = squareName(start)
+    return piece + origin + capture + squareName(end)
+
+
+def newGame(fen=None, backend="board"):
+    """
+    Create a game state at the start position or a FEN position
+
+    Args:
+        fen (str): The FEN string, None for the start position
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        GameState: The game state
+    """
+    gs = ChessBitboard.BACKENDS[backend]()
+    if fen:
+        ChessEngine.loadFen(fen, gs)
+    return gs
+
+
+def replayGame(game, backend="board"):
+    """
+    Play a game's moves from its start position, the FEN tag if it has one
+
+    Args:
+        game (PgnGame): The game
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        GameState: The final position, with every move in its move log
+
+    Raises:
+        PgnError: If a move cannot be played, the message says which
+    """
+    gs = newGame(game.tags.get("FEN"), backend)
+    for ply, san in enumerate(game.moves):
+        try:
+            moveID = sanToMoveID(gs, san, gs.getValidMoveIDs())
+        except PgnError as e:
+            raise PgnError(f"Move {ply // 2 + 1}{'.' if ply % 2 == 0 else '...'} {e}") from None
+        gs.makeMove(ChessEngine.Move.fromID(moveID))
+    return gs
+
+
+def gameToSan(moves, fen=None, backend="board") -> list:
+    """
+    Write a move log as SAN
+
+    Args:
+        moves (_list_): The moves, such as GameState.moveLog
+        fen (str): The FEN of the start position, None for the standard one
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        _list_: The SAN of each move, with check and mate suffixes
+
+    Raises:
+        PgnError: If a move is not legal in its position
+    """
+    gs = newGame(fen, backend)
+    moveIDs = gs.getValidMoveIDs()
+    sans = []
+    for move in moves:
+        if move.moveID not in moveIDs:
+            raise PgnError(f"Illegal move {move.getChessNotation()} at ply {len(sans) + 1}")
+        san = moveIDToSan(move.moveID, moveIDs)
+        gs.makeMove(move)
+        moveIDs = gs.getValidMoveIDs()
+        if gs.inCheck():
+            san += "+" if len(moveIDs) else "#"
+        sans.append(san)
+    return sans
+
+
+def writeGame(stream, moves, tags=None, result="*", fen=None, backend="board") -> None:
+    """
+    Write a game as PGN
+
+    Args:
+        stream (_file_): A text stream to write to
+        moves (_list_): The moves, such as GameState.moveLog
+        tags (dict): Tag pairs, the seven tag roster is filled in with "?" where missing
+        result (str): "1-0", "0-1", "1/2-1/2" or "*"
+        fen (str): The FEN of the start position, None for the standard one
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+    """
+    tags = dict(tags or {})
+    tags["Result"] = result
+    if fen:
+        tags["SetUp"], tags["FEN"] = "1", fen
+    lines = [f'[{name} "{tags.get(name, "?")}"]' for name in ROSTER]
+    lines += [f'[{name} "{value}"]' for name, value in tags.items() if name not in ROSTER]
+    lines.append("")
+    blackFirst, firstNumber = False, 1
+    if fen is not None:
+        position = ChessEngine.parseFen(fen)
+        blackFirst, firstNumber = not position[1], position[5]
+    line = ""
+    for ply, san in enumerate(gameToSan(moves, fen, backend), 1 if blackFirst else 0):
+        number = firstNumber + ply // 2
+        if ply % 2 == 0:
+            token = f"{number}. {san}"
+        elif blackFirst and ply == 1:
+            token = f"{number}... {san}"
+        else:
+            token = san
+        if line and len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(f"{line} {result}" if line else result)
+    stream.write("\n".join(lines) + "\n\n")
+
+
+def generateGames(path, count, maxPlies=120, backend="board", seed=0) -> None:
+    """
+    Write random legal games to a PGN file, for benchmarks and fixtures
+
+    Args:
+        path (str): The file to write
+        count (int): Number of games
+        maxPlies (int): Longest game
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        seed (int): Random seed
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for number in range(count):
+            gs = newGame(backend=backend)
+            result = "*"
+            for _ in range(maxPlies):
+                moveIDs = gs.getValidMoveIDs()
+                if len(moveIDs) == 0:
+                    result = ("0-1" if gs.whiteToMove else "1-0") if gs.inCheck() else "1/2-1/2"
+                    break
+                gs.makeMove(ChessEngine.Move.fromID(rng.choice(moveIDs)))
+            writeGame(f, gs.moveLog, {"Event": "Random game", "Round": str(number + 1)}, result, backend=backend)
+
+
+def benchmark(path, replay, backend="board", limit=None) -> None:
+    """
+    Time reading, and optionally replaying, the games of a PGN file
+
+    Args:
+        path (str): The PGN file
+        replay (bool): Whether to replay every game's moves
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        limit (int): Stop after this many games
+    """
+    games = moves = errors = 0
+    start = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for game in readGames(f):
+            games += 1
+            moves += len(game.moves)
+            if replay:
+                try:
+                    replayGame(game, backend)
+                except PgnError:
+                    errors += 1
+            if limit is not None and games >= limit:
+                break
+    elapsed = time.perf_counter() - start
+    print_c.info(f"{games} games, {moves} moves in {elapsed:.2f}s: {games / elapsed:.0f} games/sec, "
+                 f"{moves / elapsed:.0f} moves/sec{' replayed' if replay else ' parsed'}")
+    if replay and errors:
+        print_c.warning(f"{errors} games could not be replayed")
+    if resource is not None:
+        print_c.info(f"Peak memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read, replay and benchmark PGN files")
+    parser.add_argument("pgn", help="the PGN file")
+    parser.add_argument("--replay", action="store_true", help="replay the moves of every game")
+    parser.add_argument("--limit", type=int, help="stop after this many games")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend")
+    parser.add_argument("--generate", type=int, metavar="GAMES", help="write this many random games to the file first")
+    args = parser.parse_args()
+    if args.generate:
+        generateGames(args.pgn, args.generate, backend=args.backend)
+    benchmark(args.pgn, args.replay, args.backend, args.limit)
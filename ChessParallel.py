@@ -0,0 +1,199 @@
+"""
+Root-parallel search. The root moves are split across a process pool, each worker searches the positions after
+its moves with its own ChessSearch.Searcher, and the parent merges the scores. Positions travel as the 67 byte
+ChessEngine.packPosition encoding and the best score found so far is shared so later root moves search with a
+raised alpha bound.
+
+    python3 ChessParallel.py --workers 4 --time 5
+    python3 ChessParallel.py --bench --depth 4     # speedup over 1, 2, 4 and 8 workers
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import multiprocessing
+import time
+import ChessEngine
+import ChessBitboard
+import ChessSearch
+from Console import print_c
+
+# per worker process state, set by initWorker
+workerAlpha = None
+workerSearcher = None
+
+
+def initWorker(sharedAlpha, ttSizeBits) -> None:
+    """
+    Set up a worker process
+
+    Args:
+        sharedAlpha (multiprocessing.Value): Best root score found so far in the current iteration
+        ttSizeBits (int): Transposition table size of the worker's searcher
+    """
+    global workerAlpha, workerSearcher
+    workerAlpha = sharedAlpha
+    workerSearcher = ChessSearch.Searcher(ttSizeBits)
+
+
+def searchRootMove(position, backend, moveID, depth, deadline) -> tuple:
+    """
+    Search one root move in a worker
+
+    Args:
+        position (bytes): The root position from ChessEngine.packPosition
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        moveID (int): The packed root move to search
+        depth (int): The depth of the iteration, counting the root move
+        deadline (float, optional): time.perf_counter() value at which every worker stops, None to always finish.
+            perf_counter is a system-wide monotonic clock, so the parent's value holds in the workers too.
+
+    Returns:
+        tuple: (moveID, score, exact, nodes) where score is None if the search ran out of time,
+            and exact is False when the score only bounds a move that cannot beat the shared alpha
+    """
+    if deadline is not None and time.perf_counter() >= deadline:
+        return moveID, None, False, 0
+    gs = ChessBitboard.BACKENDS[backend]()
+    ChessEngine.unpackPosition(position, gs)
+    workerSearcher.prepare(depth, deadline, canStop=deadline is not None)
+    alpha = workerAlpha.value
+    gs.makeMove(ChessEngine.Move.fromID(moveID))
+    try:
+        score = -workerSearcher.negamax(gs, depth - 1, 1, -ChessSearch.INFINITY, -alpha)
+    except ChessSearch.SearchTimeout:
+        return moveID, None, False, workerSearcher.nodes
+    exact = score > alpha
+    if exact:
+        with workerAlpha.get_lock():
+            if score > workerAlpha.value:
+                workerAlpha.value = score
+    return moveID, score, exact, workerSearcher.nodes
+
+
+class ParallelSearcher():
+    """
+    Iterative deepening search with the root moves of each iteration spread over a process pool
+    """
+    def __init__(self, workers=None, ttSizeBits=18) -> None:
+        """
+        Initialize the searcher and start its pool
+
+        Args:
+            workers (int, optional): Number of worker processes, defaults to the CPU count
+            ttSizeBits (int): Transposition table size of each worker
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self.sharedAlpha = multiprocessing.Value("i", -ChessSearch.INFINITY)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=initWorker, initargs=(self.sharedAlpha, ttSizeBits))
+
+    def close(self) -> None:
+        """
+        Shut the pool down
+        """
+        self.pool.shutdown()
+
+    def __enter__(self) -> "ParallelSearcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def search(self, gs, maxDepth=64, timeLimit=None, backend="board", onIteration=None) -> ChessSearch.SearchResult:
+        """
+        Search a position with iterative deepening
+
+        Args:
+            gs (GameState): The position, left unchanged
+            maxDepth (int): The deepest iteration to run
+            timeLimit (float, optional): Wall-clock budget in seconds
+            backend (str): The backend the workers use
+            onIteration (callable, optional): Called with a SearchResult after each completed iteration
+
+        Returns:
+            SearchResult: The result of the deepest completed iteration, its pv holds only the best move
+        """
+        start = time.perf_counter()
+        position = ChessEngine.packPosition(gs)
+        rootMoves = list(gs.getValidMoveIDs())
+        result = ChessSearch.SearchResult(None, 0, 0, 0, 0.0, [])
+        nodes = 0
+        deadline = start + timeLimit if timeLimit is not None else None
+        for depth in range(1, maxDepth + 1):
+            if deadline is not None and depth > 1 and time.perf_counter() >= deadline:
+                break
+            self.sharedAlpha.value = -ChessSearch.INFINITY
+            # the first iteration always completes, later ones share one deadline however many moves are queued
+            iterationDeadline = deadline if depth > 1 else None
+            futures = [self.pool.submit(searchRootMove, position, backend, moveID, depth, iterationDeadline)
+                       for moveID in rootMoves]
+            scores = {}
+            complete = True
+            for future in futures:
+                if future.cancelled():
+                    continue
+                moveID, score, exact, moveNodes = future.result()
+                nodes += moveNodes
+                if score is None:
+                    if complete:
+                        for pending in futures:
+                            pending.cancel()
+                    complete = False
+                elif exact:
+                    scores[moveID] = score
+            if not complete or not scores:
+                break
+            bestMove = max(scores, key=scores.get)
+            move = ChessEngine.Move.fromID(bestMove)
+            result = ChessSearch.SearchResult(move, scores[bestMove], depth, nodes, time.perf_counter() - start, [move])
+            if onIteration is not None:
+                onIteration(result)
+            # search the best moves first next time so they raise the shared alpha early
+            rootMoves.sort(key=lambda moveID: -scores.get(moveID, -ChessSearch.INFINITY))
+            if abs(result.score) >= ChessSearch.MATE_BOUND:
+                break
+        result.nodes = nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+
+def benchmark(fen, depth, backend, workerCounts=(1, 2, 4, 8)) -> None:
+    """
+    Print the time and speedup of a fixed depth search for several worker counts
+
+    Args:
+        fen (str): The position to search
+        depth (int): The search depth
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        workerCounts (tuple): The pool sizes to compare
+    """
+    import ChessPerft
+    baseline = None
+    print(f"{'workers':>8}{'seconds':>10}{'nodes':>12}{'nodes/sec':>12}{'speedup':>9}  best")
+    for workers in workerCounts:
+        with ParallelSearcher(workers) as searcher:
+            searcher.search(ChessPerft.newGameState(fen, backend), 1, backend=backend) # warm the pool up
+            result = searcher.search(ChessPerft.newGameState(fen, backend), depth, backend=backend)
+        baseline = baseline or result.seconds
+        print(f"{workers:>8}{result.seconds:>10.2f}{result.nodes:>12}{result.nodesPerSecond:>12.0f}"
+              f"{baseline / result.seconds:>9.2f}  {result.move.getChessNotation() if result.move else '-'}")
+
+
+if __name__ == "__main__":
+    import ChessPerft
+    parser = argparse.ArgumentParser(description="Root-parallel search over a process pool")
+    parser.add_argument("--fen", default="r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w", help="position to search")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend to use")
+    parser.add_argument("--workers", type=int, help="number of worker processes, defaults to the CPU count")
+    parser.add_argument("--time", type=float, default=5.0, help="time budget in seconds")
+    parser.add_argument("--depth", type=int, default=64, help="maximum search depth")
+    parser.add_argument("--bench", action="store_true", help="compare a fixed depth search over 1, 2, 4 and 8 workers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.fen, 3 if args.depth == 64 else args.depth, args.backend)
+    else:
+        with ParallelSearcher(args.workers) as searcher:
+            result = searcher.search(ChessPerft.newGameState(args.fen, args.backend), args.depth, args.time,
+                                     args.backend, ChessSearch.printIteration)
+        if result.move is None:
+            print_c.warning("No legal moves")
+        else:
+            print_c.success(f"Best move {result.move.getChessNotation()} at depth {result.depth} with {args.workers or multiprocessing.cpu_count()} workers")
@@ -0,0 +1,398 @@
+"""
+Perft benchmark and move generator correctness suite.
+Counts the leaf nodes of the legal move tree for a set of positions, compares them to the expected counts
+from a JSON fixture and reports nodes/sec. A recorded baseline lets a run fail when throughput drops.
+
+    python3 ChessPerft.py                          # run perft.json on the board backend
+    python3 ChessPerft.py --backend bitboard       # same suite on the bitboard backend
+    python3 ChessPerft.py --record-baseline        # save the throughput to the baseline file
+    python3 ChessPerft.py --max-regression 10      # fail if nodes/sec is 10% below the baseline
+    python3 ChessPerft.py --divide --depth 2       # per-move node counts at the root
+    python3 ChessPerft.py --move-cache 500         # legal move cache speedup on an opening-heavy workload
+    python3 ChessPerft.py --differential 200       # both backends against the reference generator over random games
+"""
+from array import array
+import argparse
+import json
+import random
+import sys
+import time
+import ChessEngine
+import ChessBitboard
+from Console import print_c
+
+FIXTURE_FILE = "perft.json"
+BASELINE_FILE = "perft_baseline.json"
+
+
+def newGameState(fen, backend="board"):
+    """
+    Create a game state for a FEN position
+
+    Args:
+        fen (str): The FEN string
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        GameState: The game state
+    """
+    gs = ChessBitboard.BACKENDS[backend]()
+    ChessEngine.loadFen(fen, gs)
+    return gs
+
+
+def perft(gs, depth, buffers=None) -> int:
+    """
+    Count the leaf nodes of the legal move tree
+
+    Args:
+        gs (GameState): The position, restored on return
+        depth (int): The number of plies to search
+        buffers (_list_, optional): One reusable move array per ply
+
+    Returns:
+        int: The number of leaf nodes
+    """
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = [array("I") for _ in range(depth)]
+    moves = gs.getValidMoveIDs(buffers[depth - 1])
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for moveID in moves:
+        gs.makeMove(ChessEngine.Move.fromID(moveID))
+        nodes += perft(gs, depth - 1, buffers)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth) -> dict:
+    """
+    Count the leaf nodes below each root move
+
+    Args:
+        gs (GameState): The position, restored on return
+        depth (int): The number of plies to search, at least 1
+
+    Returns:
+        dict: Maps the chess notation of each root move to its node count
+    """
+    counts = {}
+    buffers = [array("I") for _ in range(depth)]
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1, buffers)
+        gs.undoMove()
+    return counts
+
+
+def verify(gs, depth, reference=None) -> int:
+    """
+    Compare getValidMoves with the make/undo reference path at every node of the tree
+
+    Args:
+        gs (GameState): The position, any backend, restored on return
+        depth (int): The number of plies to search
+        reference (GameState, optional): A ChessEngine.GameState of the same position to generate the reference
+            moves with, gs itself if None
+
+    Returns:
+        int: The number of positions checked
+    """
+    states = (gs,) if reference is None or reference is gs else (gs, reference)
+    reference = states[-1]
+    moveIDs = list(gs.getValidMoveIDs())
+    expected = [move.moveID for move in reference.getValidMovesReference()]
+    if len(states) > 1:  # the backends generate in different orders
+        moveIDs.sort()
+        expected.sort()
+    if moveIDs != expected:
+        raise AssertionError(f"move lists differ after {[m.getChessNotation() for m in reference.moveLog]}")
+    checked = 1
+    if depth > 1:
+        for moveID in moveIDs:
+            for state in states:
+                state.makeMove(ChessEngine.Move.fromID(moveID))
+            checked += verify(gs, depth - 1, reference)
+            for state in states:
+                state.undoMove()
+    return checked
+
+
+def differential(fens, games, plies=120, undoRate=0.2, seed=0) -> int:
+    """
+    Play random games with random undos on every backend at once and compare, at each position, the legal moves
+    of every backend with getValidMovesReference, and their packed positions and Zobrist keys with the reference's
+
+    Args:
+        fens (_list_): Start positions, the games cycle through them
+        games (int): Number of games
+        plies (int): Moves and undos per game
+        undoRate (float): Chance of undoing a move instead of playing one
+        seed (int): Random seed
+
+    Returns:
+        int: The number of positions checked
+
+    Raises:
+        AssertionError: At the first position where a backend disagrees with the reference
+    """
+    rng = random.Random(seed)
+    checked = 0
+    for game in range(games):
+        fen = fens[game % len(fens)]
+        reference = newGameState(fen)
+        states = {backend: newGameState(fen, backend) for backend in sorted(ChessBitboard.BACKENDS)}
+        for _ in range(plies):
+            expected = sorted(move.moveID for move in reference.getValidMovesReference())
+            packed = ChessEngine.packPosition(reference)
+            for backend, gs in states.items():
+                if (sorted(gs.getValidMoveIDs()) != expected or ChessEngine.packPosition(gs) != packed
+                        or gs.zobristKey != reference.zobristKey):
+                    raise AssertionError(f"{backend} differs from the reference in game {game} from {fen} after "
+                                         f"{[m.getChessNotation() for m in reference.moveLog]}")
+            checked += 1
+            if reference.moveLog and (not expected or rng.random() < undoRate):
+                for gs in (reference, *states.values()):
+                    gs.undoMove()
+            elif expected:
+                moveID = rng.choice(expected)
+                for gs in (reference, *states.values()):
+                    gs.makeMove(ChessEngine.Move.fromID(moveID))
+            else:
+                break
+    return checked
+
+
+def benchmarkMoveCache(games, backend="board", plies=40, openings=20, openingPlies=8, seed=0) -> tuple:
+    """
+    Time fetching the legal moves after every move, undo and redo of a set of games, without and with
+    ChessEngine.MOVE_CACHE. Every game starts with one of a few opening lines, then plays random moves.
+
+    Args:
+        games (int): Number of games
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        plies (int): Moves per game
+        openings (int): Number of distinct opening lines
+        openingPlies (int): Length of each opening line
+        seed (int): Random seed
+
+    Returns:
+        tuple: (uncachedSeconds, cachedSeconds, cache statistics)
+    """
+    rng = random.Random(seed)
+    lines = [rng.randrange(2 ** 32) for _ in range(openings)]
+    workload = []
+    for _ in range(games):
+        lineRng = random.Random(rng.choice(lines))
+        gs = ChessBitboard.BACKENDS[backend]()
+        line = []
+        for ply in range(plies):
+            moveIDs = gs.getValidMoveIDs()
+            if len(moveIDs) == 0:
+                break
+            moveID = (lineRng if ply < openingPlies else rng).choice(moveIDs)
+            gs.makeMove(ChessEngine.Move.fromID(moveID))
+            line.append(moveID)
+        workload.append(line)
+
+    def run(fetch):
+        start = time.perf_counter()
+        for line in workload:
+            gs = ChessBitboard.BACKENDS[backend]()
+            fetch(gs)
+            for moveID in line:
+                gs.makeMove(ChessEngine.Move.fromID(moveID))
+                fetch(gs)
+                gs.undoMove()  # undo and redo, as in ChessMain
+                fetch(gs)
+                gs.makeMove(ChessEngine.Move.fromID(moveID))
+                fetch(gs)
+        return time.perf_counter() - start
+
+    uncached = run(lambda gs: gs.getValidMoveIDs())
+    ChessEngine.MOVE_CACHE.clear()
+    cached = run(ChessEngine.cachedValidMoveIDs)
+    return uncached, cached, ChessEngine.MOVE_CACHE.stats()
+
+
+def benchmarkAttackMap(games, plies=60, seed=0) -> tuple:
+    """
+    Time playing random games and asking after every move whether the side to move is in check, through the
+    incremental attack map of ChessEngine.GameState, a rescan out from the king and an attack map rebuilt from scratch
+
+    Args:
+        games (int): Number of games
+        plies (int): Longest game
+        seed (int): Random seed
+
+    Returns:
+        tuple: (incrementalSeconds, rescanSeconds, rebuildSeconds, positions checked)
+    """
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(games):
+        gs = ChessEngine.GameState()
+        line = []
+        for _ in range(plies):
+            moveIDs = gs.getValidMoveIDs()
+            if len(moveIDs) == 0:
+                break
+            line.append(rng.choice(moveIDs))
+            gs.makeMove(ChessEngine.Move.fromID(line[-1]))
+        workload.append(line)
+
+    def rebuild(gs):
+        kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+        attackMap = ChessEngine.AttackMap(ChessEngine.PIECE_CODES[piece] for row in gs.board for piece in row)
+        return attackMap.isAttacked(kingRow * 8 + kingCol, 1 if gs.whiteToMove else 0)
+
+    def run(check):
+        start = time.perf_counter()
+        for line in workload:
+            gs = ChessEngine.GameState()
+            for moveID in line:
+                gs.makeMove(ChessEngine.Move.fromID(moveID))
+                check(gs)
+        return time.perf_counter() - start
+
+    incremental = run(ChessEngine.GameState.inCheck)
+    rescan = run(ChessEngine.GameState.inCheckRescan)
+    rebuilt = run(rebuild)
+    return incremental, rescan, rebuilt, sum(len(line) for line in workload)
+
+
+def runSuite(positions, backend, maxDepth=None, showDivide=False, checkReference=False) -> tuple:
+    """
+    Run perft over every position of a fixture
+
+    Args:
+        positions (_list_): Fixture entries with "name", "fen" and "nodes" (depth -> expected count)
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        maxDepth (int, optional): Skip depths above this
+        showDivide (bool): Print the per-move counts at the root
+        checkReference (bool): Also cross-check every node against the reference move generator
+
+    Returns:
+        tuple: (failures, totalNodes, totalSeconds)
+    """
+    failures = 0
+    totalNodes = 0
+    totalSeconds = 0.0
+    print(f"{'position':<24}{'depth':>6}{'nodes':>12}{'seconds':>10}{'nodes/sec':>12}")
+    for position in positions:
+        for depth, expected in sorted((int(d), n) for d, n in position["nodes"].items()):
+            if maxDepth is not None and depth > maxDepth:
+                continue
+            gs = newGameState(position["fen"], backend)
+            start = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalSeconds += elapsed
+            print(f"{position['name']:<24}{depth:>6}{nodes:>12}{elapsed:>10.3f}{nodes / max(elapsed, 1e-9):>12.0f}")
+            if nodes != expected:
+                failures += 1
+                print_c.error(f"{position['name']} depth {depth}: expected {expected} nodes, got {nodes}")
+            if showDivide:
+                for notation, count in sorted(divide(gs, depth).items()):
+                    print(f"    {notation}: {count}")
+            if checkReference:
+                reference = newGameState(position["fen"])
+                checked = verify(reference if backend == "board" else newGameState(position["fen"], backend), depth, reference)
+                print_c.success(f"{position['name']} depth {depth}: {checked} positions match the reference generator")
+    return failures, totalNodes, totalSeconds
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Perft benchmark and correctness suite for ChessEngine")
+    parser.add_argument("--fixture", default=FIXTURE_FILE, help="JSON fixture with the positions and expected node counts")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend to run")
+    parser.add_argument("--depth", type=int, help="skip fixture depths above this")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--verify", action="store_true", help="cross-check every node against the make/undo reference generator")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file for throughput checks")
+    parser.add_argument("--record-baseline", action="store_true", help="write this run's throughput to the baseline file")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed nodes/sec drop against the baseline, in percent")
+    parser.add_argument("--move-cache", type=int, metavar="GAMES", help="benchmark the legal move cache over this many games instead")
+    parser.add_argument("--attack-map", type=int, metavar="GAMES", help="benchmark check detection over this many games instead")
+    parser.add_argument("--differential", type=int, metavar="GAMES", help="compare every backend with the reference generator over this many random games with undo instead")
+    args = parser.parse_args(argv)
+
+    if args.differential:
+        with open(args.fixture) as f:
+            fens = [position["fen"] for position in json.load(f)]
+        start = time.perf_counter()
+        try:
+            checked = differential(fens, args.differential)
+        except AssertionError as e:
+            print_c.error(str(e))
+            return 1
+        print_c.success(f"{checked} positions of {args.differential} games match the reference generator on "
+                        f"{', '.join(sorted(ChessBitboard.BACKENDS))} in {time.perf_counter() - start:.1f}s")
+        return 0
+
+    if args.attack_map:
+        incremental, rescan, rebuilt, positions = benchmarkAttackMap(args.attack_map)
+        print_c.info(f"{positions} moves played and checked for check")
+        for name, seconds in (("incremental attack map", incremental), ("rescan from the king", rescan),
+                              ("attack map rebuilt every move", rebuilt)):
+            print_c.info(f"{name}: {seconds:.3f}s, {seconds / positions * 1e6:.1f} us per move")
+        gs = ChessEngine.GameState()
+        for name, check in (("lookup", gs.inCheck), ("rescan", gs.inCheckRescan)):
+            start = time.perf_counter()
+            for _ in range(100000):
+                check()
+            print_c.info(f"inCheck {name} on one position: {(time.perf_counter() - start) * 10:.2f} us")
+        return 0
+
+    if args.move_cache:
+        uncached, cached, stats = benchmarkMoveCache(args.move_cache, args.backend)
+        print_c.info(f"{args.backend}: {uncached:.3f}s uncached, {cached:.3f}s cached, {uncached / cached:.1f}x faster")
+        print_c.info(f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+                     f"hit rate {stats['hitRate']:.1%}, {stats['entries']} positions cached")
+        return 0
+
+    with open(args.fixture) as f:
+        positions = json.load(f)
+    failures, totalNodes, totalSeconds = runSuite(positions, args.backend, args.depth, args.divide, args.verify)
+    nodesPerSecond = totalNodes / max(totalSeconds, 1e-9)
+    print_c.info(f"{args.backend}: {totalNodes} nodes in {totalSeconds:.3f}s, {nodesPerSecond:.0f} nodes/sec")
+    if failures:
+        print_c.error(f"{failures} node count mismatches")
+        return 1
+
+    if args.record_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = {}
+        baseline[args.backend] = {"depth": args.depth, "nodesPerSecond": nodesPerSecond}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=4)
+        print_c.success(f"Recorded {args.backend} baseline in {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            recorded = json.load(f).get(args.backend)
+    except FileNotFoundError:
+        recorded = None
+    if recorded is None:
+        print_c.warning(f"No {args.backend} baseline in {args.baseline}, throughput not checked")
+    elif recorded["depth"] != args.depth:
+        print_c.warning(f"Baseline was recorded with --depth {recorded['depth']}, throughput not checked")
+    else:
+        change = (nodesPerSecond / recorded["nodesPerSecond"] - 1) * 100
+        if change < -args.max_regression:
+            print_c.error(f"Throughput dropped {-change:.1f}%, more than the allowed {args.max_regression}%")
+            return 1
+        print_c.success(f"Throughput {change:+.1f}% against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Wire protocol shared by ChessMain and ChessServer.
+Every message is a frame: a 4 byte big-endian payload length, then the payload. The first payload byte is the kind:
+a JSON control message {"signal": ..., "data": ...}, or a compact move of 2 bytes, start square then end square,
+each indexed row * 8 + col, and for a promotion a third byte with the ASCII letter of the piece, one of "NBRQ". Decoded frames of both kinds come out as {"signal": ..., "data": ...} dicts.
+"""
+import json
+import struct
+
+HEADER = struct.Struct("!I")
+KIND_JSON = 0
+KIND_MOVE = 1
+PROMOTION_PIECES = "NBRQ"
+MAX_FRAME_SIZE = 1 << 20
+
+
+class ProtocolError(ValueError):
+    """
+    Raised when the peer sends bytes that are not a valid frame
+    """
+
+
+def encodeMessage(signal, data=None) -> bytes:
+    """
+    Encode a JSON control message as a frame
+
+    Args:
+        signal (str): The signal name, such as "join", "new" or "quit"
+        data (_any_): JSON serializable payload
+
+    Returns:
+        bytes: The frame
+    """
+    payload = bytes([KIND_JSON]) + json.dumps({"signal": signal, "data": data}).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+def encodeMove(startSq, endSq, promotion=None) -> bytes:
+    """
+    Encode a move as a 2 byte frame, 3 bytes for a promotion
+
+    Args:
+        startSq (_tuple_): The start square (row, col)
+        endSq (_tuple_): The end square (row, col)
+        promotion (str, optional): The promotion piece letter, one of PROMOTION_PIECES
+
+    Returns:
+        bytes: The frame
+    """
+    if promotion:
+        return HEADER.pack(4) + bytes([KIND_MOVE, startSq[0] * 8 + startSq[1], endSq[0] * 8 + endSq[1], ord(promotion)])
+    return HEADER.pack(3) + bytes([KIND_MOVE, startSq[0] * 8 + startSq[1], endSq[0] * 8 + endSq[1]])
+
+
+def decodePayload(payload) -> dict:
+    """
+    Decode the payload of one frame
+
+    Args:
+        payload (bytes): The payload, kind byte first
+
+    Returns:
+        dict: The message, moves come out as {"signal": "move", "data": [[startRow, startCol], [endRow, endCol]]}
+            with the promotion letter as a third item of "data" for a promotion
+    """
+    if not payload:
+        raise ProtocolError("empty frame")
+    kind = payload[0]
+    if kind == KIND_JSON:
+        try:
+            message = json.loads(payload[1:])
+        except ValueError as e:
+            raise ProtocolError(f"bad JSON frame: {e}")
+        if not isinstance(message, dict):
+            raise ProtocolError("JSON frame is not an object")
+        return message
+    if kind == KIND_MOVE:
+        if len(payload) not in (3, 4) or payload[1] > 63 or payload[2] > 63:
+            raise ProtocolError("bad move frame")
+        data = [list(divmod(payload[1], 8)), list(divmod(payload[2], 8))]
+        if len(payload) == 4:
+            if chr(payload[3]) not in PROMOTION_PIECES:
+                raise ProtocolError("bad move frame")
+            data.append(chr(payload[3]))
+        return {"signal": "move", "data": data}
+    raise ProtocolError(f"unknown frame kind {kind}")
+
+
+class FrameDecoder():
+    """
+    Incremental decoder, fed whatever each recv returns. Keeps partial frames until the rest arrives.
+    """
+    def __init__(self, maxFrameSize=MAX_FRAME_SIZE) -> None:
+        """
+        Initialize the decoder
+
+        Args:
+            maxFrameSize (int): Largest payload accepted, a bigger length prefix raises ProtocolError
+        """
+        self.buffer = bytearray()
+        self.maxFrameSize = maxFrameSize
+
+    def feed(self, data) -> list:
+        """
+        Add received bytes and take out every complete message
+
+        Args:
+            data (bytes): The bytes received
+
+        Returns:
+            _list_: The decoded messages, empty if no frame is complete yet
+        """
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > self.maxFrameSize:
+                raise ProtocolError(f"frame of {length} bytes is over the {self.maxFrameSize} byte limit")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            messages.append(decodePayload(bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return messages
+
+    def hasPartialFrame(self) -> bool:
+        """
+        Check whether bytes of an incomplete frame are buffered, meaning an EOF now would cut a message
+        """
+        return len(self.buffer) > 0
+
+
+def recvMessages(sock, decoder, bufferSize=4096):
+    """
+    Block for the next read and decode it
+
+    Args:
+        sock (socket): The connected socket
+        decoder (FrameDecoder): The decoder of this connection
+        bufferSize (int): The maximum bytes to read
+
+    Returns:
+        _list_: The decoded messages, possibly empty, or None once the peer has closed the connection
+    """
+    data = sock.recv(bufferSize)
+    if not data:
+        if decoder.hasPartialFrame():
+            raise ProtocolError("connection closed in the middle of a frame")
+        return None
+    return decoder.feed(data)
+
+
+def sendMessage(sock, signal, data=None) -> None:
+    """
+    Send a JSON control message
+
+    Args:
+        sock (socket): The connected socket
+        signal (str): The signal name
+        data (_any_): JSON serializable payload
+    """
+    sock.sendall(encodeMessage(signal, data))
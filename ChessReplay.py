@@ -0,0 +1,214 @@
+"""
+Bulk replay and validation of PGN archives. Games are streamed out of the file, grouped into chunks and replayed on
+a process pool; every move is checked against the legal moves of its position before GameState.makeMove plays it.
+The chunk results are merged as they arrive into the legal/illegal counts, result distribution, average branching
+factor and capture frequencies. At most two chunks per worker are in flight, so memory stays flat on any file size.
+
+    python3 ChessReplay.py games.pgn --workers 4 --chunk-size 200
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import os
+import time
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+import ChessEngine
+import ChessBitboard
+import ChessPGN
+from Console import print_c
+
+MAX_ERRORS_KEPT = 20
+
+
+class ReplayStats():
+    """
+    Counters of a batch of replayed games, merged across chunks
+    """
+    def __init__(self) -> None:
+        self.games = 0
+        self.legal = 0
+        self.illegal = 0
+        self.plies = 0
+        self.branching = 0
+        self.results = {}
+        self.captures = {}
+        self.errors = []
+
+    def merge(self, other) -> None:
+        """
+        Add another batch's counters to these
+
+        Args:
+            other (ReplayStats): The other batch
+        """
+        self.games += other.games
+        self.legal += other.legal
+        self.illegal += other.illegal
+        self.plies += other.plies
+        self.branching += other.branching
+        for result, count in other.results.items():
+            self.results[result] = self.results.get(result, 0) + count
+        for piece, count in other.captures.items():
+            self.captures[piece] = self.captures.get(piece, 0) + count
+        self.errors.extend(other.errors[:MAX_ERRORS_KEPT - len(self.errors)])
+
+    @property
+    def averageBranching(self) -> float:
+        """
+        Average number of legal moves over every position a move was played from
+        """
+        return self.branching / self.plies if self.plies else 0.0
+
+
+def replayChunk(games, backend="board") -> ReplayStats:
+    """
+    Replay a chunk of games, checking each move against the legal moves of its position
+
+    Args:
+        games (_list_): PgnGame objects
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+
+    Returns:
+        ReplayStats: The chunk's counters
+    """
+    stats = ReplayStats()
+    for game in games:
+        stats.games += 1
+        stats.results[game.result] = stats.results.get(game.result, 0) + 1
+        try:
+            gs = ChessPGN.newGame(game.tags.get("FEN"), backend)
+            for ply, san in enumerate(game.moves):
+                moveIDs = gs.getValidMoveIDs()
+                try:
+                    moveID = ChessPGN.sanToMoveID(gs, san, moveIDs)
+                except ChessPGN.PgnError as e:
+                    raise ChessPGN.PgnError(f"Move {ply // 2 + 1}{'.' if ply % 2 == 0 else '...'} {e}") from None
+                stats.plies += 1
+                stats.branching += len(moveIDs)
+                captured = moveID >> 16 & 15
+                if captured:
+                    piece = ChessEngine.PIECES[captured][1]
+                    stats.captures[piece] = stats.captures.get(piece, 0) + 1
+                gs.makeMove(ChessEngine.Move.fromID(moveID))
+            stats.legal += 1
+        except ValueError as e:  # PgnError, or a bad FEN tag
+            stats.illegal += 1
+            if len(stats.errors) < MAX_ERRORS_KEPT:
+                stats.errors.append(f"{game.tags.get('Event', '?')} round {game.tags.get('Round', '?')}: {e}")
+    return stats
+
+
+def chunked(games, chunkSize, limit=None):
+    """
+    Group games into lists
+
+    Args:
+        games (_iterable_): The games
+        chunkSize (int): Games per list
+        limit (int): Stop after this many games
+
+    Yields:
+        _list_: Up to chunkSize games
+    """
+    chunk = []
+    for count, game in enumerate(games, 1):
+        chunk.append(game)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+        if limit is not None and count >= limit:
+            break
+    if chunk:
+        yield chunk
+
+
+def runPipeline(path, workers, chunkSize, backend="board", limit=None, onProgress=None) -> ReplayStats:
+    """
+    Replay every game of a PGN file across a process pool
+
+    Args:
+        path (str): The PGN file
+        workers (int): Worker processes, 0 to replay in this process
+        chunkSize (int): Games sent to a worker at a time
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+        limit (int): Stop after this many games
+        onProgress (callable): Called with the merged ReplayStats as chunks finish, and last with the final counters
+
+    Returns:
+        ReplayStats: The merged counters
+    """
+    total = ReplayStats()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        chunks = chunked(ChessPGN.readGames(f), chunkSize, limit)
+        if workers == 0:
+            for chunk in chunks:
+                total.merge(replayChunk(chunk, backend))
+                if onProgress is not None:
+                    onProgress(total)
+            return total
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for chunk in chunks:
+                pending.add(pool.submit(replayChunk, chunk, backend))
+                if len(pending) < 2 * workers:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+                if onProgress is not None:
+                    onProgress(total)
+            for future in pending:
+                total.merge(future.result())
+        if onProgress is not None:
+            onProgress(total)
+    return total
+
+
+def peakMemory() -> tuple:
+    """
+    Get the peak resident memory of this process and of its largest finished child, Unix only
+
+    Returns:
+        tuple: (self, children) in bytes, -1 where it cannot be read
+    """
+    if resource is None:
+        return -1, -1
+    scale = 1 if os.uname().sysname == "Darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay and validate the games of a PGN file")
+    parser.add_argument("pgn", help="the PGN file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 0 to run in this process")
+    parser.add_argument("--chunk-size", type=int, default=100, help="games sent to a worker at a time")
+    parser.add_argument("--limit", type=int, help="stop after this many games")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend")
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    def progress(stats):
+        elapsed = time.perf_counter() - start
+        print(f"\r{stats.games} games, {stats.games / elapsed:.0f} games/sec, {stats.illegal} illegal", end="", flush=True)
+
+    stats = runPipeline(args.pgn, args.workers, args.chunk_size, args.backend, args.limit, progress)
+    elapsed = time.perf_counter() - start
+    print()
+    print_c.info(f"{stats.games} games, {stats.plies} moves in {elapsed:.2f}s: {stats.games / elapsed:.0f} games/sec, "
+                 f"{stats.plies / elapsed:.0f} moves/sec with {args.workers} workers")
+    print_c.info(f"{stats.legal} legal, {stats.illegal} illegal, average branching factor {stats.averageBranching:.1f}")
+    print_c.info("Results: " + ", ".join(f"{result} {count}" for result, count in sorted(stats.results.items())))
+    captures = sum(stats.captures.values())
+    if captures:
+        print_c.info("Captures: " + ", ".join(f"{piece} {count / captures:.1%}"
+                                              for piece, count in sorted(stats.captures.items(), key=lambda item: -item[1])))
+    for error in stats.errors:
+        print_c.warning(error)
+    parent, children = peakMemory()
+    if parent >= 0 and args.workers:
+        print_c.info(f"Peak memory {parent / 2 ** 20:.1f} MB in this process, {children / 2 ** 20:.1f} MB in the largest worker")
+    elif parent >= 0:
+        print_c.info(f"Peak memory {parent / 2 ** 20:.1f} MB")
@@ -0,0 +1,456 @@
+"""
+Server-side rooms. Each room owns the authoritative GameState of its game, validates the moves its players send
+and broadcasts the accepted ones to both players and every spectator. Room numbers come from RoomIdAllocator and
+players without a room number are paired by MatchmakingQueue.
+
+A room keeps a packed snapshot of its position every SNAPSHOT_INTERVAL plies and the move frames played since. A
+client that reconnects or falls behind is sent the snapshot and those moves, which costs the same at any game length.
+"""
+from collections import OrderedDict, deque
+import secrets
+import ChessEngine
+import ChessBitboard
+import ChessProtocol
+import ChessStore
+
+WHITE, BLACK = 0, 1
+
+# What happens to a spectator whose unsent data passes the room's backlog limit
+SNAPSHOT = "snapshot"  # skip moves until it catches up, then send it the whole position
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (SNAPSHOT, DISCONNECT)
+MAX_BACKLOG = 64 * 1024
+SNAPSHOT_INTERVAL = 32
+
+
+class MoveRejected(Exception):
+    """
+    Raised when a player sends a move the room does not accept
+    """
+
+
+class Room():
+    """
+    One game. The legal moves of the current position are cached and only regenerated after a move is applied.
+    Every update is encoded once and written to each recipient's outbound buffer, which is bounded: a spectator
+    that falls behind is handled by the slow consumer policy so it never holds back the players.
+    """
+    def __init__(self, room_id, backend="board", slowPolicy=SNAPSHOT, maxBacklog=MAX_BACKLOG) -> None:
+        """
+        Initialize the room
+
+        Args:
+            room_id (int): The room number
+            backend (str): The name of the GameState backend in ChessBitboard.BACKENDS
+            slowPolicy (str): SNAPSHOT or DISCONNECT, what to do with a spectator that falls behind
+            maxBacklog (int): Unsent bytes a connection may hold before it counts as slow
+        """
+        if slowPolicy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {slowPolicy}")
+        self.room_id = room_id
+        self.slowPolicy = slowPolicy
+        self.maxBacklog = maxBacklog
+        self.gs = ChessBitboard.BACKENDS[backend]()
+        self.players = [None, None]
+        self.tokens = [None, None]
+        self.spectators = set()
+        self.validMoves = {}
+        self.snapshot = b""
+        self.deltas = []
+        self.takeSnapshot()
+        self.refreshValidMoves()
+
+    def refreshValidMoves(self) -> None:
+        """
+        Rebuild the legal moves of the current position, keyed by their ChessEngine.shortMoveID
+        """
+        self.validMoves = {ChessEngine.shortMoveID(moveID): moveID for moveID in ChessEngine.cachedValidMoveIDs(self.gs)}
+
+    def addPlayer(self, connection) -> int:
+        """
+        Seat a connection, as a player if a seat is free, otherwise as a spectator.
+        A seat held for a disconnected player is not free.
+
+        Args:
+            connection (Connection): The connection joining
+
+        Returns:
+            int: WHITE or BLACK for a player, None for a spectator
+        """
+        for color in (WHITE, BLACK):
+            if self.players[color] is None and self.tokens[color] is None:
+                self.players[color] = connection
+                self.tokens[color] = secrets.token_hex(8)
+                return color
+        self.spectators.add(connection)
+        return None
+
+    def rejoin(self, connection, token) -> int:
+        """
+        Give a held seat back to the player who reconnected with its token
+
+        Args:
+            connection (Connection): The new connection of the player
+            token (str): The seat token the player was given
+
+        Returns:
+            int: The color of the seat, None if the token does not match a held seat
+        """
+        for color in (WHITE, BLACK):
+            if self.players[color] is None and self.tokens[color] is not None and self.tokens[color] == token:
+                self.players[color] = connection
+                return color
+        return None
+
+    def removeConnection(self, connection, holdSeat=False) -> int:
+        """
+        Remove a player or spectator
+
+        Args:
+            connection (Connection): The connection leaving
+            holdSeat (bool): Keep a player's seat and token so the player can rejoin after a dropped connection
+
+        Returns:
+            int: The color of a held seat, None otherwise
+        """
+        held = None
+        for color in (WHITE, BLACK):
+            if self.players[color] is connection:
+                self.players[color] = None
+                if holdSeat:
+                    held = color
+                else:
+                    self.tokens[color] = None
+        self.spectators.discard(connection)
+        connection.lagging = False
+        return held
+
+    def releaseSeat(self, color, token) -> bool:
+        """
+        Free a held seat whose player did not come back
+
+        Args:
+            color (int): WHITE or BLACK
+            token (str): The token the seat was held with, a seat taken back and held again is not released
+
+        Returns:
+            bool: Whether the seat was released
+        """
+        if self.players[color] is None and self.tokens[color] == token:
+            self.tokens[color] = None
+            return True
+        return False
+
+    def isEmpty(self) -> bool:
+        """
+        Whether nobody is in the room and no seat is held
+        """
+        return self.tokens[WHITE] is None and self.tokens[BLACK] is None and not self.spectators
+
+    def result(self) -> int:
+        """
+        Get the outcome of the game so far
+
+        Returns:
+            int: ChessStore.WHITE_WINS or BLACK_WINS after checkmate, DRAW after stalemate, threefold repetition
+                or fifty moves without a capture or pawn move, UNFINISHED otherwise
+        """
+        if self.validMoves:
+            return ChessStore.DRAW if ChessEngine.drawReason(self.gs) else ChessStore.UNFINISHED
+        if not self.gs.inCheck():
+            return ChessStore.DRAW
+        return ChessStore.BLACK_WINS if self.gs.whiteToMove else ChessStore.WHITE_WINS
+
+    def recipients(self) -> list:
+        """
+        Get everyone who receives the room's updates
+        """
+        return [player for player in self.players if player is not None] + list(self.spectators)
+
+    def takeSnapshot(self) -> None:
+        """
+        Pack the current position into a 'snapshot' frame and start a new delta log
+        """
+        self.snapshot = ChessProtocol.encodeMessage('snapshot', {
+            "room": self.room_id,
+            "ply": len(self.gs.moveLog),
+            "position": ChessEngine.packPosition(self.gs).hex()
+        })
+        self.deltas = []
+
+    def resyncFrames(self) -> bytes:
+        """
+        Get what a client needs to reach the current position from nothing
+
+        Returns:
+            bytes: The last snapshot frame followed by the move frames played since, at most SNAPSHOT_INTERVAL
+        """
+        return self.snapshot + b"".join(self.deltas)
+
+    def broadcast(self, frame) -> None:
+        """
+        Send an encoded frame to both players, then to every spectator that keeps up.
+        A player over the backlog limit is disconnected. A spectator over it is disconnected or, with the SNAPSHOT
+        policy, skipped until its backlog drops below a quarter of the limit and then resynchronized.
+
+        Args:
+            frame (bytes): The frame, encoded once for all recipients
+        """
+        for player in self.players:
+            if player is not None:
+                if player.backlog() > self.maxBacklog:
+                    player.abort()
+                else:
+                    player.sendFrame(frame)
+        resync = None
+        dropped = []
+        for spectator in self.spectators:
+            backlog = spectator.backlog()
+            if spectator.lagging:
+                if backlog > self.maxBacklog // 4:
+                    continue
+                if resync is None:
+                    resync = self.resyncFrames()
+                spectator.lagging = False
+                spectator.sendFrame(resync)
+            elif backlog <= self.maxBacklog:
+                spectator.sendFrame(frame)
+            elif self.slowPolicy == SNAPSHOT:
+                spectator.lagging = True
+            else:
+                spectator.abort()
+                dropped.append(spectator)
+        for spectator in dropped:
+            self.spectators.discard(spectator)
+
+    def applyMove(self, connection, startSq, endSq, promotion=None) -> bytes:
+        """
+        Validate and play a move sent by a player, recording it in the delta log
+
+        Args:
+            connection (Connection): The sender
+            startSq (_tuple_): The start square (row, col)
+            endSq (_tuple_): The end square (row, col)
+            promotion (str, optional): The promotion piece letter, required when the move promotes
+
+        Returns:
+            bytes: The move frame, encoded once for the broadcast and the delta log
+
+        Raises:
+            MoveRejected: If it is not the sender's turn or the move is not legal
+        """
+        color = WHITE if self.gs.whiteToMove else BLACK
+        if self.players[color] is not connection:
+            raise MoveRejected("not your turn")
+        return self.playMove(startSq, endSq, promotion)
+
+    def playMove(self, startSq, endSq, promotion=None) -> bytes:
+        """
+        Validate and play a move for the side to move, recording it in the delta log
+
+        Args:
+            startSq (_tuple_): The start square (row, col)
+            endSq (_tuple_): The end square (row, col)
+            promotion (str, optional): The promotion piece letter, required when the move promotes
+
+        Returns:
+            bytes: The move frame, encoded once for the broadcast and the delta log
+
+        Raises:
+            MoveRejected: If the move is not legal
+        """
+        short = startSq[0] * 8 + startSq[1] | (endSq[0] * 8 + endSq[1]) << 6
+        if promotion is not None:
+            if promotion not in ChessEngine.PROMOTION_PIECES or len(promotion) != 1:
+                raise MoveRejected("illegal move")
+            short |= ChessEngine.PROMOTION_PIECES.index(promotion) + 1 << 12
+        moveID = self.validMoves.get(short)
+        if moveID is None:
+            raise MoveRejected("illegal move")
+        move = ChessEngine.Move.fromID(moveID)
+        self.gs.makeMove(move)
+        self.refreshValidMoves()
+        frame = ChessProtocol.encodeMove((move.startRow, move.startCol), (move.endRow, move.endCol),
+                                         move.piecePromoted[1] if move.piecePromoted != "--" else None)
+        if len(self.gs.moveLog) % SNAPSHOT_INTERVAL == 0:
+            self.takeSnapshot()
+        else:
+            self.deltas.append(frame)
+        return frame
+
+
+class RoomIdAllocator():
+    """
+    Hands out unique 6-digit room numbers in O(1). A counter is passed through an affine permutation of the id
+    space, so consecutive rooms get unrelated looking numbers without ever colliding. With a game store the counter
+    starts after the furthest room number it holds, see advancePast, so a restarted server does not give new games
+    the numbers of stored ones. Released numbers are only reused once the counter has gone through the whole id
+    space, reserved ones (rooms recovered from the game store) are skipped.
+    """
+    FIRST_ID = 100000
+    ID_SPACE = 900000
+    MULTIPLIER = 480193  # coprime with ID_SPACE, which makes the mapping a permutation
+    INVERSE = 253057  # MULTIPLIER * INVERSE % ID_SPACE == 1
+    OFFSET = 271828
+
+    def __init__(self) -> None:
+        self.counter = 0
+        self.released = deque()
+        self.reserved = set()
+
+    def allocate(self) -> int:
+        """
+        Get an unused room number
+
+        Returns:
+            int: The room number
+
+        Raises:
+            RuntimeError: If every room number is in use
+        """
+        while self.counter < self.ID_SPACE:
+            room_id = self.FIRST_ID + (self.counter * self.MULTIPLIER + self.OFFSET) % self.ID_SPACE
+            self.counter += 1
+            if room_id not in self.reserved:
+                return room_id
+        if self.released:
+            return self.released.popleft()
+        raise RuntimeError("no free room numbers")
+
+    def advancePast(self, room_id) -> None:
+        """
+        Move the counter past a room number that was handed out before, such as one in the game store
+
+        Args:
+            room_id (int): The room number
+        """
+        if self.FIRST_ID <= room_id < self.FIRST_ID + self.ID_SPACE:
+            position = (room_id - self.FIRST_ID - self.OFFSET) * self.INVERSE % self.ID_SPACE
+            self.counter = max(self.counter, position + 1)
+
+    def reserve(self, room_id) -> None:
+        """
+        Keep a room number that is already in use from ever coming out of the counter
+
+        Args:
+            room_id (int): The room number
+        """
+        self.reserved.add(room_id)
+
+    def release(self, room_id) -> None:
+        """
+        Return a room number once its room is closed
+
+        Args:
+            room_id (int): The room number
+        """
+        self.released.append(room_id)
+
+
+class MatchmakingQueue():
+    """
+    Pairs waiting players first in, first out. Players only meet others in the same bucket, for example a rating
+    band or time control. Enqueue, pairing and removal are all O(1).
+    """
+    def __init__(self) -> None:
+        self.buckets = {}
+        self.waiting = {}
+
+    def __len__(self) -> int:
+        return len(self.waiting)
+
+    def enqueue(self, connection, bucket=None):
+        """
+        Pair a connection with the longest waiting player of its bucket, or queue it if nobody is waiting
+
+        Args:
+            connection (Connection): The player looking for a game
+            bucket (_hashable_): The bucket to match in, None for the default one
+
+        Returns:
+            Connection: The opponent, who should play white, None if the connection was queued
+        """
+        self.remove(connection)
+        queue = self.buckets.get(bucket)
+        if queue:
+            opponent, _ = queue.popitem(last=False)
+            del self.waiting[opponent]
+            if not queue:
+                del self.buckets[bucket]
+            return opponent
+        self.buckets.setdefault(bucket, OrderedDict())[connection] = None
+        self.waiting[connection] = bucket
+        return None
+
+    def remove(self, connection) -> bool:
+        """
+        Take a connection out of the queue, on 'quit', 'new' or disconnect
+
+        Args:
+            connection (Connection): The connection
+
+        Returns:
+            bool: Whether it was waiting
+        """
+        if connection not in self.waiting:
+            return False
+        bucket = self.waiting.pop(connection)
+        queue = self.buckets[bucket]
+        del queue[connection]
+        if not queue:
+            del self.buckets[bucket]
+        return True
+
+
+class RoomStats():
+    """
+    Validation latency counters shared by every room of a server
+    """
+    def __init__(self, movesPerRoomPerSecond=0.1) -> None:
+        """
+        Initialize the counters
+
+        Args:
+            movesPerRoomPerSecond (float): Expected move rate of one room, used to estimate rooms per core
+        """
+        self.movesPerRoomPerSecond = movesPerRoomPerSecond
+        self.accepted = 0
+        self.rejected = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+
+    def record(self, seconds, accepted) -> None:
+        """
+        Count one validated move
+
+        Args:
+            seconds (float): Time spent validating, applying and regenerating the legal moves
+            accepted (bool): Whether the move was played
+        """
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        self.totalSeconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+
+    def snapshot(self, rooms) -> dict:
+        """
+        Get the current statistics
+
+        Args:
+            rooms (int): The number of open rooms
+
+        Returns:
+            dict: Room count, move counts, mean and max latency in microseconds and the estimated rooms per core
+        """
+        validated = self.accepted + self.rejected
+        meanSeconds = self.totalSeconds / validated if validated else 0.0
+        return {
+            "rooms": rooms,
+            "movesAccepted": self.accepted,
+            "movesRejected": self.rejected,
+            "meanValidationMicros": meanSeconds * 1e6,
+            "maxValidationMicros": self.maxSeconds * 1e6,
+            "roomsPerCore": 1 / (meanSeconds * self.movesPerRoomPerSecond) if meanSeconds else None
+        }
@@ -0,0 +1,569 @@
+"""
+Search engine on top of the GameState API. Negamax alpha-beta with iterative deepening under a wall-clock budget,
+a bounded transposition table keyed by the Zobrist key, MVV-LVA and killer move ordering and a quiescence search
+over captures and queen promotions. Repetitions and the fifty-move rule score as draws. Works with any backend in
+ChessBitboard.BACKENDS.
+
+    python3 ChessSearch.py --time 2
+    python3 ChessSearch.py --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w" --depth 4
+"""
+from array import array
+import argparse
+import time
+import ChessEngine
+import ChessBitboard
+from Console import print_c
+
+PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+# piece-square bonuses for white, row 0 is rank 8. Black reads them mirrored.
+PIECE_SQUARE_TABLES = {
+    "p": [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0
+    ],
+    "N": [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50
+    ],
+    "B": [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20
+    ],
+    "R": [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0
+    ],
+    "Q": [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20
+    ],
+    "K": [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20
+    ]
+}
+
+
+def buildSquareValues() -> list:
+    """
+    Combine material and piece-square bonuses per piece code
+
+    Returns:
+        _list_: For each piece code of ChessEngine.PIECES, its value on each square from white's point of view
+    """
+    squareValues = [[0] * 64]
+    for piece in ChessEngine.PIECES[1:]:
+        sign = 1 if piece[0] == "w" else -1
+        table = PIECE_SQUARE_TABLES[piece[1]]
+        squareValues.append([sign * (PIECE_VALUES[piece[1]] + table[sq if sign > 0 else sq ^ 56]) for sq in range(64)])
+    return squareValues
+
+
+SQUARE_VALUES = buildSquareValues()
+# victim value per piece code, for MVV-LVA ordering
+CODE_VALUES = [0] + [PIECE_VALUES[piece[1]] or 10000 for piece in ChessEngine.PIECES[1:]]
+
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+POLL_NODES = 1024  # nodes between checks for a stop or the deadline
+COOPERATIVE_POLL_NODES = 64  # the same for a cooperative searcher, which also releases the GIL at every check
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+def evaluate(gs) -> int:
+    """
+    Score a position with material and piece-square tables
+
+    Args:
+        gs (GameState): The position
+
+    Returns:
+        int: The score in centipawns for the side to move
+    """
+    score = 0
+    board = gs.board
+    for r in range(8):
+        row = board[r]
+        for c in range(8):
+            if row[c] != "--":
+                score += SQUARE_VALUES[ChessEngine.PIECE_CODES[row[c]]][r * 8 + c]
+    return score if gs.whiteToMove else -score
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget runs out
+    """
+
+
+class TranspositionTable():
+    """
+    Fixed size table of search results indexed by the low bits of the Zobrist key.
+    An entry is replaced by a deeper search, or by any result from a newer search.
+    """
+    def __init__(self, sizeBits=20) -> None:
+        """
+        Initialize the table
+
+        Args:
+            sizeBits (int): The table holds 2 ** sizeBits entries
+        """
+        size = 1 << sizeBits
+        self.mask = size - 1
+        self.keys = [0] * size
+        self.depths = array("b", [-1]) * size
+        self.scores = array("i", [0]) * size
+        self.flags = array("B", [0]) * size
+        self.moves = array("I", [0]) * size
+        self.generations = array("H", [0]) * size
+        self.generation = 0
+
+    def newSearch(self) -> None:
+        """
+        Age the stored entries so the next search may overwrite them
+        """
+        self.generation = (self.generation + 1) & 0xFFFF
+
+    def probe(self, key) -> int:
+        """
+        Find the slot holding a key
+
+        Args:
+            key (int): The Zobrist key
+
+        Returns:
+            int: The slot index, -1 if the key is not stored
+        """
+        index = key & self.mask
+        if self.keys[index] == key and self.depths[index] >= 0:
+            return index
+        return -1
+
+    def store(self, key, depth, score, flag, moveID) -> None:
+        """
+        Store a search result, subject to the replacement policy
+
+        Args:
+            key (int): The Zobrist key
+            depth (int): The remaining depth the score was searched to
+            score (int): The score
+            flag (int): EXACT, LOWER or UPPER bound
+            moveID (int): The best move found, 0 if none
+        """
+        index = key & self.mask
+        if self.generations[index] == self.generation and self.depths[index] > depth and self.keys[index] != key:
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.scores[index] = score
+        self.flags[index] = flag
+        self.moves[index] = moveID
+        self.generations[index] = self.generation
+
+    def clear(self) -> None:
+        """
+        Drop every entry
+        """
+        for i in range(len(self.keys)):
+            self.keys[i] = 0
+            self.depths[i] = -1
+
+
+class SearchResult():
+    """
+    Outcome of a search
+    """
+    def __init__(self, move, score, depth, nodes, seconds, pv) -> None:
+        """
+        Initialize the result
+
+        Args:
+            move (Move): The best move, None if there are no legal moves
+            score (int): The score in centipawns for the side to move
+            depth (int): The deepest completed iteration
+            nodes (int): The number of nodes searched
+            seconds (float): The time spent
+            pv (_list_): The principal variation as a list of moves
+        """
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.pv = pv
+
+    @property
+    def nodesPerSecond(self) -> float:
+        return self.nodes / max(self.seconds, 1e-9)
+
+
+class Searcher():
+    """
+    Alpha-beta searcher, keeps its transposition table between searches
+    """
+    def __init__(self, ttSizeBits=20, book=None, cooperative=False) -> None:
+        """
+        Initialize the searcher
+
+        Args:
+            ttSizeBits (int): The transposition table holds 2 ** ttSizeBits entries
+            book (ChessBook.OpeningBook, optional): Book whose heaviest move is played without searching
+            cooperative (bool): Release the GIL every COOPERATIVE_POLL_NODES nodes and between iterations, for a
+                search running on a thread beside a render loop
+        """
+        self.tt = TranspositionTable(ttSizeBits)
+        self.book = book
+        self.killers = []
+        self.nodes = 0
+        self.deadline = None
+        self.stopped = False
+        self.rootMove = 0
+        self.canStop = False
+        self.cooperative = cooperative
+        self.pollMask = (COOPERATIVE_POLL_NODES if cooperative else POLL_NODES) - 1
+
+    def search(self, gs, maxDepth=64, timeLimit=None, onIteration=None) -> SearchResult:
+        """
+        Search a position with iterative deepening
+
+        Args:
+            gs (GameState): The position, restored on return
+            maxDepth (int): The deepest iteration to run
+            timeLimit (float, optional): Wall-clock budget in seconds
+            onIteration (callable, optional): Called with a SearchResult after each completed iteration
+
+        Returns:
+            SearchResult: The result of the deepest completed iteration
+        """
+        start = time.perf_counter()
+        if self.book is not None:
+            move = self.book.pickMove(gs, best=True)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, time.perf_counter() - start, [move])
+        if len(gs.getValidMoveIDs()) == 0:
+            return SearchResult(None, -MATE_SCORE if gs.inCheck() else 0, 0, 0, time.perf_counter() - start, [])
+        self.prepare(maxDepth, start + timeLimit if timeLimit is not None else None)
+        plyAtRoot = len(gs.moveLog)
+        result = SearchResult(None, 0, 0, 0, 0.0, [])
+        for depth in range(1, maxDepth + 1):
+            try:
+                score = self.negamax(gs, depth, 0, -INFINITY, INFINITY)
+            except SearchTimeout:
+                while len(gs.moveLog) > plyAtRoot:
+                    gs.undoMove()
+                break
+            self.canStop = True
+            move = ChessEngine.Move.fromID(self.rootMove) if self.rootMove else None
+            pv = self.principalVariation(gs, depth) if move is not None else []
+            if move is not None and (not pv or pv[0] != move):
+                pv = [move]
+            result = SearchResult(move, score, depth, self.nodes, time.perf_counter() - start, pv)
+            if onIteration is not None:
+                onIteration(result)
+            if self.cooperative:
+                time.sleep(0)
+            if abs(score) >= MATE_BOUND or (self.deadline is not None and time.perf_counter() >= self.deadline):
+                break
+        self.stopped = False
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def prepare(self, maxDepth, deadline=None, canStop=False) -> None:
+        """
+        Reset the per-search state before calling negamax directly. A stop() asked for before the search starts
+        is kept, clearStop() drops it.
+
+        Args:
+            maxDepth (int): The deepest ply the search can reach
+            deadline (float, optional): time.perf_counter() value at which to abort
+            canStop (bool): Allow aborting before a first result exists
+        """
+        self.deadline = deadline
+        self.nodes = 0
+        self.rootMove = 0
+        self.canStop = canStop
+        self.killers = [[0, 0] for _ in range(maxDepth + 1)]
+        self.tt.newSearch()
+
+    def stop(self) -> None:
+        """
+        Ask a running search to return its last completed iteration, or the next one to stop after its first
+        """
+        self.stopped = True
+
+    def clearStop(self) -> None:
+        """
+        Drop a stop() that no search has answered yet
+        """
+        self.stopped = False
+
+    def checkTime(self) -> None:
+        """
+        Abort the search when it is stopped or out of time, checked every POLL_NODES nodes, and let other threads
+        run there when the searcher is cooperative. The first iteration always completes so there is a move to play.
+        """
+        if self.nodes & self.pollMask == 0:
+            if self.cooperative:
+                time.sleep(0)
+            if self.canStop and (self.stopped or (self.deadline is not None and time.perf_counter() >= self.deadline)):
+                raise SearchTimeout()
+
+    def negamax(self, gs, depth, ply, alpha, beta) -> int:
+        """
+        Alpha-beta search
+
+        Args:
+            gs (GameState): The position
+            depth (int): The remaining depth
+            ply (int): The distance from the root
+            alpha (int): The lower bound
+            beta (int): The upper bound
+
+        Returns:
+            int: The score for the side to move
+        """
+        self.nodes += 1
+        self.checkTime()
+        # one repetition inside the tree is enough, the side that could avoid it would have
+        if ply > 0 and (gs.halfmoveClock >= ChessEngine.FIFTY_MOVE_PLIES
+                        or (gs.halfmoveClock >= 4 and ChessEngine.repetitionCount(gs) >= 2)):
+            return 0
+        if depth <= 0:
+            return self.quiescence(gs, ply, alpha, beta)
+
+        key = gs.zobristKey
+        ttMove = 0
+        index = self.tt.probe(key)
+        if index >= 0:
+            ttMove = self.tt.moves[index]
+            if ply > 0 and self.tt.depths[index] >= depth:
+                score = scoreFromTable(self.tt.scores[index], ply)
+                flag = self.tt.flags[index]
+                if flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha):
+                    return score
+
+        moves = gs.getValidMoveIDs()
+        if len(moves) == 0:
+            return -MATE_SCORE + ply if gs.inCheck() else 0
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = 0
+        for moveID in self.orderMoves(moves, ttMove, self.killers[ply]):
+            gs.makeMove(ChessEngine.Move.fromID(moveID))
+            score = -self.negamax(gs, depth - 1, ply + 1, -beta, -alpha)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = moveID
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not moveID >> 16 & 15 and moveID != self.killers[ply][0]:
+                    self.killers[ply][1] = self.killers[ply][0]
+                    self.killers[ply][0] = moveID
+                break
+
+        if bestScore <= originalAlpha:
+            flag = UPPER
+        elif bestScore >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if ply == 0:
+            self.rootMove = bestMove
+        self.tt.store(key, depth, scoreToTable(bestScore, ply), flag, bestMove)
+        return bestScore
+
+    def quiescence(self, gs, ply, alpha, beta) -> int:
+        """
+        Search captures and queen promotions only until the position is quiet
+
+        Args:
+            gs (GameState): The position
+            ply (int): The distance from the root
+            alpha (int): The lower bound
+            beta (int): The upper bound
+
+        Returns:
+            int: The score for the side to move
+        """
+        self.nodes += 1
+        self.checkTime()
+        standPat = evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        captures = [moveID for moveID in gs.getValidMoveIDs()
+                    if moveID >> 16 & 15 or ChessEngine.PIECES[moveID >> ChessEngine.PROMOTION_SHIFT & 15][1] == "Q"]
+        for moveID in self.orderMoves(captures, 0, (0, 0)):
+            gs.makeMove(ChessEngine.Move.fromID(moveID))
+            score = -self.quiescence(gs, ply + 1, -beta, -alpha)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def orderMoves(self, moves, ttMove, killers) -> list:
+        """
+        Order moves: table move, captures by MVV-LVA, promotions, killers, then quiet moves
+
+        Args:
+            moves (_array_): The packed move IDs
+            ttMove (int): The best move from the transposition table, 0 if none
+            killers (_list_): The killer moves at this ply
+
+        Returns:
+            _list_: The ordered move IDs
+        """
+        def moveOrder(moveID) -> int:
+            if moveID == ttMove:
+                return -1000000
+            captured = moveID >> 16 & 15
+            if captured:
+                return -100000 - CODE_VALUES[captured] * 10 + CODE_VALUES[moveID >> 12 & 15] // 10
+            if moveID >> ChessEngine.PROMOTION_SHIFT & 15:
+                return -95000 - CODE_VALUES[moveID >> ChessEngine.PROMOTION_SHIFT & 15]
+            if moveID == killers[0]:
+                return -90000
+            if moveID == killers[1]:
+                return -80000
+            return 0
+        return sorted(moves, key=moveOrder)
+
+    def principalVariation(self, gs, depth) -> list:
+        """
+        Follow the best moves stored in the transposition table
+
+        Args:
+            gs (GameState): The root position, restored on return
+            depth (int): The maximum length of the line
+
+        Returns:
+            _list_: The principal variation as a list of moves
+        """
+        pv = []
+        seen = set()
+        while len(pv) < depth and gs.zobristKey not in seen:
+            seen.add(gs.zobristKey)
+            index = self.tt.probe(gs.zobristKey)
+            if index < 0 or self.tt.moves[index] not in gs.getValidMoveIDs():
+                break
+            move = ChessEngine.Move.fromID(self.tt.moves[index])
+            gs.makeMove(move)
+            pv.append(move)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+
+def scoreToTable(score, ply) -> int:
+    """
+    Store mate scores relative to the node rather than the root
+
+    Args:
+        score (int): The score relative to the root
+        ply (int): The distance from the root
+
+    Returns:
+        int: The score to store
+    """
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply) -> int:
+    """
+    Convert a stored mate score back to be relative to the root
+
+    Args:
+        score (int): The stored score
+        ply (int): The distance from the root
+
+    Returns:
+        int: The score relative to the root
+    """
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def printIteration(result) -> None:
+    """
+    Print one line of search progress
+
+    Args:
+        result (SearchResult): The completed iteration
+    """
+    pv = " ".join(move.getChessNotation() for move in result.pv)
+    print(f"depth {result.depth:>2}  score {result.score:>6}  nodes {result.nodes:>9}  "
+          f"nps {result.nodesPerSecond:>8.0f}  time {result.seconds:>6.2f}  pv {pv}")
+
+
+if __name__ == "__main__":
+    import ChessBook
+    import ChessPerft
+    parser = argparse.ArgumentParser(description="Search a position with the alpha-beta engine")
+    parser.add_argument("--fen", default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w", help="position to search")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend to use")
+    parser.add_argument("--time", type=float, default=5.0, help="time budget in seconds")
+    parser.add_argument("--depth", type=int, default=64, help="maximum search depth")
+    parser.add_argument("--tt-bits", type=int, default=20, help="transposition table holds 2 ** bits entries")
+    parser.add_argument("--book", help="opening book to play from before searching, see ChessBook")
+    args = parser.parse_args()
+    gs = ChessPerft.newGameState(args.fen, args.backend)
+    book = ChessBook.OpeningBook(args.book) if args.book else None
+    result = Searcher(args.tt_bits, book).search(gs, args.depth, args.time, printIteration)
+    if result.move is None:
+        print_c.warning("No legal moves")
+    elif result.depth == 0:
+        print_c.success(f"Book move {result.move.getChessNotation()}")
+    else:
+        print_c.success(f"Best move {result.move.getChessNotation()} at depth {result.depth}, "
+                        f"{result.nodes} nodes, {result.nodesPerSecond:.0f} nodes/sec")
@@ -1,13 +1,9 @@
 import threading
 import customtkinter as ctk
-import socket
-import json
-import random
+import ChessServerCore
+from ChessServerCore import SERVER_ADDRESS, SERVER_PORT
 from Console import print_c
 
-SERVER_ADDRESS = "localhost"
-SERVER_PORT = 4953
-
 class Server(ctk.CTk):
     def __init__(self):
         
@@ -16,16 +12,13 @@ class Server(ctk.CTk):
         self.server_on = False
         self.server_accept = False
         self.server_ban_mode = False
-        self.sock = None
+        self.core = None
         
         self.server_address = SERVER_ADDRESS
         self.server_port = SERVER_PORT
         self.initializeGui()
         self.initializeSocket()
         
-        self.users = {}
-        self.rooms = {}
-        
         self.protocol("WM_DELETE_WINDOW", self.onWindowClose)
 
     def initializeGui(self) -> None:
@@ -42,70 +35,13 @@ class Server(ctk.CTk):
         self.createFeatureButtons()
         
     def initializeSocket(self) -> None:
-        """Initialize server socket and set callback for client connections"""
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.sock.bind((self.server_address, self.server_port))
-            self.sock.listen(5)
-            self.running = True
-            handler_client_connect = threading.Thread(target=self.handlerClientConnect, daemon=True)
-            handler_client_connect.start()
-            self.appendMessageSafe(f"[+] Server started at {self.server_address}:{self.server_port}")
-            print_c.success(f"Server started at {self.server_address}:{self.server_port}")
-        except Exception as e:
-            print_c.error(f"Error starting server: {e}")
-            
-    def handlerClientConnect(self) -> None:
-        """Handler for incoming client connections"""
-        while self.running:
-            try:
-                client_socket, client_address = self.sock.accept()
-                handle_client_thread = threading.Thread(target=self.handlerClient, args=(client_socket, client_address), daemon=True)
-                handle_client_thread.start()  
-                self.appendMessageSafe(f"[+] {client_address} connected")
-                print_c.success(f"Connected to {client_address}")
-            except Exception as e:
-                print_c.error(f"Error accepting client: {e}")
-
-    def handlerClient(self, client_socket: socket, client_address: tuple) -> None:
-        """Handler for accepted client connections."""
-        if client_socket not in self.users:
-            self.users[client_socket] = client_address
-            self.addUserToList(client_address)
-            print_c.success(f"Added {client_address} to user list")
-        while self.running:
-            try:
-                data = client_socket.recv(1024)
-                if not data:
-                    continue
-                message = json.loads(data.decode())
-
-                signal = message.get('signal')
-                data = message.get('data')
-
-                if signal == 'join':
-                    pass
-                    username = data
-
-                elif signal == 'new':
-                    random_room = None
-                    while True:
-                        random_room = random.randint(100000, 999999) 
-                        if random_room not in self.rooms: 
-                            self.rooms[random_room] = client_socket
-                            self.appendMessageSafe(f"[+] Room {random_room} created by {client_address}")
-                            client_socket.send(json.dumps({'signal': 'new', 'data': random_room}).encode())
-                            print_c.success(f"Room {random_room} created by {client_address}")
-                            break 
-
-                elif signal == 'quit':
-                    pass
-            except Exception as e:
-                print_c.error(f"Error in client handler: {e}")
-                break
+        """Start the asyncio server core in a background thread and observe it"""
+        self.core = ChessServerCore.ServerCore(self.server_address, self.server_port)
+        self.core.addObserver(self)
+        self.server_on = True
+        core_thread = threading.Thread(target=self.core.run, daemon=True)
+        core_thread.start()
 
-        
     def createSidebar(self) -> None:
         """Create the sidebar panel with control options"""
         self.sidebar = ctk.CTkFrame(self, width=140)
@@ -171,9 +107,17 @@ class Server(ctk.CTk):
     def appendMessageSafe(self, message: str) -> None:
         self.after(0, self.appendMessage, message)
 
-    def onClientConnect(self, address, client_socket) -> None:
-        """Handle a new client connection and display in the chatbox"""
-        pass
+    def onServerMessage(self, message: str) -> None:
+        """Show a server event in the chatbox"""
+        self.appendMessageSafe(message)
+
+    def onClientConnect(self, address, connection) -> None:
+        """Handle a new client connection and display in the user list"""
+        self.after(0, self.addUserToList, str(address))
+
+    def onClientDisconnect(self, address) -> None:
+        """Handle a client disconnecting"""
+        self.after(0, self.removeUserFromList, str(address))
     
     def addUserToList(self, username: str) -> None:
         """Add a new user to the user list"""
@@ -182,7 +126,9 @@ class Server(ctk.CTk):
 
     def removeUserFromList(self, username) -> None:
         """Remove a user from the user list"""
-        pass
+        for widget in self.list_box.winfo_children():
+            if isinstance(widget, ctk.CTkButton) and widget.cget("text") == username:
+                widget.destroy()
 
     def toggleAccept(self) -> None:
         """Toggle accepting new connections"""
@@ -210,8 +156,8 @@ class Server(ctk.CTk):
     def onWindowClose(self) -> None:
         """Handle window close event"""
         if self.server_on:
-            self.sock.off()
-            self.sock.join()
+            self.core.stop()
+            self.server_on = False
         self.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+"""
+Connection benchmark for the headless server. Starts ChessServerCore in a subprocess, opens connections to it in
+steps and reports how many it holds and the server's resident memory per connection.
+
+    python3 ChessServerBench.py --connections 10000 --step 1000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import ChessProtocol
+import ChessServerCore
+from Console import print_c
+
+
+def residentMemory(pid) -> int:
+    """
+    Read the resident set size of a process, Linux only
+
+    Args:
+        pid (int): The process id
+
+    Returns:
+        int: The resident memory in bytes, -1 if it cannot be read
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return -1
+
+
+async def openConnections(host, port, count, connections) -> None:
+    """
+    Open more client connections, each one sends a 'new' signal and waits for its room
+
+    Args:
+        host (str): The server address
+        port (int): The server port
+        count (int): How many to open
+        connections (_list_): Receives the (reader, writer) pairs
+
+    Raises:
+        ConnectionError: If the server closes a connection before answering
+    """
+    async def connect():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(ChessProtocol.encodeMessage('new', 'new'))
+        decoder = ChessProtocol.FrameDecoder()
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            if decoder.feed(data):
+                break
+        connections.append((reader, writer))
+    # bounded batches keep the listen backlog from overflowing
+    for start in range(0, count, 500):
+        await asyncio.gather(*(connect() for _ in range(min(500, count - start))))
+
+
+async def runBenchmark(host, port, total, step, pid) -> None:
+    """
+    Connect in steps and print the memory after each
+
+    Args:
+        host (str): The server address
+        port (int): The server port
+        total (int): The number of connections to reach
+        step (int): Connections added per step
+        pid (int): The server process id
+    """
+    connections = []
+    idle = residentMemory(pid)
+    print(f"{'connections':>12}{'server RSS MB':>15}{'bytes/conn':>12}")
+    print(f"{0:>12}{idle / 2 ** 20:>15.1f}{'-':>12}")
+    while len(connections) < total:
+        try:
+            await openConnections(host, port, min(step, total - len(connections)), connections)
+        except OSError as e:
+            print_c.error(f"Stopped at {len(connections)} connections: {e}")
+            break
+        await asyncio.sleep(0.2)
+        memory = residentMemory(pid)
+        print(f"{len(connections):>12}{memory / 2 ** 20:>15.1f}{(memory - idle) / len(connections):>12.0f}")
+    for reader, writer in connections:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connection count and memory benchmark for ChessServerCore")
+    parser.add_argument("--connections", type=int, default=10000, help="number of connections to open")
+    parser.add_argument("--step", type=int, default=1000, help="connections added between measurements")
+    parser.add_argument("--port", type=int, default=4954, help="port for the benchmark server")
+    args = parser.parse_args()
+    limit = ChessServerCore.raiseFileLimit()
+    if 0 <= limit < args.connections + 100:
+        print_c.warning(f"Open file limit is {limit}, the run will stop short of {args.connections} connections")
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ChessServerCore.py"),
+                               "--host", "127.0.0.1", "--port", str(args.port)], stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(asyncio.sleep(1.0))
+        asyncio.run(runBenchmark("127.0.0.1", args.port, args.connections, args.step, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,541 @@
+"""
+Headless chess server. One asyncio event loop serves every connection with streams, so it runs without a display
+and holds thousands of clients without a thread each. The customtkinter window in ChessServer is an optional
+observer attached to it.
+
+    python3 ChessServerCore.py --host 0.0.0.0 --port 4953
+"""
+import argparse
+import asyncio
+import time
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+import ChessEngine
+import ChessBitboard
+import ChessProtocol
+import ChessRooms
+import ChessStore
+from Console import print_c
+
+SERVER_ADDRESS = "localhost"
+SERVER_PORT = 4953
+LISTEN_BACKLOG = 4096
+RECONNECT_GRACE = 30.0
+STORE_FLUSH_INTERVAL = 0.1
+
+
+def isSquare(square) -> bool:
+    """
+    Check that a square sent by a client is a [row, col] pair on the board
+
+    Args:
+        square (_any_): The decoded square
+    """
+    return (isinstance(square, (list, tuple)) and len(square) == 2
+            and all(isinstance(v, int) and not isinstance(v, bool) and 0 <= v < 8 for v in square))
+
+
+def isMove(data) -> bool:
+    """
+    Check that move data sent by a client is two squares, then optionally a promotion letter or None
+
+    Args:
+        data (_any_): The decoded move
+    """
+    if not isinstance(data, (list, tuple)) or len(data) not in (2, 3) or not (isSquare(data[0]) and isSquare(data[1])):
+        return False
+    return len(data) == 2 or data[2] is None or (isinstance(data[2], str) and len(data[2]) == 1
+                                                  and data[2] in ChessEngine.PROMOTION_PIECES)
+
+
+class Connection():
+    """
+    One connected client
+    """
+    __slots__ = ("reader", "writer", "address", "room", "lagging")
+
+    def __init__(self, reader, writer) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.room = None
+        self.lagging = False
+
+    def send(self, signal, data=None) -> None:
+        """
+        Queue a JSON control message to the client
+
+        Args:
+            signal (str): The signal name
+            data (_any_): JSON serializable payload
+        """
+        self.writer.write(ChessProtocol.encodeMessage(signal, data))
+
+    def sendFrame(self, frame) -> None:
+        """
+        Queue an already encoded frame to the client
+
+        Args:
+            frame (bytes): The frame
+        """
+        self.writer.write(frame)
+
+    def backlog(self) -> int:
+        """
+        Get the bytes written to the connection but not yet sent
+        """
+        return self.writer.transport.get_write_buffer_size()
+
+    def abort(self) -> None:
+        """
+        Drop the connection at once, discarding its unsent data
+        """
+        self.writer.transport.abort()
+
+
+class ServerCore():
+    """
+    Accepts clients and handles their 'join', 'new', 'rejoin', 'move', 'stats' and 'quit' signals.
+    Each room owns the authoritative game, see ChessRooms. 'join' with a room number enters that room, any other
+    'join' goes through matchmaking, optionally bucketed with {'bucket': ...}. Seated players get a 'seat' message
+    with a token; when their connection drops the seat is held for the reconnect grace period and
+    'rejoin' {'room': ..., 'token': ...} takes it back, followed by the room's snapshot and the moves since.
+    With a ChessStore.GameStore every game is persisted, and rooms in progress when the server stopped are restored
+    with their seats held.
+    Observers get onServerMessage(text), onClientConnect(address, connection) and onClientDisconnect(address)
+    calls from the event loop thread, any of them may be left out.
+    """
+    def __init__(self, address=SERVER_ADDRESS, port=SERVER_PORT, backend="board",
+                 slowPolicy=ChessRooms.SNAPSHOT, maxBacklog=ChessRooms.MAX_BACKLOG, reconnectGrace=RECONNECT_GRACE,
+                 store=None) -> None:
+        """
+        Initialize the server
+
+        Args:
+            address (str): The address to bind
+            port (int): The port to bind
+            backend (str): The GameState backend of the rooms, see ChessBitboard.BACKENDS
+            slowPolicy (str): What rooms do with spectators that fall behind, see ChessRooms.SLOW_CONSUMER_POLICIES
+            maxBacklog (int): Unsent bytes a connection may hold before it counts as slow
+            reconnectGrace (float): Seconds a dropped player's seat is held
+            store (GameStore): Where games are persisted, None to keep them in memory only
+        """
+        self.server_address = address
+        self.server_port = port
+        self.backend = backend
+        self.slowPolicy = slowPolicy
+        self.maxBacklog = maxBacklog
+        self.reconnectGrace = reconnectGrace
+        self.store = store
+        self.users = {}
+        self.rooms = {}
+        self.roomIds = ChessRooms.RoomIdAllocator()
+        if store is not None:
+            for room_id in store.roomNumbers():
+                self.roomIds.advancePast(room_id)
+        self.matchmaking = ChessRooms.MatchmakingQueue()
+        self.stats = ChessRooms.RoomStats()
+        self.observers = []
+        self.loop = None
+        self.server = None
+
+    def addObserver(self, observer) -> None:
+        """
+        Attach an observer, such as the GUI
+
+        Args:
+            observer (_object_): Object with any of the observer callbacks
+        """
+        self.observers.append(observer)
+
+    def notify(self, event, *args) -> None:
+        """
+        Call an observer callback on every observer that has it
+
+        Args:
+            event (str): The callback name
+        """
+        for observer in self.observers:
+            callback = getattr(observer, event, None)
+            if callback is not None:
+                callback(*args)
+
+    def log(self, text) -> None:
+        """
+        Report a server event to the observers
+
+        Args:
+            text (str): The message
+        """
+        self.notify("onServerMessage", text)
+
+    async def serve(self) -> None:
+        """
+        Bind and serve until stop is called
+        """
+        raiseFileLimit()
+        self.loop = asyncio.get_running_loop()
+        if self.store is not None:
+            self.restoreRooms()
+            flusher = asyncio.create_task(self.flushStore())
+        self.server = await asyncio.start_server(
+            self.handlerClient, self.server_address, self.server_port, backlog=LISTEN_BACKLOG, reuse_address=True
+        )
+        self.log(f"[+] Server started at {self.server_address}:{self.server_port}")
+        print_c.success(f"Server started at {self.server_address}:{self.server_port}")
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        if self.store is not None:
+            flusher.cancel()
+            self.store.close()
+
+    async def flushStore(self) -> None:
+        """
+        Flush the game store periodically, so writes are batched and a crash loses at most one interval
+        """
+        while True:
+            await asyncio.sleep(STORE_FLUSH_INTERVAL)
+            self.store.flush()
+
+    def restoreRooms(self) -> None:
+        """
+        Rebuild the rooms the game store recovered, holding their seats for the players to rejoin
+        """
+        for game in list(self.store.active.values()):
+            room = ChessRooms.Room(game.room_id, self.backend, self.slowPolicy, self.maxBacklog)
+            try:
+                for startSq, endSq, promotion in ChessStore.unpackMoves(bytes(game.moves)):
+                    room.playMove(startSq, endSq, promotion)
+            except ChessRooms.MoveRejected:
+                print_c.warning(f"Room {game.room_id} could not be replayed, keeping it up to move {len(room.gs.moveLog)}")
+            self.roomIds.reserve(room.room_id)
+            self.rooms[room.room_id] = room
+            for color in (ChessRooms.WHITE, ChessRooms.BLACK):
+                if game.tokens[color]:
+                    room.tokens[color] = game.tokens[color]
+                    self.loop.call_later(self.reconnectGrace, self.releaseSeat, room, color, game.tokens[color])
+            if room.isEmpty():
+                self.closeRoom(room)
+            else:
+                self.log(f"[+] Room {room.room_id} restored at move {len(room.gs.moveLog)}")
+
+    def run(self) -> None:
+        """
+        Run the event loop in the calling thread until stop is called
+        """
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print_c.error(f"Error starting server: {e}")
+
+    def stop(self) -> None:
+        """
+        Stop serving, safe to call from any thread
+        """
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def handlerClient(self, reader, writer) -> None:
+        """
+        Serve one client connection until it closes
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader
+            writer (asyncio.StreamWriter): The connection's writer
+        """
+        connection = Connection(reader, writer)
+        self.users[connection] = connection.address
+        self.log(f"[+] {connection.address} connected")
+        self.notify("onClientConnect", connection.address, connection)
+        decoder = ChessProtocol.FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    self.handleMessage(connection, message)
+                await writer.drain()
+        except (ConnectionError, ChessProtocol.ProtocolError) as e:
+            print_c.error(f"Error in client handler: {e}")
+        finally:
+            self.leaveRoom(connection, holdSeat=True)
+            self.users.pop(connection, None)
+            self.log(f"[-] {connection.address} disconnected")
+            self.notify("onClientDisconnect", connection.address)
+            writer.close()
+
+    def handleMessage(self, connection, message) -> None:
+        """
+        Act on one decoded client message
+
+        Args:
+            connection (Connection): The sender
+            message (dict): The message
+        """
+        signal = message.get('signal')
+        data = message.get('data')
+
+        if signal == 'join':
+            if isinstance(data, int) and not isinstance(data, bool):
+                self.joinRoom(connection, data)
+            else:
+                self.matchmake(connection, data.get('bucket') if isinstance(data, dict) else None)
+
+        elif signal == 'new':
+            self.leaveRoom(connection)
+            room = self.createRoom()
+            color = room.addPlayer(connection)
+            connection.room = room
+            self.log(f"[+] Room {room.room_id} created by {connection.address}")
+            connection.send('new', room.room_id)
+            self.sendSeat(connection, room, color)
+
+        elif signal == 'rejoin':
+            self.rejoinRoom(connection, data)
+
+        elif signal == 'move':
+            self.handleMove(connection, data)
+
+        elif signal == 'stats':
+            connection.send('stats', self.getStats())
+
+        elif signal == 'quit':
+            self.leaveRoom(connection)
+
+    def createRoom(self) -> ChessRooms.Room:
+        """
+        Open an empty room under a fresh room number
+
+        Returns:
+            Room: The room
+        """
+        room = ChessRooms.Room(self.roomIds.allocate(), self.backend, self.slowPolicy, self.maxBacklog)
+        self.rooms[room.room_id] = room
+        if self.store is not None:
+            self.store.openGame(room.room_id)
+        return room
+
+    def joinRoom(self, connection, room_id) -> None:
+        """
+        Seat a connection in an existing room, as a player if a seat is free, otherwise as a spectator
+
+        Args:
+            connection (Connection): The connection joining
+            room_id (int): The room number
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            connection.send('error', f"Room {room_id} does not exist")
+            return
+        self.leaveRoom(connection)
+        color = room.addPlayer(connection)
+        connection.room = room
+        seat = "as a spectator" if color is None else ("as white", "as black")[color]
+        self.log(f"[+] {connection.address} joined room {room.room_id} {seat}")
+        connection.send('join', room.room_id)
+        if color is not None:
+            self.sendSeat(connection, room, color)
+        if room.gs.moveLog:
+            connection.sendFrame(room.resyncFrames())
+
+    def rejoinRoom(self, connection, data) -> None:
+        """
+        Give a player back the seat held since its connection dropped and resynchronize it
+
+        Args:
+            connection (Connection): The player's new connection
+            data (dict): {'room': room number, 'token': seat token}
+        """
+        room_id = data.get('room') if isinstance(data, dict) else None
+        room = self.rooms.get(room_id) if isinstance(room_id, int) and not isinstance(room_id, bool) else None
+        if room is None:
+            connection.send('error', "No seat to rejoin")
+            return
+        self.leaveRoom(connection)
+        color = room.rejoin(connection, data.get('token'))
+        if color is None:
+            connection.send('error', "No seat to rejoin")
+            return
+        connection.room = room
+        self.log(f"[+] {connection.address} rejoined room {room.room_id} as {('white', 'black')[color]}")
+        connection.send('rejoin', room.room_id)
+        connection.sendFrame(room.resyncFrames())
+
+    def sendSeat(self, connection, room, color) -> None:
+        """
+        Tell a player its color and the token to rejoin with, and record the seat in the game store
+
+        Args:
+            connection (Connection): The player
+            room (Room): The room
+            color (int): WHITE or BLACK
+        """
+        connection.send('seat', {"room": room.room_id, "color": "wb"[color], "token": room.tokens[color]})
+        if self.store is not None:
+            self.store.addPlayer(room.room_id, color, f"{connection.address[0]}:{connection.address[1]}",
+                                 room.tokens[color])
+
+    def matchmake(self, connection, bucket) -> None:
+        """
+        Pair a connection with the longest waiting player of its bucket, or queue it
+
+        Args:
+            connection (Connection): The connection looking for a game
+            bucket (_hashable_): The matchmaking bucket, None for the default one
+        """
+        self.leaveRoom(connection)
+        try:
+            opponent = self.matchmaking.enqueue(connection, bucket)
+        except TypeError:
+            connection.send('error', f"Invalid bucket {bucket}")
+            return
+        if opponent is None:
+            connection.send('queued', len(self.matchmaking))
+            return
+        room = self.createRoom()
+        for player in (opponent, connection):
+            color = room.addPlayer(player)
+            player.room = room
+            player.send('join', room.room_id)
+            self.sendSeat(player, room, color)
+        self.log(f"[+] Room {room.room_id} matched {opponent.address} and {connection.address}")
+
+    def handleMove(self, connection, data) -> None:
+        """
+        Validate a move against the sender's room and broadcast it when accepted
+
+        Args:
+            connection (Connection): The sender
+            data (_list_): [[startRow, startCol], [endRow, endCol]], then the promotion letter for a promotion
+        """
+        room = connection.room
+        if room is None:
+            connection.send('error', "Not in a room")
+            return
+        start = time.perf_counter()
+        try:
+            if not isMove(data):
+                raise ChessRooms.MoveRejected("malformed move")
+            startSq, endSq, *promotion = data
+            promotion = promotion[0] if promotion else None
+            frame = room.applyMove(connection, tuple(startSq), tuple(endSq), promotion)
+        except (ChessRooms.MoveRejected, TypeError, ValueError, IndexError) as e:
+            self.stats.record(time.perf_counter() - start, False)
+            connection.send('error', f"Move rejected: {e}")
+            return
+        self.stats.record(time.perf_counter() - start, True)
+        room.broadcast(frame)
+        if self.store is not None:
+            self.store.appendMove(room.room_id, startSq, endSq, promotion)
+
+    def leaveRoom(self, connection, holdSeat=False) -> None:
+        """
+        Take a connection out of its room or the matchmaking queue, closing the room once nobody is left
+
+        Args:
+            connection (Connection): The connection leaving
+            holdSeat (bool): Hold a player's seat for the reconnect grace period, used when the connection dropped
+        """
+        self.matchmaking.remove(connection)
+        room = connection.room
+        if room is None:
+            return
+        color = room.removeConnection(connection, holdSeat)
+        connection.room = None
+        if color is not None:
+            self.loop.call_later(self.reconnectGrace, self.releaseSeat, room, color, room.tokens[color])
+        if room.isEmpty():
+            self.closeRoom(room)
+
+    def releaseSeat(self, room, color, token) -> None:
+        """
+        Free a held seat once the grace period is over, closing the room if nobody is left
+
+        Args:
+            room (Room): The room
+            color (int): WHITE or BLACK
+            token (str): The token the seat was held with
+        """
+        if room.releaseSeat(color, token) and room.isEmpty():
+            self.closeRoom(room)
+
+    def closeRoom(self, room) -> None:
+        """
+        Remove an empty room and free its number
+
+        Args:
+            room (Room): The room
+        """
+        if self.rooms.get(room.room_id) is room:
+            del self.rooms[room.room_id]
+            self.roomIds.release(room.room_id)
+            if self.store is not None:
+                self.store.finishGame(room.room_id, room.result())
+            self.log(f"[-] Room {room.room_id} closed")
+
+    def getStats(self) -> dict:
+        """
+        Get the room count, matchmaking queue length, move validation latency, estimated rooms per core and
+        legal move cache counters
+
+        Returns:
+            dict: See ChessRooms.RoomStats.snapshot, plus the number of players waiting for a match and the
+                legal move cache counters
+        """
+        stats = self.stats.snapshot(len(self.rooms))
+        stats["waiting"] = len(self.matchmaking)
+        stats["moveCache"] = ChessEngine.MOVE_CACHE.stats()
+        return stats
+
+
+class ConsoleObserver():
+    """
+    Prints server events, the observer used when running headless
+    """
+    def onServerMessage(self, text) -> None:
+        print_c.info(text)
+
+
+def raiseFileLimit() -> int:
+    """
+    Raise the open file limit to its hard maximum, each connection needs a descriptor
+
+    Returns:
+        int: The soft limit now in effect, -1 if it cannot be read on this platform
+    """
+    if resource is None:
+        return -1
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless chess server")
+    parser.add_argument("--host", default=SERVER_ADDRESS, help="address to bind")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="port to bind")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend of the rooms")
+    parser.add_argument("--slow-consumer", default=ChessRooms.SNAPSHOT, choices=ChessRooms.SLOW_CONSUMER_POLICIES,
+                        help="what to do with spectators that fall behind")
+    parser.add_argument("--max-backlog", type=int, default=ChessRooms.MAX_BACKLOG, help="unsent bytes before a connection counts as slow")
+    parser.add_argument("--reconnect-grace", type=float, default=RECONNECT_GRACE, help="seconds a dropped player's seat is held")
+    parser.add_argument("--store", metavar="DIRECTORY", help="persist games in this directory, see ChessStore")
+    args = parser.parse_args()
+    store = ChessStore.GameStore(args.store) if args.store else None
+    core = ServerCore(args.host, args.port, args.backend, args.slow_consumer, args.max_backlog, args.reconnect_grace, store)
+    core.addObserver(ConsoleObserver())
+    try:
+        core.run()
+    except KeyboardInterrupt:
+        pass
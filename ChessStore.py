@@ -0,0 +1,534 @@
+"""
+Append-only game store. Games are written to numbered segment files as length-prefixed, checksummed records with
+every move packed into 2 bytes. While a game is in progress its moves are journaled one record at a time; when it
+finishes the whole game is written as a GAME record and listed in a sidecar index by room, player and date. Moves that
+do not fit in the GAME record follow it as MOVES records, and the index entry spans them all. GAME records are read back through mmap, so a history query only touches the records it returns.
+
+Each new segment starts with a checkpoint of the games in progress, so recovery after a crash only replays the last
+segment. A torn record at the end of the log is detected by its checksum and cut off.
+
+    python3 ChessStore.py games --player 127.0.0.1:50312
+    python3 ChessStore.py games --bench 10000
+"""
+import argparse
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from Console import print_c
+
+SEGMENT_SIZE = 64 * 2 ** 20
+SEGMENT_NAME = "games-{:06d}.log"
+INDEX_NAME = "index.log"
+
+# Record kinds
+OPEN, PLAYER, MOVES, GAME = 1, 2, 3, 4
+
+# Game results
+UNFINISHED, WHITE_WINS, BLACK_WINS, DRAW = 0, 1, 2, 3
+
+HEADER = struct.Struct("!IBIH")  # crc32 of everything after it, kind, room, payload length
+OPEN_PAYLOAD = struct.Struct("!d")  # start time
+PLAYER_PAYLOAD = struct.Struct("!BB")  # color, token length, then the token and the name
+GAME_PAYLOAD = struct.Struct("!ddBBB")  # start time, end time, result, white name length, black name length
+INDEX_ENTRY = struct.Struct("!IIIIdBB")  # room, segment, offset, length, start time, white and black name lengths
+MAX_PAYLOAD = 0xFFFF
+PROMOTION_PIECES = "NBRQ"  # packed as index + 1 above the squares, 0 for no promotion
+
+
+def packMove(startSq, endSq, promotion=None) -> bytes:
+    """
+    Pack a move into 2 bytes
+
+    Args:
+        startSq (_tuple_): The start square (row, col)
+        endSq (_tuple_): The end square (row, col)
+        promotion (str, optional): The promotion piece letter, one of PROMOTION_PIECES
+
+    Returns:
+        bytes: start square | end square << 6 | promotion << 12, big endian
+    """
+    move = startSq[0] * 8 + startSq[1] | (endSq[0] * 8 + endSq[1]) << 6
+    if promotion:
+        move |= PROMOTION_PIECES.index(promotion) + 1 << 12
+    return move.to_bytes(2, "big")
+
+
+def unpackMoves(data) -> list:
+    """
+    Unpack moves packed by packMove
+
+    Args:
+        data (bytes): The packed moves
+
+    Returns:
+        _list_: ((startRow, startCol), (endRow, endCol), promotion) for each move, promotion is None or a letter
+            of PROMOTION_PIECES
+    """
+    moves = []
+    for i in range(0, len(data) - 1, 2):
+        move = data[i] << 8 | data[i + 1]
+        promotion = PROMOTION_PIECES[(move >> 12) - 1] if move >> 12 else None
+        moves.append((divmod(move & 63, 8), divmod(move >> 6 & 63, 8), promotion))
+    return moves
+
+
+def packName(name) -> bytes:
+    return name.encode("utf-8")[:255]
+
+
+class ActiveGame():
+    """
+    A game in progress, as far as the store knows it
+    """
+    __slots__ = ("room_id", "start", "players", "tokens", "moves")
+
+    def __init__(self, room_id, start) -> None:
+        self.room_id = room_id
+        self.start = start
+        self.players = ["", ""]
+        self.tokens = ["", ""]
+        self.moves = bytearray()
+
+
+class IndexEntry():
+    """
+    Where a finished game is stored
+    """
+    __slots__ = ("room_id", "segment", "offset", "length", "start", "white", "black")
+
+    def __init__(self, room_id, segment, offset, length, start, white, black) -> None:
+        self.room_id = room_id
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.start = start
+        self.white = white
+        self.black = black
+
+    @property
+    def date(self) -> str:
+        return time.strftime("%Y-%m-%d", time.gmtime(self.start))
+
+
+class GameRecord():
+    """
+    A finished game read back from the store
+    """
+    __slots__ = ("room_id", "start", "end", "result", "white", "black", "moves")
+
+    def __init__(self, room_id, start, end, result, white, black, moves) -> None:
+        self.room_id = room_id
+        self.start = start
+        self.end = end
+        self.result = result
+        self.white = white
+        self.black = black
+        self.moves = moves
+
+
+class GameStore():
+    """
+    Writes and reads games in one directory. Writes are buffered, call flush to push them to the operating system,
+    with durable=True every flush is also synced to disk.
+    """
+    def __init__(self, directory, segmentSize=SEGMENT_SIZE, durable=False) -> None:
+        """
+        Open the store, creating the directory if needed, and recover the games in progress
+
+        Args:
+            directory (str): The directory holding the segments and the index
+            segmentSize (int): Size in bytes after which a new segment is started
+            durable (bool): Whether flush also syncs the files to disk
+        """
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.durable = durable
+        self.active = {}
+        self.byRoom = {}
+        self.byPlayer = {}
+        self.byDate = {}
+        self.indexed = set()
+        self.maps = {}
+        os.makedirs(directory, exist_ok=True)
+        self.loadIndex()
+        self.index = open(os.path.join(directory, INDEX_NAME), "ab")
+        segments = self.segmentNumbers()
+        self.segment = segments[-1] if segments else 1
+        self.recover()
+        self.log = open(self.segmentPath(self.segment), "ab")
+        self.position = self.log.tell()
+        self.checkpointEnd = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def segmentPath(self, segment) -> str:
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+    def segmentNumbers(self) -> list:
+        """
+        Get the numbers of the segments on disk, in order
+        """
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith("games-") and name.endswith(".log"):
+                numbers.append(int(name[6:-4]))
+        return sorted(numbers)
+
+    # ----- writing
+
+    def writeRecord(self, kind, room_id, payload, checkpoint=True) -> int:
+        """
+        Append one record, starting a new segment first if this one is full
+
+        Args:
+            kind (int): OPEN, PLAYER, MOVES or GAME
+            room_id (int): The room number
+            payload (bytes): The record payload
+            checkpoint (bool): Whether a new segment starts with a checkpoint of the games in progress
+
+        Returns:
+            int: The offset of the record in the current segment
+        """
+        body = HEADER.pack(0, kind, room_id, len(payload))[4:] + payload
+        if checkpoint and self.position > self.checkpointEnd and self.position + len(body) + 4 > self.segmentSize:
+            self.rollSegment()
+        offset = self.position
+        self.log.write(zlib.crc32(body).to_bytes(4, "big"))
+        self.log.write(body)
+        self.position += len(body) + 4
+        return offset
+
+    def rollSegment(self) -> None:
+        """
+        Close the current segment and start the next one with a checkpoint of every game in progress
+        """
+        self.log.close()
+        self.segment += 1
+        self.log = open(self.segmentPath(self.segment), "ab")
+        self.position = 0
+        for game in self.active.values():
+            self.writeRecord(OPEN, game.room_id, OPEN_PAYLOAD.pack(game.start), False)
+            for color in (0, 1):
+                if game.players[color] or game.tokens[color]:
+                    self.writePlayer(game.room_id, color, game.players[color], game.tokens[color], False)
+            for start in range(0, len(game.moves), MAX_PAYLOAD - 1):
+                self.writeRecord(MOVES, game.room_id, bytes(game.moves[start:start + MAX_PAYLOAD - 1]), False)
+        self.checkpointEnd = self.position
+
+    def writePlayer(self, room_id, color, name, token, checkpoint=True) -> None:
+        token = token.encode("ascii")
+        self.writeRecord(PLAYER, room_id, PLAYER_PAYLOAD.pack(color, len(token)) + token + packName(name), checkpoint)
+
+    def openGame(self, room_id, start=None) -> None:
+        """
+        Record that a game started
+
+        Args:
+            room_id (int): The room number
+            start (float): The start time, now if None
+        """
+        game = ActiveGame(room_id, time.time() if start is None else start)
+        self.active[room_id] = game
+        self.writeRecord(OPEN, room_id, OPEN_PAYLOAD.pack(game.start))
+
+    def addPlayer(self, room_id, color, name, token="") -> None:
+        """
+        Record who sits on one side of a game
+
+        Args:
+            room_id (int): The room number
+            color (int): 0 for white, 1 for black
+            name (str): The player
+            token (str): The seat token, kept so a recovered room can still be rejoined
+        """
+        game = self.active.get(room_id)
+        if game is None:
+            return
+        game.players[color] = name
+        game.tokens[color] = token
+        self.writePlayer(room_id, color, name, token)
+
+    def appendMove(self, room_id, startSq, endSq, promotion=None) -> None:
+        """
+        Journal one move of a game in progress
+
+        Args:
+            room_id (int): The room number
+            startSq (_tuple_): The start square (row, col)
+            endSq (_tuple_): The end square (row, col)
+            promotion (str, optional): The promotion piece letter
+        """
+        game = self.active.get(room_id)
+        if game is None:
+            return
+        move = packMove(startSq, endSq, promotion)
+        self.writeRecord(MOVES, room_id, move)  # before updating the game, a checkpoint must not contain it twice
+        game.moves += move
+
+    def finishGame(self, room_id, result=UNFINISHED) -> IndexEntry:
+        """
+        Write a game as one GAME record and index it
+
+        Args:
+            room_id (int): The room number
+            result (int): UNFINISHED, WHITE_WINS, BLACK_WINS or DRAW
+
+        Returns:
+            IndexEntry: Where the game was stored, None if the game is not in progress
+        """
+        game = self.active.pop(room_id, None)
+        if game is None:
+            return None
+        white, black = packName(game.players[0]), packName(game.players[1])
+        first = MAX_PAYLOAD - GAME_PAYLOAD.size - len(white) - len(black)
+        first -= first % 2
+        payload = GAME_PAYLOAD.pack(game.start, time.time(), result, len(white), len(black)) + white + black
+        offset = self.writeRecord(GAME, room_id, payload + bytes(game.moves[:first]))
+        # the rest of the moves stay next to the GAME record, a new segment must not start between them
+        for start in range(first, len(game.moves), MAX_PAYLOAD - 1):
+            self.writeRecord(MOVES, room_id, bytes(game.moves[start:start + MAX_PAYLOAD - 1]), False)
+        entry = IndexEntry(room_id, self.segment, offset, self.position - offset, game.start,
+                           game.players[0], game.players[1])
+        self.writeIndex(entry)
+        return entry
+
+    def writeIndex(self, entry) -> None:
+        white, black = packName(entry.white), packName(entry.black)
+        self.index.write(INDEX_ENTRY.pack(entry.room_id, entry.segment, entry.offset, entry.length, entry.start,
+                                          len(white), len(black)) + white + black)
+        self.addToIndex(entry)
+
+    def flush(self) -> None:
+        """
+        Push buffered writes to the operating system, and to disk if the store is durable
+        """
+        self.log.flush()
+        self.index.flush()
+        if self.durable:
+            os.fsync(self.log.fileno())
+            os.fsync(self.index.fileno())
+
+    def close(self) -> None:
+        """
+        Flush and close the files, games in progress stay journaled for the next open
+        """
+        self.flush()
+        for segmentMap in self.maps.values():
+            segmentMap.close()
+        self.maps = {}
+        self.log.close()
+        self.index.close()
+
+    # ----- index
+
+    def addToIndex(self, entry) -> None:
+        self.indexed.add((entry.segment, entry.offset))
+        self.byRoom.setdefault(entry.room_id, []).append(entry)
+        for name in (entry.white, entry.black):
+            if name:
+                self.byPlayer.setdefault(name, []).append(entry)
+        self.byDate.setdefault(entry.date, []).append(entry)
+
+    def loadIndex(self) -> None:
+        """
+        Read the sidecar index, ignoring a torn entry at its end
+        """
+        path = os.path.join(self.directory, INDEX_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + INDEX_ENTRY.size <= len(data):
+            room_id, segment, recordOffset, length, start, whiteLength, blackLength = INDEX_ENTRY.unpack_from(data, offset)
+            end = offset + INDEX_ENTRY.size + whiteLength + blackLength
+            if end > len(data):
+                break
+            names = data[offset + INDEX_ENTRY.size:end]
+            white = names[:whiteLength].decode("utf-8", "replace")
+            black = names[whiteLength:].decode("utf-8", "replace")
+            self.addToIndex(IndexEntry(room_id, segment, recordOffset, length, start, white, black))
+            offset = end
+        if offset < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def roomNumbers(self) -> set:
+        """
+        Returns:
+            _set_: The room number of every stored game, finished or in progress
+        """
+        return self.byRoom.keys() | self.active.keys()
+
+    def findByRoom(self, room_id) -> list:
+        return self.byRoom.get(room_id, [])
+
+    def findByPlayer(self, name) -> list:
+        return self.byPlayer.get(name, [])
+
+    def findByDate(self, date) -> list:
+        """
+        Args:
+            date (str): UTC date as YYYY-MM-DD
+        """
+        return self.byDate.get(date, [])
+
+    # ----- reading
+
+    def mapSegment(self, segment, end) -> mmap.mmap:
+        """
+        Get a read-only map of a segment that covers at least the first end bytes
+
+        Args:
+            segment (int): The segment number
+            end (int): The number of bytes that must be mapped
+        """
+        segmentMap = self.maps.get(segment)
+        if segmentMap is None or len(segmentMap) < end:
+            if segment == self.segment:
+                self.log.flush()
+            if segmentMap is not None:
+                segmentMap.close()
+            with open(self.segmentPath(segment), "rb") as f:
+                segmentMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = segmentMap
+        return segmentMap
+
+    def readGame(self, entry) -> GameRecord:
+        """
+        Read a finished game
+
+        Args:
+            entry (IndexEntry): The game's index entry
+
+        Returns:
+            GameRecord: The game
+        """
+        segmentMap = self.mapSegment(entry.segment, entry.offset + entry.length)
+        kind, room_id, length = HEADER.unpack_from(segmentMap, entry.offset)[1:]
+        payload = segmentMap[entry.offset + HEADER.size:entry.offset + HEADER.size + length]
+        start, end, result, whiteLength, blackLength = GAME_PAYLOAD.unpack_from(payload)
+        names = GAME_PAYLOAD.size + whiteLength + blackLength
+        white = payload[GAME_PAYLOAD.size:GAME_PAYLOAD.size + whiteLength].decode("utf-8", "replace")
+        black = payload[GAME_PAYLOAD.size + whiteLength:names].decode("utf-8", "replace")
+        moves = [payload[names:]]
+        offset = entry.offset + HEADER.size + length
+        while offset < entry.offset + entry.length:
+            length = HEADER.unpack_from(segmentMap, offset)[3]
+            moves.append(segmentMap[offset + HEADER.size:offset + HEADER.size + length])
+            offset += HEADER.size + length
+        return GameRecord(room_id, start, end, result, white, black, unpackMoves(b"".join(moves)))
+
+    # ----- recovery
+
+    def recover(self) -> None:
+        """
+        Replay the last segment to rebuild the games in progress, cutting off a torn record at its end and indexing
+        GAME records the index missed, with the MOVES records that continue them
+        """
+        path = self.segmentPath(self.segment)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        missed = None
+        while offset + HEADER.size <= len(data):
+            crc, kind, room_id, length = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + length
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            payload = data[offset + HEADER.size:end]
+            if missed is not None and (kind != MOVES or room_id != missed.room_id):
+                self.writeIndex(missed)
+                missed = None
+            if kind == OPEN:
+                self.active[room_id] = ActiveGame(room_id, OPEN_PAYLOAD.unpack(payload)[0])
+            elif kind == PLAYER and room_id in self.active:
+                color, tokenLength = PLAYER_PAYLOAD.unpack_from(payload)
+                game = self.active[room_id]
+                game.tokens[color] = payload[PLAYER_PAYLOAD.size:PLAYER_PAYLOAD.size + tokenLength].decode("ascii")
+                game.players[color] = payload[PLAYER_PAYLOAD.size + tokenLength:].decode("utf-8", "replace")
+            elif kind == MOVES and room_id in self.active:
+                self.active[room_id].moves += payload
+            elif kind == MOVES and missed is not None:
+                missed.length += end - offset
+            elif kind == GAME:
+                game = self.active.pop(room_id, None)
+                if (self.segment, offset) not in self.indexed:
+                    start, _, _, whiteLength, blackLength = GAME_PAYLOAD.unpack_from(payload)
+                    white = payload[GAME_PAYLOAD.size:GAME_PAYLOAD.size + whiteLength].decode("utf-8", "replace")
+                    black = payload[GAME_PAYLOAD.size + whiteLength:GAME_PAYLOAD.size + whiteLength + blackLength]
+                    missed = IndexEntry(room_id, self.segment, offset, end - offset, start, white,
+                                        black.decode("utf-8", "replace"))
+            offset = end
+        if missed is not None:
+            self.writeIndex(missed)
+        if offset < len(data):
+            print_c.warning(f"Cut {len(data) - offset} torn bytes off {path}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+
+def benchmark(games, moves) -> None:
+    """
+    Time writing finished games to a temporary store
+
+    Args:
+        games (int): Number of games
+        moves (int): Moves per game
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        with GameStore(directory) as store:
+            start = time.perf_counter()
+            for room_id in range(games):
+                store.openGame(room_id)
+                store.addPlayer(room_id, 0, f"white{room_id % 100}")
+                store.addPlayer(room_id, 1, f"black{room_id % 100}")
+                for ply in range(moves):
+                    store.appendMove(room_id, (6, ply % 8), (4, ply % 8))
+                store.finishGame(room_id, DRAW)
+            store.flush()
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            read = sum(len(store.readGame(entry).moves) for entry in store.findByPlayer("white7"))
+            readSeconds = time.perf_counter() - start
+            size = sum(os.path.getsize(store.segmentPath(n)) for n in store.segmentNumbers())
+        print_c.info(f"{games} games of {moves} moves in {elapsed:.2f}s: {games / elapsed:.0f} games/sec, "
+                     f"{games * moves / elapsed:.0f} moves/sec, {size / games:.0f} bytes/game on disk")
+        print_c.info(f"Read {read} moves of one player's games in {readSeconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or benchmark a game store")
+    parser.add_argument("directory", nargs="?", default="games", help="the store directory")
+    parser.add_argument("--room", type=int, help="list the games of a room number")
+    parser.add_argument("--player", help="list the games of a player")
+    parser.add_argument("--date", help="list the games started on a UTC date, YYYY-MM-DD")
+    parser.add_argument("--bench", type=int, metavar="GAMES", help="time writing this many games to a temporary store")
+    parser.add_argument("--moves", type=int, default=80, help="moves per game for --bench")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench, args.moves)
+    else:
+        with GameStore(args.directory) as store:
+            if args.room is not None:
+                entries = store.findByRoom(args.room)
+            elif args.player is not None:
+                entries = store.findByPlayer(args.player)
+            elif args.date is not None:
+                entries = store.findByDate(args.date)
+            else:
+                entries = [entry for entries in store.byRoom.values() for entry in entries]
+            for entry in entries:
+                game = store.readGame(entry)
+                print(f"{entry.date} room {game.room_id} {game.white or '?'} - {game.black or '?'} "
+                      f"result {game.result} {len(game.moves)} moves")
+            print_c.info(f"{len(entries)} games, {len(store.active)} in progress")
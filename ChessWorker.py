@@ -0,0 +1,229 @@
+"""
+Background compute service for the game window. ChessMain hands positions to an EngineWorker, which answers on its
+own thread with legal moves or search results. The render loop drains the answers once per frame, so input and
+drawing never wait for the engine. cancel() drops every pending request and stops a running search; ChessMain calls
+it whenever the position changes under the engine, an undo included.
+
+The worker is a thread rather than a process, so the position travels as a GameState.clone with nothing to pickle.
+Its searcher is cooperative: it releases the GIL every few dozen nodes and between iterations, so a frame that wakes
+up during a search does not wait out the interpreter's 5 ms switch interval. The legal moves are generated
+with getValidMoveIDs, not through ChessEngine.MOVE_CACHE, which belongs to the main thread.
+
+    python3 ChessWorker.py --time 3      # frame times of a render loop while the engine thinks
+"""
+import argparse
+import queue
+import threading
+import time
+import ChessBitboard
+import ChessSearch
+from Console import print_c
+
+# Request kinds
+LEGAL_MOVES, SEARCH = "moves", "search"
+
+
+class EngineResult():
+    """
+    The answer to one request
+    """
+    def __init__(self, requestId, kind, key, value) -> None:
+        """
+        Initialize the result
+
+        Args:
+            requestId (int): The number submit returned for the request
+            kind (str): LEGAL_MOVES or SEARCH
+            key (int): The Zobrist key of the position answered, to check against the game's current one
+            value (_any_): The legal move IDs (_array_) or a ChessSearch.SearchResult
+        """
+        self.requestId = requestId
+        self.kind = kind
+        self.key = key
+        self.value = value
+
+
+class EngineWorker():
+    """
+    A worker thread with a request queue and a result queue. Requests are answered in order; those submitted
+    before the last cancel() are skipped, and their answers are never delivered.
+    """
+    def __init__(self, ttSizeBits=20) -> None:
+        """
+        Initialize the worker, start() runs it
+
+        Args:
+            ttSizeBits (int): The searcher's transposition table holds 2 ** ttSizeBits entries
+        """
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.searcher = ChessSearch.Searcher(ttSizeBits, cooperative=True)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.lastRequestId = 0
+        self.thread = None
+
+    def start(self) -> None:
+        """
+        Start the worker thread, if it is not running yet
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="EngineWorker", daemon=True)
+            self.thread.start()
+
+    def submit(self, kind, gs, timeLimit=1.0, maxDepth=64) -> int:
+        """
+        Queue a request. The position is cloned, so the game can move on at once.
+
+        Args:
+            kind (str): LEGAL_MOVES or SEARCH
+            gs (GameState): The position, any backend
+            timeLimit (float): Search budget in seconds, SEARCH only
+            maxDepth (int): Deepest search iteration, SEARCH only
+
+        Returns:
+            int: The request number, repeated in its EngineResult
+        """
+        self.lastRequestId += 1
+        self.requests.put((self.lastRequestId, self.generation, kind, gs.clone(), timeLimit, maxDepth))
+        return self.lastRequestId
+
+    def cancel(self) -> None:
+        """
+        Drop every request submitted so far, with the answers not polled yet, and stop the search in progress
+        """
+        with self.lock:
+            self.generation += 1
+            self.searcher.stop()
+            self.poll()
+
+    def poll(self) -> list:
+        """
+        Take the answers that are ready, without waiting
+
+        Returns:
+            _list_: EngineResult objects in the order they were answered
+        """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self, timeout=1.0) -> None:
+        """
+        Cancel everything and stop the worker thread
+
+        Args:
+            timeout (float): Seconds to wait for the thread to finish
+        """
+        self.cancel()
+        self.requests.put(None)
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self) -> None:
+        """
+        The worker thread: answer requests until close()
+        """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            requestId, generation, kind, gs, timeLimit, maxDepth = request
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                # a cancel() from here on sets a stop that the search keeps through prepare()
+                self.searcher.clearStop()
+            if kind == LEGAL_MOVES:
+                value = gs.getValidMoveIDs()
+            else:
+                value = self.searcher.search(gs, maxDepth, timeLimit,
+                                             lambda result: generation != self.generation and self.searcher.stop())
+            with self.lock:
+                if generation == self.generation:
+                    self.results.put(EngineResult(requestId, kind, gs.zobristKey, value))
+
+
+def renderFrame(gs) -> list:
+    """
+    Stand in for the work ChessMain does to draw a frame: copy the board and test for check
+
+    Args:
+        gs (GameState): The position drawn
+
+    Returns:
+        _list_: The board copy
+    """
+    board = [row[:] for row in gs.board]
+    gs.inCheck()
+    return board
+
+
+def frameTimes(gs, seconds, fps=15, worker=None, synchronous=False) -> list:
+    """
+    Run a render loop and time each frame, from its start to the next one's. A frame that had to wait for the
+    engine, to wake up or to finish drawing, runs over 1000 / fps milliseconds.
+
+    Args:
+        gs (GameState): The position drawn
+        seconds (float): How long the engine thinks
+        fps (int): Frames per second of the loop
+        worker (EngineWorker, optional): Thinks in the background for the whole run
+        synchronous (bool): Think in the loop instead, the way a blocking call would
+
+    Returns:
+        _list_: Milliseconds of each frame
+    """
+    times = []
+    if worker is not None:
+        worker.submit(SEARCH, gs, seconds)
+    end = time.perf_counter() + seconds
+    previous = time.perf_counter()
+    while previous < end:
+        renderFrame(gs)
+        if synchronous and not times:
+            ChessSearch.Searcher().search(gs, timeLimit=seconds)
+        if worker is not None:
+            worker.poll()
+        time.sleep(max(0.0, 1 / fps - (time.perf_counter() - previous)))
+        start = time.perf_counter()
+        times.append((start - previous) * 1000)
+        previous = start
+    return times
+
+
+def benchmark(seconds, backend="board") -> None:
+    """
+    Compare frame times with an idle engine, a background search and a search in the loop
+
+    Args:
+        seconds (float): How long each run lasts
+        backend (str): The name of the backend in ChessBitboard.BACKENDS
+    """
+    gs = ChessBitboard.BACKENDS[backend]()
+    worker = EngineWorker()
+    worker.start()
+    for name, times in (("idle", frameTimes(gs, seconds)),
+                        ("worker searching", frameTimes(gs, seconds, worker=worker)),
+                        ("search in the loop", frameTimes(gs, seconds, synchronous=True))):
+        times.sort()
+        print_c.info(f"{name}: {len(times)} frames, median {times[len(times) // 2]:.2f} ms, "
+                     f"95th percentile {times[int(len(times) * 0.95)]:.2f} ms, worst {times[-1]:.2f} ms")
+    start = time.perf_counter()
+    worker.submit(SEARCH, gs, 30.0)
+    time.sleep(0.2)
+    worker.cancel()
+    worker.close(5.0)
+    print_c.info(f"Cancelled a 30 s search, the worker stopped {time.perf_counter() - start - 0.2:.3f} s after cancel()")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frame times of a render loop with the engine thinking in the background")
+    parser.add_argument("--time", type=float, default=3.0, help="seconds of each run")
+    parser.add_argument("--backend", default="board", choices=sorted(ChessBitboard.BACKENDS), help="GameState backend")
+    args = parser.parse_args()
+    benchmark(args.time, args.backend)